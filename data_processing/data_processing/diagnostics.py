@@ -0,0 +1,204 @@
+import logging
+from multiprocessing.util import Finalize
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple
+
+# The width of matplotlib's default figure, at which the plots are saved
+PLOT_WIDTH_PX = 640
+
+
+def decimate_series(
+    x: np.ndarray, y: np.ndarray, width: int = PLOT_WIDTH_PX
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduces a series sorted by x to the minimum and maximum y of each of width equal bins of x,
+    which draws the same line at a plot width of width pixels.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= 2 * width:
+        return x, y
+
+    bins = np.minimum(((x - x[0]) / (x[-1] - x[0]) * width).astype(np.int64), width - 1)
+
+    # Sort by bin then y, so that the first and last of each bin are its minimum and maximum
+    order = np.lexsort((y, bins))
+    starts = np.flatnonzero(np.diff(bins[order], prepend=-1))
+    ends = np.append(starts[1:], len(order)) - 1
+    keep = np.unique(np.concatenate([order[starts], order[ends]]))
+
+    return x[keep], y[keep]
+
+
+def plot_spline(
+    output_path: Path,
+    times: np.ndarray,
+    diameters: np.ndarray,
+    spline_times: np.ndarray,
+    spline_diameters: np.ndarray,
+):
+    """
+    Plots a pupil spline over the discrete samples that it was fitted to.
+    """
+    import matplotlib.pyplot as plt
+
+    plt.clf()
+    plt.plot(spline_times, spline_diameters, "o", label="spline")
+    plt.plot(times, diameters, "k", label="discrete")
+    plt.title("Smoothed Pupil Function")
+    plt.savefig(output_path)
+
+
+def plot_confusion_matrix(output_path: Path, matrix: np.ndarray, classes: List[str]):
+    """
+    Plots a confusion matrix.
+    """
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import ConfusionMatrixDisplay
+
+    plt.clf()
+    disp = ConfusionMatrixDisplay(matrix, display_labels=classes)
+    disp.plot(ax=plt.gca())
+    plt.title("Confusion Matrix")
+    plt.savefig(output_path)
+
+
+def render_plots(jobs: BinaryIO):
+    """
+    Renders the pickled plot jobs from the stream with a non-interactive backend until it
+    gets None or the stream ends.
+    The jobs draw on the same figure, which they clear first.
+    An error in one plot is logged and does not stop the others.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg", force=True)
+    while True:
+        try:
+            job = pickle.load(jobs)
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        plot_function, args = job
+        try:
+            plot_function(*args)
+        except Exception:
+            logging.exception("Error rendering %s", args[0])
+
+
+class PlotRenderer:
+    """
+    Renders plots in a background process, so that plotting is not on the critical path.
+    The plot functions and their arguments are pickled to the stdin of the process by a
+    feeder thread, so submitting a plot does not wait for the process to read it.
+    The process runs this module rather than being forked or spawned by multiprocessing:
+    a fork cannot safely inherit the callers' threads (e.g. TensorFlow's thread pools), and
+    a spawned process would import the callers' main module, and with it TensorFlow.
+    """
+
+    def __init__(self):
+        # Make the package importable by the process, even if it is not installed
+        env = dict(os.environ)
+        package_dir = str(Path(__file__).resolve().parents[1])
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_dir, env.get("PYTHONPATH")]))
+
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "data_processing.diagnostics"],
+            stdin=subprocess.PIPE,
+            env=env,
+        )
+        self.jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self.feeder = threading.Thread(target=self.feed, daemon=True)
+        self.feeder.start()
+
+    def feed(self):
+        """
+        Writes the queued jobs to the process until it gets None or the process stops reading.
+        A job that cannot be pickled is logged and skipped.
+        """
+        try:
+            while (job := self.jobs.get()) is not None:
+                try:
+                    data = pickle.dumps(job)
+                except Exception:
+                    logging.exception("Error sending %s to the plot renderer", job[1][0])
+                    continue
+
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+        except OSError:
+            # The process failed, which close reports
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def submit(self, plot_function: Callable[..., Any], output_path: Path, *args):
+        """
+        Queues a plot job, which calls plot_function(output_path, *args) in the background.
+        """
+        self.jobs.put((plot_function, (output_path, *args)))
+
+    def close(self):
+        """
+        Waits for the queued plots to be rendered and stops the process.
+        """
+        if self.process is not None:
+            self.jobs.put(None)
+            self.feeder.join()
+            self.process.wait()
+
+            if self.process.returncode != 0:
+                logging.error(
+                    "The plot renderer exited with code %d", self.process.returncode
+                )
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# The plot renderer of the current process
+_renderer: Optional[PlotRenderer] = None
+
+
+def get_plot_renderer() -> PlotRenderer:
+    """
+    Returns the plot renderer of the current process, starting it the first time.
+    Unless it is closed before, it is closed when the process exits, after the queued
+    plots are rendered.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = PlotRenderer()
+        Finalize(None, close_plot_renderer, exitpriority=20)
+
+    return _renderer
+
+
+def close_plot_renderer():
+    """
+    Waits for the plots queued by the current process to be rendered.
+    """
+    global _renderer
+    if _renderer is not None:
+        _renderer.close()
+        _renderer = None
+
+
+if __name__ == "__main__":
+    render_plots(sys.stdin.buffer)
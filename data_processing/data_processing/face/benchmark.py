@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import argparse
+import cv2
+import numpy as np
+from pathlib import Path
+import tempfile
+import time
+from typing import List, Optional
+
+from data_processing.face.crop import FaceCropper, FaceTracker
+from data_processing.face.video_to_images import extract_frames, iter_frames
+
+
+def box_iou(box_a: np.ndarray, box_b: np.ndarray) -> float:
+    """
+    Returns the intersection over union of two (x, y, w, h) boxes.
+    """
+    x_a, y_a, w_a, h_a = box_a
+    x_b, y_b, w_b, h_b = box_b
+    x_overlap = max(0, min(x_a + w_a, x_b + w_b) - max(x_a, x_b))
+    y_overlap = max(0, min(y_a + h_a, y_b + h_b) - max(y_a, y_b))
+    intersection = x_overlap * y_overlap
+    return intersection / (w_a * h_a + w_b * h_b - intersection)
+
+
+def compare_detections(
+    name: str, reference: List[Optional[np.ndarray]], faces: List[Optional[np.ndarray]]
+):
+    """
+    Prints how well the detected faces agree with the reference (per-frame) detections.
+    """
+    ious = [
+        box_iou(ref_face, face)
+        for ref_face, face in zip(reference, faces)
+        if ref_face is not None and face is not None
+    ]
+    mismatches = sum(
+        (ref_face is None) != (face is None) for ref_face, face in zip(reference, faces)
+    )
+    print(
+        f"{name}: mean IoU {np.mean(ious) if ious else float('nan'):.3f}, "
+        f"{sum(iou >= 0.9 for iou in ious)}/{len(ious)} crops with IoU >= 0.9, "
+        f"{mismatches} frames where only one found a face"
+    )
+
+
+def time_detections(detect, gray_frames: List[np.ndarray]):
+    """
+    Runs the detect function on every frame and returns the faces and elapsed time.
+    """
+    start = time.perf_counter()
+    faces = [detect(gray_frame) for gray_frame in gray_frames]
+    return faces, time.perf_counter() - start
+
+
+def benchmark_extract_frames(video: Path, rate: int, repeats: int = 1):
+    """
+    Times the seek-per-frame and sequential frame extraction paths on the same video.
+    """
+    for sequential in (False, True):
+        name = "sequential" if sequential else "seek-per-frame"
+        elapsed = []
+        for _ in range(repeats):
+            with tempfile.TemporaryDirectory() as image_dir:
+                start = time.perf_counter()
+                image_paths = extract_frames(video, rate, Path(image_dir), sequential)
+                elapsed.append(time.perf_counter() - start)
+
+        best = min(elapsed)
+        print(
+            f"{name}: {len(image_paths)} frames in {best:.2f}s "
+            f"({len(image_paths) / best:.1f} frames/s)"
+        )
+
+
+def benchmark_tracking(video: Path, rate: int, redetect_interval: int = 10):
+    """
+    Compares the detection time and crops of the face tracker against per-frame detection.
+    """
+    gray_frames = [
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for _, frame in iter_frames(video, rate)
+    ]
+
+    face_cropper = FaceCropper()
+    face_tracker = FaceTracker(face_cropper, redetect_interval=redetect_interval)
+
+    reference, reference_time = time_detections(face_cropper.detect, gray_frames)
+    tracked, tracked_time = time_detections(face_tracker.detect, gray_frames)
+
+    print(
+        f"per-frame: {len(gray_frames)} frames in {reference_time:.2f}s "
+        f"({1000 * reference_time / len(gray_frames):.1f}ms/frame)"
+    )
+    print(
+        f"tracking: {len(gray_frames)} frames in {tracked_time:.2f}s "
+        f"({1000 * tracked_time / len(gray_frames):.1f}ms/frame, "
+        f"{reference_time / tracked_time:.1f}x faster)"
+    )
+    compare_detections("tracking", reference, tracked)
+
+
+def benchmark_downscaling(video: Path, rate: int, detection_scale: float = 0.25):
+    """
+    Compares the detection time and crops of downscaled detection against full-resolution detection.
+    """
+    gray_frames = [
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for _, frame in iter_frames(video, rate)
+    ]
+
+    face_cropper = FaceCropper()
+    downscaled_cropper = FaceCropper(detection_scale)
+
+    reference, reference_time = time_detections(face_cropper.detect, gray_frames)
+    downscaled, downscaled_time = time_detections(downscaled_cropper.detect, gray_frames)
+
+    print(
+        f"full resolution: {len(gray_frames)} frames in {reference_time:.2f}s "
+        f"({1000 * reference_time / len(gray_frames):.1f}ms/frame)"
+    )
+    print(
+        f"scale {detection_scale}: {len(gray_frames)} frames in {downscaled_time:.2f}s "
+        f"({1000 * downscaled_time / len(gray_frames):.1f}ms/frame, "
+        f"{reference_time / downscaled_time:.1f}x faster)"
+    )
+    compare_detections(f"scale {detection_scale}", reference, downscaled)
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the face processing steps.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    extract_parser = subparsers.add_parser(
+        "extract", help="Compare the frame extraction modes."
+    )
+    extract_parser.add_argument("video", type=Path, help="Video to extract frames from.")
+    extract_parser.add_argument(
+        "-r", "--rate", type=int, default=1, help="Frames per second to extract."
+    )
+    extract_parser.add_argument(
+        "-n", "--repeats", type=int, default=1, help="Number of times to run each mode."
+    )
+
+    track_parser = subparsers.add_parser(
+        "track", help="Compare face tracking against per-frame detection."
+    )
+    track_parser.add_argument("video", type=Path, help="Video to crop the faces of.")
+    track_parser.add_argument(
+        "-r", "--rate", type=int, default=1, help="Frames per second to extract."
+    )
+    track_parser.add_argument(
+        "-i",
+        "--redetect-interval",
+        type=int,
+        default=10,
+        help="Number of tracked frames between full-frame detections.",
+    )
+
+    downscale_parser = subparsers.add_parser(
+        "downscale", help="Compare downscaled detection against full-resolution detection."
+    )
+    downscale_parser.add_argument("video", type=Path, help="Video to crop the faces of.")
+    downscale_parser.add_argument(
+        "-r", "--rate", type=int, default=1, help="Frames per second to extract."
+    )
+    downscale_parser.add_argument(
+        "-d",
+        "--detection-scale",
+        type=float,
+        default=0.25,
+        help="Scale of the downscaled copy used to detect faces.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.benchmark == "extract":
+        benchmark_extract_frames(args.video, args.rate, args.repeats)
+    elif args.benchmark == "track":
+        benchmark_tracking(args.video, args.rate, args.redetect_interval)
+    elif args.benchmark == "downscale":
+        benchmark_downscaling(args.video, args.rate, args.detection_scale)
@@ -1,19 +1,234 @@
 import cv2
+import numpy as np
 from pathlib import Path
+import threading
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 
-def crop(image_path: Path, output_dir: Path):
-    img = cv2.imread(str(image_path))
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+HAAR_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+MIN_FACE_SIZE = (150, 150)
 
-    face_classifier = cv2.CascadeClassifier(
-        cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    )
 
-    face = face_classifier.detectMultiScale(gray_img, 1.1, 5, minSize=(150, 150))
+class FaceCropper:
+    """
+    Crops faces using a Haar cascade classifier that is only loaded once.
+    The classifier is not thread-safe, so each worker thread or process should
+    use its own instance (see get_face_cropper).
+    If detection_scale is below 1, faces are detected on a downscaled copy of the image
+    and their boxes are mapped back to crop the full-resolution image.
+    """
 
-    if len(face) > 0:
-        x, y, w, h = face[0]
-        cropped_img = gray_img[y:y+h, x:x+w]
+    def __init__(
+        self,
+        detection_scale: float = 1.0,
+        face_classifier: Optional[cv2.CascadeClassifier] = None,
+    ):
+        if face_classifier is None:
+            face_classifier = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
 
-        output_image_path = image_path.stem + "_c" + image_path.suffix
-        cv2.imwrite(str(output_dir / output_image_path), cropped_img)
+        self.face_classifier = face_classifier
+        self.detection_scale = detection_scale
+
+    def detect(
+        self,
+        gray_img: np.ndarray,
+        min_size: Tuple[int, int] = MIN_FACE_SIZE,
+        max_size: Tuple[int, int] = (0, 0),
+    ) -> Optional[np.ndarray]:
+        """
+        Detects the first face in a grayscale image.
+        Returns its (x, y, w, h) box, or None if no face was found.
+        """
+        scale = self.detection_scale
+        if scale != 1:
+            gray_img = cv2.resize(
+                gray_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+            min_size = tuple(int(size * scale) for size in min_size)
+            max_size = tuple(int(size * scale) for size in max_size)
+
+        face = self.face_classifier.detectMultiScale(
+            gray_img, 1.1, 5, minSize=min_size, maxSize=max_size
+        )
+
+        if len(face) > 0:
+            if scale != 1:
+                return np.round(face[0] / scale).astype(face.dtype)
+            return face[0]
+
+        return None
+
+    def crop_frame(self, img: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Crops the first face found in a BGR image.
+        Returns the grayscale face, or None if no face was found.
+        """
+        return self.crop_gray(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+
+    def crop_gray(self, gray_img: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Crops the first face found in a grayscale image.
+        Returns the face, or None if no face was found.
+        """
+        face = self.detect(gray_img)
+
+        if face is not None:
+            x, y, w, h = face
+            return gray_img[y:y+h, x:x+w]
+
+        return None
+
+    def crop_many(
+        self, images: Iterable[Union[Path, np.ndarray]]
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Crops a batch of images, given either as paths or as BGR arrays.
+        Returns the grayscale face of each image, or None where no face was found.
+        """
+        cropped_imgs = []
+        for image in images:
+            if isinstance(image, np.ndarray):
+                cropped_imgs.append(self.crop_frame(image))
+            else:
+                cropped_imgs.append(self.crop_gray(self.read_gray(image)))
+
+        return cropped_imgs
+
+    def read_gray(self, image_path: Path) -> np.ndarray:
+        """
+        Reads an image file in grayscale.
+        When detecting on a downscaled copy, the image is decoded directly to grayscale
+        instead of being decoded in colour and converted.
+        """
+        if self.detection_scale != 1:
+            return cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+
+        return cv2.cvtColor(cv2.imread(str(image_path)), cv2.COLOR_BGR2GRAY)
+
+    def crop(self, image_path: Path, output_dir: Path) -> Optional[Path]:
+        """
+        Crops an image file and writes the face to the output directory with a '_c' suffix.
+        Returns the path to the cropped image, or None if no face was found.
+        """
+        cropped_img = self.crop_gray(self.read_gray(image_path))
+
+        if cropped_img is not None:
+            output_image_path = output_dir / (image_path.stem + "_c" + image_path.suffix)
+            cv2.imwrite(str(output_image_path), cropped_img)
+            return output_image_path
+
+        return None
+
+
+_local = threading.local()
+
+
+def get_face_cropper(detection_scale: float = 1.0) -> FaceCropper:
+    """
+    Returns the FaceCropper of the current thread, creating it on first use.
+    """
+    if not hasattr(_local, "face_croppers"):
+        _local.face_croppers = {}
+
+    if detection_scale not in _local.face_croppers:
+        _local.face_croppers[detection_scale] = FaceCropper(detection_scale)
+
+    return _local.face_croppers[detection_scale]
+
+
+class FaceTracker(FaceCropper):
+    """
+    Crops the faces in consecutive frames of the same video.
+    Only an expanded region around the previous face is searched, for faces of a similar
+    size. A full-frame detection is used for the first frame, when the face is lost,
+    and every redetect_interval frames. A new tracker should be used for each video.
+    """
+
+    def __init__(
+        self,
+        face_cropper: Optional[FaceCropper] = None,
+        margin: float = 0.5,
+        size_tolerance: float = 0.25,
+        redetect_interval: int = 10,
+    ):
+        # Share the classifier of the worker's FaceCropper instead of loading another one
+        if face_cropper is None:
+            face_cropper = get_face_cropper()
+
+        super().__init__(face_cropper.detection_scale, face_cropper.face_classifier)
+        self.margin = margin
+        self.size_tolerance = size_tolerance
+        self.redetect_interval = redetect_interval
+        self.face = None
+        self.frames_since_detection = 0
+
+    def detect(
+        self,
+        gray_img: np.ndarray,
+        min_size: Tuple[int, int] = MIN_FACE_SIZE,
+        max_size: Tuple[int, int] = (0, 0),
+    ) -> Optional[np.ndarray]:
+        """
+        Detects the first face in a grayscale image, starting from the previous face.
+        The size around the previous face is kept within min_size and max_size.
+        Returns its (x, y, w, h) box, or None if no face was found.
+        """
+        face = None
+
+        # Search the region around the previous face
+        if self.face is not None and self.frames_since_detection < self.redetect_interval:
+            x, y, w, h = self.face
+            x_margin, y_margin = int(w * self.margin), int(h * self.margin)
+            x_start, y_start = max(x - x_margin, 0), max(y - y_margin, 0)
+            x_end = min(x + w + x_margin, gray_img.shape[1])
+            y_end = min(y + h + y_margin, gray_img.shape[0])
+
+            min_side = max(int(w * (1 - self.size_tolerance)), min_size[0])
+            max_side = int(w * (1 + self.size_tolerance))
+            if max_size[0] > 0:
+                max_side = min(max_side, max_size[0])
+
+            face = super().detect(
+                gray_img[y_start:y_end, x_start:x_end],
+                (min_side, min_side),
+                (max_side, max_side),
+            )
+            if face is not None:
+                face = face + np.array([x_start, y_start, 0, 0], dtype=face.dtype)
+                self.frames_since_detection += 1
+
+        # Fall back to the full frame
+        if face is None:
+            face = super().detect(gray_img, min_size, max_size)
+            self.frames_since_detection = 0
+
+        self.face = face
+        return face
+
+
+def crop_frame(img: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Crops the first face found in a BGR image.
+    Returns the grayscale face, or None if no face was found.
+    """
+    return get_face_cropper().crop_frame(img)
+
+
+def iter_cropped_frames(
+    frames: Iterable[Tuple[float, np.ndarray]],
+    face_cropper: Optional[FaceCropper] = None,
+) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Crops a stream of (time, BGR frame) tuples, such as the one from iter_frames.
+    Yields a (time, grayscale face) tuple for each frame where a face was found.
+    """
+    if face_cropper is None:
+        face_cropper = get_face_cropper()
+
+    for time, frame in frames:
+        cropped_img = face_cropper.crop_frame(frame)
+        if cropped_img is not None:
+            yield time, cropped_img
+
+
+def crop(image_path: Path, output_dir: Path) -> Optional[Path]:
+    return get_face_cropper().crop(image_path, output_dir)
@@ -0,0 +1,150 @@
+import numpy as np
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple, Union
+
+FRAME_STACK_DATA_FORMAT = "{}_frames.dat"
+FRAME_STACK_INDEX_FORMAT = "{}_frames_index.npy"
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("time", np.float64),
+        ("offset", np.int64),
+        ("height", np.int32),
+        ("width", np.int32),
+        ("channels", np.int32),
+    ]
+)
+
+
+def frame_stack_paths(stack_dir: Path, name: str) -> Tuple[Path, Path]:
+    """
+    Returns the data and index paths of the named frame stack in the directory.
+    """
+    return (
+        stack_dir / FRAME_STACK_DATA_FORMAT.format(name),
+        stack_dir / FRAME_STACK_INDEX_FORMAT.format(name),
+    )
+
+
+def list_frame_stacks(stack_dir: Path) -> List[str]:
+    """
+    Returns the names of the frame stacks in the directory.
+    """
+    suffix = FRAME_STACK_INDEX_FORMAT.format("")
+    return sorted(
+        file[: -len(suffix)] for file in os.listdir(stack_dir) if file.endswith(suffix)
+    )
+
+
+class FrameStackWriter:
+    """
+    Writes the frames of a video to a single file instead of one image per frame.
+    The pixels of every frame are appended to a raw uint8 data file, and a timestamp index
+    with the offset and shape of each frame is written when the writer is closed.
+    """
+
+    def __init__(self, stack_dir: Path, name: str):
+        self.data_path, self.index_path = frame_stack_paths(stack_dir, name)
+        os.makedirs(stack_dir, exist_ok=True)
+
+        self.data_file = open(self.data_path, "wb")
+        self.index: List[Tuple[float, int, int, int, int]] = []
+        self.offset = 0
+
+    def append(self, time: float, frame: np.ndarray):
+        """
+        Appends a grayscale (height, width) or colour (height, width, channels) frame.
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        channels = frame.shape[2] if frame.ndim == 3 else 0
+
+        self.data_file.write(frame.tobytes())
+        self.index.append((time, self.offset, frame.shape[0], frame.shape[1], channels))
+        self.offset += frame.nbytes
+
+    def close(self):
+        self.data_file.close()
+        np.save(self.index_path, np.array(self.index, dtype=INDEX_DTYPE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_frame_stack(
+    stack_dir: Path, name: str, frames: Iterable[Tuple[float, np.ndarray]]
+) -> Path:
+    """
+    Writes a stream of (time, frame) tuples to a frame stack.
+    Returns the path to the index of the stack.
+    """
+    with FrameStackWriter(stack_dir, name) as writer:
+        for time, frame in frames:
+            writer.append(time, frame)
+
+    return writer.index_path
+
+
+class FrameStack:
+    """
+    Reads a frame stack written by FrameStackWriter.
+    The data file is memory-mapped, so frames are only read from disk when they are accessed.
+    """
+
+    def __init__(self, stack_dir: Path, name: str):
+        self.name = name
+        data_path, index_path = frame_stack_paths(stack_dir, name)
+
+        self.index = np.load(index_path)
+        self.times = self.index["time"]
+        self.data = (
+            np.memmap(data_path, dtype=np.uint8, mode="r")
+            if os.path.getsize(data_path) > 0
+            else np.empty(0, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        _, offset, height, width, channels = self.index[i]
+        shape = (height, width, channels) if channels else (height, width)
+        return self.data[offset : offset + np.prod(shape)].reshape(shape)
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray]]:
+        for i in range(len(self)):
+            yield self.times[i], self[i]
+
+    def find(self, time: float) -> int:
+        """
+        Returns the index of the frame at the specified time, or -1 if there is none.
+        """
+        i = np.searchsorted(self.times, time)
+        if i < len(self) and np.isclose(self.times[i], time):
+            return int(i)
+
+        return -1
+
+    def at_time(self, time: float) -> np.ndarray:
+        """
+        Returns the frame at the specified time.
+        """
+        i = self.find(time)
+        if i < 0:
+            raise KeyError(f"No frame at time {time} in {self.name}")
+
+        return self[i]
+
+    def subset(
+        self, stack_dir: Path, name: str, times: Union[Iterable[float], np.ndarray]
+    ) -> Path:
+        """
+        Writes the frames at the specified times to a new frame stack.
+        Returns the path to the index of the new stack.
+        """
+        return write_frame_stack(
+            stack_dir, name, ((time, self.at_time(time)) for time in sorted(times))
+        )
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import argparse
+import cv2
+import json
+import numpy as np
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from data_processing.face.frame_stack import FrameStack
+from data_processing.face.sample_index import dataset_identity, load_sample_index, SampleIndex
+
+IMAGE_STORE_FORMAT = "image_store_{}x{}.npy"
+IMAGE_STORE_INFO_FORMAT = "image_store_{}x{}.json"
+
+
+def image_store_paths(dataset_dir: Path, image_size: Tuple[int, int]) -> Tuple[Path, Path]:
+    """
+    Returns the images and info paths of the image store of the dataset for the image size.
+    """
+    return (
+        dataset_dir / IMAGE_STORE_FORMAT.format(*image_size),
+        dataset_dir / IMAGE_STORE_INFO_FORMAT.format(*image_size),
+    )
+
+
+def resize_image(image: np.ndarray, image_size: Tuple[int, int]) -> np.ndarray:
+    """
+    Converts an image to grayscale and resizes it to image_size (height, width).
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    return cv2.resize(image, image_size[::-1], interpolation=cv2.INTER_LINEAR)
+
+
+def read_image(path: Path) -> np.ndarray:
+    """
+    Reads an image file as grayscale.
+    """
+    image = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise FileNotFoundError(path)
+
+    return image
+
+
+def write_image_store(
+    samples: SampleIndex, image_size: Tuple[int, int], identity: Dict[str, Dict[str, int]]
+):
+    """
+    Resizes the image of every sample of the index, in the order of the index, into a
+    (samples, height, width, 1) uint8 array.
+    The info file, with the identity of the dataset, is written last, so that an interrupted
+    write is not used.
+    """
+    images_path, info_path = image_store_paths(samples.dataset_dir, image_size)
+    if info_path.is_file():
+        os.remove(info_path)
+
+    images = np.lib.format.open_memmap(
+        images_path, "w+", np.uint8, (len(samples), *image_size, 1)
+    )
+    start = 0
+    for label, inits, emotion, segment in samples.segments():
+        end = start + len(segment)
+        if segment.stacks[0]:
+            stack = FrameStack(samples.dataset_dir / label, f"{inits}_{emotion}")
+            frames = (stack.at_time(time) for time in segment.times)
+        else:
+            frames = (read_image(path) for path in segment.image_paths())
+
+        for i, frame in enumerate(frames, start):
+            images[i, ..., 0] = resize_image(frame, image_size)
+        start = end
+
+    images.flush()
+    with open(info_path, "w") as f:
+        json.dump({"identity": identity, "image_size": list(image_size)}, f)
+
+
+class ImageStore:
+    """
+    Reads an image store written by write_image_store.
+    The images are memory-mapped, and row i is the image of sample i of the sample index.
+    """
+
+    def __init__(self, samples: SampleIndex, image_size: Tuple[int, int]):
+        images_path, _ = image_store_paths(samples.dataset_dir, image_size)
+        self.samples = samples
+        self.images = np.load(images_path, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+
+def load_image_store(
+    dataset_dir: Path, image_size: Tuple[int, int], samples: Optional[SampleIndex] = None
+) -> ImageStore:
+    """
+    Opens the image store of the dataset directory for the image size, building it first if
+    there is none or if the dataset changed since it was built.
+    """
+    identity = dataset_identity(dataset_dir)
+    if samples is None:
+        samples = load_sample_index(dataset_dir)
+
+    _, info_path = image_store_paths(dataset_dir, image_size)
+    try:
+        with open(info_path, "r") as f:
+            up_to_date = json.load(f)["identity"] == identity
+    except FileNotFoundError:
+        up_to_date = False
+
+    if not up_to_date:
+        write_image_store(samples, image_size, identity)
+
+    return ImageStore(samples, image_size)
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Build the image stores of the face dataset directories."
+    )
+    parser.add_argument(
+        "dataset_dirs",
+        type=Path,
+        nargs="+",
+        help="Dataset directories (e.g. output_path/train), with one directory per label.",
+    )
+    parser.add_argument(
+        "-s",
+        "--image-size",
+        type=int,
+        nargs=2,
+        default=(224, 224),
+        metavar=("HEIGHT", "WIDTH"),
+        help="Size the images are resized to, which is the input shape of the face model.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for dataset_dir in args.dataset_dirs:
+        image_store = load_image_store(dataset_dir, tuple(args.image_size))
+        print(f"{dataset_dir}: {len(image_store)} images")
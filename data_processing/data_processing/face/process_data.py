@@ -1,20 +1,38 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import csv
+import cv2
+from functools import partial
 import logging
 import os
 from pathlib import Path
 import re
 import shutil
 from sklearn.model_selection import train_test_split
+from typing import Any, Callable, Dict, List, Tuple
 
-from data_processing.face.crop import crop
+from data_processing.face.crop import FaceTracker, get_face_cropper, iter_cropped_frames
 from data_processing.face.crop_ui import run_image_cropper_with_image
-from data_processing.face.video_to_images import extract_frames
+from data_processing.face.frame_stack import (
+    FrameStack,
+    FrameStackWriter,
+    frame_stack_paths,
+    list_frame_stacks,
+    write_frame_stack,
+)
+from data_processing.face.video_to_images import extract_frames, iter_frames
+from data_processing.manifest import Manifest, MANIFEST_FILE
 
 RATE = 1
 TIMES_FILE_FORMAT = "times_{}_{}.csv"
+IMAGE_FORMATS = (".png", ".jpg", ".jpeg")
+STORAGE_FORMATS = ("png", "stack")
+COPY_MODES = ("copy", "link", "parallel")
+COPY_WORKERS = 8
+CROPPED_TIME_PATTERN = re.compile(r".+_(?P<time>\d+.\d+)_c.(png|jpg)")
+CROP_MANIFEST_SAVE_INTERVAL = 100
 
 BINARY_EMOTIONS = {
     "anger": "negative",
@@ -36,6 +54,45 @@ MULTICLASS_EMOTIONS = {
 }
 
 
+def transfer_file(source_path: Path, destination_path: Path, copy_mode: str):
+    """
+    Copies a file to the destination, replacing any existing file.
+    In 'link' mode, the file is hard linked instead, falling back to a symbolic link
+    when a hard link is not possible (e.g. the destination is on another device).
+    """
+    # Remove the old file first, so that a link to the source is never written through
+    if os.path.lexists(destination_path):
+        os.remove(destination_path)
+
+    if copy_mode == "link":
+        try:
+            os.link(source_path, destination_path)
+        except OSError:
+            os.symlink(os.path.abspath(source_path), destination_path)
+    else:
+        shutil.copy(source_path, destination_path)
+
+
+def transfer_files(
+    filenames: List[str], source_dir: Path, dest_dir: Path, copy_mode: str = "copy"
+):
+    """
+    Copies or links the files from the source directory to the destination directory.
+    In 'parallel' mode, the files are copied by a pool of threads.
+    """
+    transfer = partial(transfer_file, copy_mode=copy_mode)
+    source_paths = [source_dir / filename for filename in filenames]
+    dest_paths = [dest_dir / filename for filename in filenames]
+
+    if copy_mode == "parallel":
+        with ThreadPoolExecutor(COPY_WORKERS) as executor:
+            # Consume the results so that any error is raised
+            list(executor.map(transfer, source_paths, dest_paths))
+    else:
+        for source_path, dest_path in zip(source_paths, dest_paths):
+            transfer(source_path, dest_path)
+
+
 def separate_images(
     source_dirs,
     output_dir,
@@ -44,11 +101,18 @@ def separate_images(
     test_split=0.2,
     val_split=0.2,
     split_participants=True,
+    copy_mode="copy",
 ):
     """
     Takes in a list of source folders and separates the images into folders based on emotions.
     Each source folder should contain a 'cropped' directory with the images to be copied.
+    The copy mode can be 'copy', 'link' (hard links, or symbolic links across devices)
+    or 'parallel' (copies using a pool of threads).
+    If the 'cropped' directory contains a frame stack instead of images, the frames of each
+    dataset are written to a frame stack named after the participant and emotion.
     """
+    if copy_mode not in COPY_MODES:
+        raise ValueError(f"Unknown copy mode {copy_mode}")
 
     # Checks that source_dirs exist
     for source_dir in source_dirs:
@@ -111,8 +175,22 @@ def separate_images(
             )
             continue
 
-        # Get the list of files that need to be copied
-        files = {"": os.listdir(crop_dir)}
+        # Get the list of files (or frame times, for a frame stack) that need to be copied
+        stack_names = list_frame_stacks(crop_dir)
+        if stack_names:
+            crop_stack = FrameStack(crop_dir, stack_names[0])
+            files = {"": list(crop_stack.times)}
+        else:
+            crop_stack = None
+            files = {"": os.listdir(crop_dir)}
+
+            # Get the timestamp from each image name
+            file_times = {}
+            for filename in files[""]:
+                if match := CROPPED_TIME_PATTERN.search(filename):
+                    file_times[filename] = float(match["time"])
+                else:
+                    raise ValueError("No timestamp in filename")
 
         # Split the files into train/val/test sets
         if split_files:
@@ -125,19 +203,14 @@ def separate_images(
 
         # Copy all of the files into the dest_path
         def copy_files(files, dest_path):
-            times = []
-            for filename in files:
-                source_file_path = crop_dir / filename
-                destination_file_path = dest_path / filename
-
-                # Get the timestamp from the image name
-                if match := re.search(".+_(?P<time>\d+.\d+)_c.(png|jpg)", filename):
-                    times.append({"times": float(match["time"])})
-                else:
-                    raise ValueError("No timestamp in filename")
-
-                shutil.copy(source_file_path, destination_file_path)
-                logging.debug("Copied %s to %s", filename, dest_path)
+            if crop_stack is not None:
+                crop_stack.subset(dest_path, f"{inits}_{emotion}", files)
+                times = [{"times": float(time)} for time in sorted(files)]
+                logging.debug("Copied %d frames to %s", len(files), dest_path)
+            else:
+                transfer_files(files, crop_dir, dest_path, copy_mode)
+                times = [{"times": file_times[filename]} for filename in files]
+                logging.debug("Copied %d files to %s", len(files), dest_path)
 
             # Save a list of times for data synchronization
             with open(dest_path / TIMES_FILE_FORMAT.format(inits, emotion), "w") as f:
@@ -165,6 +238,362 @@ def separate_images(
         return destination_paths[""]
 
 
+def run_if_outdated(
+    image_dir: Path,
+    key: str,
+    inputs: List[Path],
+    params: Dict[str, Any],
+    process: Callable[[], List[Path]],
+) -> List[Path]:
+    """
+    Runs a processing step (e.g. on a video), unless the manifest of its image directory shows
+    that the step already completed with the same inputs and parameters.
+    Returns the outputs of the step.
+    """
+    manifest = Manifest(image_dir / MANIFEST_FILE)
+    if manifest.is_up_to_date(key, inputs, params):
+        logging.debug("Skipping %s of %s, which is up to date", key, inputs[0])
+        return manifest.outputs(key)
+
+    # Mark the step as unfinished in case it does not complete
+    manifest.record(key, inputs, params, complete=False)
+    manifest.save()
+
+    outputs = process()
+
+    manifest.record(key, inputs, params, outputs)
+    manifest.save()
+
+    return outputs
+
+
+def extract_cropped_frames(
+    video_path: Path,
+    image_dir: Path,
+    keep_frames: bool = False,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+    storage: str = "png",
+) -> List[Path]:
+    """
+    Extracts the frames of a video and crops them in a single streaming pass.
+    Only the cropped faces are written to the 'cropped' directory, unless keep_frames
+    is set, in which case the full frames are also written to the image directory.
+    If track_faces is set, each face is searched for around the previous one (see FaceTracker).
+    If detection_scale is below 1, faces are detected on downscaled frames (see FaceCropper).
+    If incremental is set, videos that are up to date in the manifest are skipped.
+    If storage is 'stack', the frames are written to frame stacks instead of images.
+    Returns the list of paths to the cropped images (or cropped frame stack).
+    """
+    if incremental:
+        params = {
+            "rate": RATE,
+            "keep_frames": keep_frames,
+            "track_faces": track_faces,
+            "detection_scale": detection_scale,
+            "storage": storage,
+        }
+        return run_if_outdated(
+            image_dir,
+            "cropped_frames",
+            [video_path],
+            params,
+            partial(
+                extract_cropped_frames,
+                video_path,
+                image_dir,
+                keep_frames,
+                track_faces,
+                detection_scale,
+                storage=storage,
+            ),
+        )
+
+    cropped_dir = image_dir / "cropped"
+    if not cropped_dir.exists():
+        os.makedirs(cropped_dir)
+
+    if storage == "stack":
+        frame_writer = FrameStackWriter(image_dir, video_path.stem) if keep_frames else None
+        cropped_writer = FrameStackWriter(cropped_dir, video_path.stem)
+    else:
+        frame_writer = None
+        cropped_writer = None
+
+    def save_frames(frames):
+        for time, frame in frames:
+            if frame_writer:
+                frame_writer.append(time, frame)
+            else:
+                cv2.imwrite(str(image_dir / f"{video_path.stem}_{time}.png"), frame)
+            yield time, frame
+
+    frames = iter_frames(video_path, RATE)
+    if keep_frames:
+        frames = save_frames(frames)
+
+    face_cropper = get_face_cropper(detection_scale)
+    if track_faces:
+        face_cropper = FaceTracker(face_cropper)
+
+    cropped_paths = []
+    try:
+        for time, cropped_img in iter_cropped_frames(frames, face_cropper):
+            if cropped_writer:
+                cropped_writer.append(time, cropped_img)
+            else:
+                cropped_path = cropped_dir / f"{video_path.stem}_{time}_c.png"
+                cv2.imwrite(str(cropped_path), cropped_img)
+                cropped_paths.append(cropped_path)
+    finally:
+        for writer in (frame_writer, cropped_writer):
+            if writer:
+                writer.close()
+
+    if cropped_writer:
+        return list(frame_stack_paths(cropped_dir, video_path.stem))
+
+    return cropped_paths
+
+
+def get_frame_time(filename: str) -> float:
+    """
+    Returns the timestamp of an extracted frame from its name, or infinity if it has none.
+    """
+    if match := re.search(r"_(?P<time>\d+\.\d+)\.(png|jpg)$", filename):
+        return float(match["time"])
+
+    return float("inf")
+
+
+def log_call(call: Callable[[], Any], i: int, total: int, description: str, name: Any):
+    """
+    Makes a call of run_in_pool, and logs whether it finished or failed.
+    """
+    try:
+        call()
+        logging.info("[%d/%d] Finished %s %s", i, total, description, name)
+    except Exception as e:
+        logging.error("[%d/%d] Error %s %s: %s", i, total, description, name, e)
+
+
+def run_in_pool(
+    function: Callable, argument_lists: List[Tuple], workers: int, description: str
+):
+    """
+    Calls the function with each tuple of arguments, spreading the calls across a process pool
+    if workers is greater than 1, or in this process otherwise.
+    The first argument of each call is used to report progress and errors, which are logged
+    per call so that one failure does not stop the others.
+    """
+    if workers <= 1:
+        for i, arguments in enumerate(argument_lists, start=1):
+            log_call(
+                partial(function, *arguments),
+                i,
+                len(argument_lists),
+                description,
+                arguments[0],
+            )
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(function, *arguments): arguments[0]
+            for arguments in argument_lists
+        }
+
+        for i, future in enumerate(as_completed(futures), start=1):
+            log_call(future.result, i, len(futures), description, futures[future])
+
+
+def extract_frame_stack(video_path: Path, image_dir: Path) -> List[Path]:
+    """
+    Extracts the frames of a video at the processing RATE into a frame stack.
+    Returns the data and index paths of the stack.
+    """
+    write_frame_stack(image_dir, video_path.stem, iter_frames(video_path, RATE))
+    return list(frame_stack_paths(image_dir, video_path.stem))
+
+
+def extract_video_frames(
+    video_path: Path,
+    image_dir: Path,
+    sequential_decode: bool = False,
+    incremental: bool = False,
+    storage: str = "png",
+) -> List[Path]:
+    """
+    Extracts the frames of a video at the processing RATE.
+    If incremental is set, videos that are up to date in the manifest are skipped.
+    If storage is 'stack', the frames are written to a frame stack instead of images.
+    """
+    if storage == "stack":
+        extract = partial(extract_frame_stack, video_path, image_dir)
+    else:
+        extract = partial(extract_frames, video_path, RATE, image_dir, sequential_decode)
+
+    if incremental:
+        params = {"rate": RATE, "storage": storage}
+        return run_if_outdated(image_dir, "frames", [video_path], params, extract)
+
+    return extract()
+
+
+def extract_all_frames(
+    video_paths: List[Path],
+    image_dirs: List[Path],
+    sequential_decode: bool = False,
+    workers: int = 1,
+    stream_crop: bool = False,
+    keep_frames: bool = False,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+    storage: str = "png",
+):
+    """
+    Extracts the frames of each video into the matching image directory.
+    If stream_crop is set, the frames are cropped as they are decoded (see extract_cropped_frames).
+    If workers is greater than 1, the videos are spread across a process pool.
+    If incremental is set, videos that are up to date in their manifest are skipped.
+    """
+    if stream_crop:
+        extract = extract_cropped_frames
+        argument_lists = [
+            (
+                video_path,
+                image_dir,
+                keep_frames,
+                track_faces,
+                detection_scale,
+                incremental,
+                storage,
+            )
+            for video_path, image_dir in zip(video_paths, image_dirs)
+        ]
+    else:
+        extract = extract_video_frames
+        argument_lists = [
+            (video_path, image_dir, sequential_decode, incremental, storage)
+            for video_path, image_dir in zip(video_paths, image_dirs)
+        ]
+
+    run_in_pool(extract, argument_lists, workers, "extracting frames from")
+
+
+def crop_frame_stack(
+    image_dir: Path,
+    name: str,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+) -> List[Path]:
+    """
+    Crops every frame of a frame stack into a frame stack of the same name in the
+    'cropped' directory. Returns the data and index paths of the cropped stack.
+    """
+    cropped_dir = image_dir / "cropped"
+
+    def crop_stack():
+        face_cropper = get_face_cropper(detection_scale)
+        if track_faces:
+            face_cropper = FaceTracker(face_cropper)
+
+        frames = FrameStack(image_dir, name)
+        write_frame_stack(cropped_dir, name, iter_cropped_frames(frames, face_cropper))
+        return list(frame_stack_paths(cropped_dir, name))
+
+    if incremental:
+        params = {"track_faces": track_faces, "detection_scale": detection_scale}
+        inputs = list(frame_stack_paths(image_dir, name))
+        return run_if_outdated(
+            image_dir, f"crop_stack/{name}", inputs, params, crop_stack
+        )
+
+    return crop_stack()
+
+
+def crop_images(
+    image_dir: Path,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+):
+    """
+    Crops every image in the directory into its 'cropped' directory.
+    The images are cropped with the FaceCropper of the current worker.
+    If track_faces is set, the images are cropped in time order with a FaceTracker.
+    If incremental is set, images that are up to date in the manifest are skipped.
+    If the directory contains frame stacks instead of images, the stacks are cropped.
+    """
+    logging.debug("Cropping images in %s", image_dir)
+
+    cropped_dir = image_dir / "cropped"
+    if not cropped_dir.exists():
+        os.makedirs(cropped_dir)
+
+    if stack_names := list_frame_stacks(image_dir):
+        for name in stack_names:
+            crop_frame_stack(image_dir, name, track_faces, detection_scale, incremental)
+        return
+
+    files = os.listdir(image_dir)
+    face_cropper = get_face_cropper(detection_scale)
+    if track_faces:
+        face_cropper = FaceTracker(face_cropper)
+        files.sort(key=get_frame_time)
+
+    manifest = Manifest(image_dir / MANIFEST_FILE) if incremental else None
+    params = {"track_faces": track_faces, "detection_scale": detection_scale}
+
+    # Iterate over the images
+    for i, file in enumerate(files):
+        image_path = image_dir / file
+        if not Path(image_path).is_file() or not file.lower().endswith(IMAGE_FORMATS):
+            continue
+
+        key = f"crop/{file}"
+        if manifest and manifest.is_up_to_date(key, [image_path], params):
+            continue
+
+        try:
+            cropped_path = face_cropper.crop(image_path, cropped_dir)
+        except ValueError as e:
+            logging.error("Error cropping images: %s", e)
+            continue
+
+        if manifest:
+            manifest.record(key, [image_path], params, [cropped_path] if cropped_path else [])
+
+            # Save regularly so that a crash only loses the most recent crops
+            if i % CROP_MANIFEST_SAVE_INTERVAL == 0:
+                manifest.save()
+
+    if manifest:
+        manifest.save()
+
+
+def crop_all_images(
+    image_dirs: List[Path],
+    workers: int = 1,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+):
+    """
+    Crops the images of each image directory.
+    If workers is greater than 1, the directories are spread across a process pool.
+    """
+    run_in_pool(
+        crop_images,
+        [(image_dir, track_faces, detection_scale, incremental) for image_dir in image_dirs],
+        workers,
+        "cropping images in",
+    )
+
+
 def process_data(
     video_dir: Path,
     output_path: Path,
@@ -173,6 +602,15 @@ def process_data(
     skip_crop_images: bool = False,
     use_crop_ui: bool = False,
     log: bool = False,
+    sequential_decode: bool = False,
+    workers: int = 1,
+    stream_crop: bool = False,
+    keep_frames: bool = False,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+    storage: str = "png",
+    copy_mode: str = "copy",
 ) -> Path:
     """
     Extracts frames from all videos, then crops them and separates them to the correct directory in the output path.
@@ -180,38 +618,45 @@ def process_data(
     if log:
         logging.basicConfig(level=logging.DEBUG)
 
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format {storage}")
+
+    if storage == "stack" and use_crop_ui and not skip_crop_images:
+        raise ValueError("The crop UI needs the frames to be stored as images")
+
     # Get all the video files in the directory
     video_files = [file for file in os.listdir(video_dir) if file.endswith(".mp4")]
 
-    # Extract the frames from each video and get the list of image directories
-    image_dirs = []
-    for video_file in video_files:
-        video_file_path = video_dir / video_file
-        image_dir = video_file_path.parent / video_file_path.stem
-        if not skip_get_frames:
-            extract_frames(video_file_path, RATE, image_dir)
-        image_dirs.append(image_dir)
+    # Get the list of image directories
+    video_paths = [video_dir / video_file for video_file in video_files]
+    image_dirs = [video_path.parent / video_path.stem for video_path in video_paths]
 
-    # Crop the images using the UI
-    if not skip_crop_images:
-        if not use_crop_ui:
-            for image_dir in image_dirs:
-                logging.debug("Cropping images in %s", image_dir)
-
-                cropped_dir = image_dir / "cropped"
-                if not cropped_dir.exists():
-                    os.makedirs(cropped_dir)
+    # Only crop while extracting when both steps run and the crop UI is not used
+    stream_crop = (
+        stream_crop and not skip_get_frames and not skip_crop_images and not use_crop_ui
+    )
 
-                # Iterate over the images
-                for file in os.listdir(image_dir):
-                    image_path = image_dir / file
-                    if not Path(image_path).is_file():
-                        continue
+    # Extract the frames from each video
+    if not skip_get_frames:
+        extract_all_frames(
+            video_paths,
+            image_dirs,
+            sequential_decode,
+            workers,
+            stream_crop,
+            keep_frames,
+            track_faces,
+            detection_scale,
+            incremental,
+            storage,
+        )
 
-                    try:
-                        crop(image_path, cropped_dir)
-                    except ValueError as e:
-                        logging.error("Error cropping images: %s", e)
+    # Crop the images using the UI
+    if not skip_crop_images and not stream_crop:
+        if not use_crop_ui:
+            crop_all_images(
+                image_dirs, workers, track_faces, detection_scale, incremental
+            )
         else:
             for image_dir in image_dirs:
                 logging.debug("Cropping images in %s", image_dir)
@@ -239,7 +684,14 @@ def process_data(
                     logging.error("Error: Directory is empty")
 
     try:
-        separate_images(image_dirs, output_path, binary, split_files=False, split_participants=False)
+        separate_images(
+            image_dirs,
+            output_path,
+            binary,
+            split_files=False,
+            split_participants=False,
+            copy_mode=copy_mode,
+        )
     except FileNotFoundError as e:
         logging.error("Error separating images: %s", e)
     return output_path
@@ -273,6 +725,60 @@ def parse_args():
     parser.add_argument(
         "-l", "--log", action="store_true", help="Whether to log debug messages."
     )
+    parser.add_argument(
+        "-s",
+        "--sequential-decode",
+        action="store_true",
+        help="Decode each video in a single pass instead of seeking to every frame.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to extract and crop the frames of the videos.",
+    )
+    parser.add_argument(
+        "--stream-crop",
+        action="store_true",
+        help="Crop the frames as they are decoded instead of saving them first.",
+    )
+    parser.add_argument(
+        "--keep-frames",
+        action="store_true",
+        help="With --stream-crop, also save the full frames.",
+    )
+    parser.add_argument(
+        "-t",
+        "--track-faces",
+        action="store_true",
+        help="Search for each face around the face in the previous frame.",
+    )
+    parser.add_argument(
+        "-d",
+        "--detection-scale",
+        type=float,
+        default=1.0,
+        help="Scale of the downscaled copy used to detect faces (e.g. 0.25).",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Skip the videos and frames that are up to date in their manifest.",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=STORAGE_FORMATS,
+        default="png",
+        help="Store the frames of each video as images or as a single frame stack.",
+    )
+    parser.add_argument(
+        "--copy-mode",
+        choices=COPY_MODES,
+        default="copy",
+        help="Copy, link or copy in parallel the cropped images into the output path.",
+    )
     return parser.parse_args()
 
 
@@ -288,4 +794,13 @@ if __name__ == "__main__":
         args.skip_crop_images,
         args.use_crop_ui,
         args.log,
+        args.sequential_decode,
+        args.workers,
+        args.stream_crop,
+        args.keep_frames,
+        args.track_faces,
+        args.detection_scale,
+        args.incremental,
+        args.storage,
+        args.copy_mode,
     )
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from data_processing.face.frame_stack import frame_stack_paths
+from data_processing.manifest import file_identity
+
+SAMPLE_INDEX_FILE_FORMAT = "sample_index_{}_{}.npz"
+# The index is cached outside of the dataset, which may be read-only
+SAMPLE_INDEX_CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "emotion-watchers"
+    / "sample_index"
+)
+TIMES_FILE_PATTERN = re.compile(r"times_(?P<inits>\w+)_(?P<emotion>[a-z]+)\.csv$")
+IMAGE_NAME_FORMAT = "{}_{}_{}_c.png"
+
+# The columns that are stored as codes into a list of names
+CATEGORICAL_COLUMNS = ("participant", "emotion", "label")
+
+
+def dataset_identity(dataset_dir: Path) -> Dict[str, Dict[str, int]]:
+    """
+    Returns the identity of the label directories of the dataset and their times files,
+    which changes when a label, an image or a times file is added, removed or rewritten.
+    The dataset directory itself is left out, since the image stores are saved in it.
+    """
+    identity = {}
+    for label in sorted(os.listdir(dataset_dir)):
+        if not os.path.isdir(dataset_dir / label):
+            continue
+
+        identity[label] = file_identity(dataset_dir / label)
+        for file in os.listdir(dataset_dir / label):
+            if TIMES_FILE_PATTERN.match(file):
+                identity[f"{label}/{file}"] = file_identity(dataset_dir / label / file)
+
+    return identity
+
+
+def sample_index_path(dataset_dir: Path, cache_dir: Optional[Path] = None) -> Path:
+    """
+    Returns the path of the saved index of the dataset directory in the cache directory,
+    SAMPLE_INDEX_CACHE_DIR by default. The file is named after the absolute path of the dataset.
+    """
+    if cache_dir is None:
+        cache_dir = SAMPLE_INDEX_CACHE_DIR
+
+    key = hashlib.sha256(str(Path(dataset_dir).resolve()).encode()).hexdigest()[:16]
+    return Path(cache_dir) / SAMPLE_INDEX_FILE_FORMAT.format(Path(dataset_dir).name, key)
+
+
+class SampleIndex:
+    """
+    The samples of a dataset directory of the face data (e.g. output_path/train), which has one
+    directory of images or frame stacks per label, with a times file per participant and emotion.
+    There is one sample per frame time in the times files, with its participant, emotion and
+    label, and its image path. The split is the name of the dataset directory.
+    The participants, emotions and labels are stored as codes into lists of names, and the
+    samples of each times file are contiguous.
+    """
+
+    def __init__(
+        self,
+        dataset_dir: Path,
+        classes: List[str],
+        names: Dict[str, List[str]],
+        codes: Dict[str, np.ndarray],
+        times: np.ndarray,
+        stacks: np.ndarray,
+    ):
+        self.dataset_dir = dataset_dir
+        self.split = dataset_dir.name
+        # The label directories, which are the classes of the models
+        self.classes = classes
+        self.names = names
+        self.codes = codes
+        self.times = times
+        # Whether each sample is a frame of a frame stack rather than an image file
+        self.stacks = stacks
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @classmethod
+    def build(cls, dataset_dir: Path) -> "SampleIndex":
+        """
+        Reads the times files of every label directory of the dataset.
+        The images that are not in the times files are left out, and counted in a warning.
+        """
+        classes = sorted(
+            label for label in os.listdir(dataset_dir) if os.path.isdir(dataset_dir / label)
+        )
+        names: Dict[str, List[str]] = {column: [] for column in CATEGORICAL_COLUMNS}
+        codes: Dict[str, List[np.ndarray]] = {column: [] for column in CATEGORICAL_COLUMNS}
+        times: List[np.ndarray] = []
+        stacks: List[np.ndarray] = []
+        for label in classes:
+            for file in sorted(os.listdir(dataset_dir / label)):
+                if not (match := TIMES_FILE_PATTERN.match(file)):
+                    continue
+
+                file_times = np.loadtxt(
+                    dataset_dir / label / file, delimiter=",", skiprows=1, usecols=0, ndmin=1
+                )
+                for column, name in zip(
+                    CATEGORICAL_COLUMNS, (match["inits"], match["emotion"], label)
+                ):
+                    if name not in names[column]:
+                        names[column].append(name)
+                    codes[column].append(
+                        np.full(len(file_times), names[column].index(name), dtype=np.int32)
+                    )
+
+                _, stack_index_path = frame_stack_paths(
+                    dataset_dir / label, f"{match['inits']}_{match['emotion']}"
+                )
+                times.append(file_times)
+                stacks.append(
+                    np.full(len(file_times), os.path.isfile(stack_index_path), dtype=bool)
+                )
+
+        sample_index = cls(
+            dataset_dir,
+            classes,
+            names,
+            {
+                column: np.concatenate(codes[column])
+                if codes[column]
+                else np.empty(0, dtype=np.int32)
+                for column in CATEGORICAL_COLUMNS
+            },
+            np.concatenate(times) if times else np.empty(0),
+            np.concatenate(stacks) if stacks else np.empty(0, dtype=bool),
+        )
+
+        sample_paths = set(sample_index.image_paths())
+        excluded = sum(
+            file.endswith(".png") and dataset_dir / label / file not in sample_paths
+            for label in classes
+            for file in os.listdir(dataset_dir / label)
+        )
+        if excluded:
+            logging.warning(
+                "%s: %d images are not in the times files and are left out",
+                dataset_dir,
+                excluded,
+            )
+
+        return sample_index
+
+    def save(self, identity: Dict[str, Dict[str, int]], cache_dir: Optional[Path] = None):
+        """
+        Saves the index in the cache directory (see sample_index_path), with the identity of
+        the dataset it was built from.
+        """
+        path = sample_index_path(self.dataset_dir, cache_dir)
+        os.makedirs(path.parent, exist_ok=True)
+        np.savez(
+            path,
+            info=np.array(
+                json.dumps({"identity": identity, "classes": self.classes, "names": self.names})
+            ),
+            times=self.times,
+            stacks=self.stacks,
+            **{f"{column}_codes": codes for column, codes in self.codes.items()},
+        )
+
+    @classmethod
+    def load(
+        cls,
+        dataset_dir: Path,
+        identity: Optional[Dict[str, Dict[str, int]]] = None,
+        cache_dir: Optional[Path] = None,
+    ) -> Optional["SampleIndex"]:
+        """
+        Loads the saved index of the dataset directory from the cache directory.
+        Returns None if there is none, or if it does not match the identity of the dataset.
+        """
+        try:
+            with np.load(sample_index_path(dataset_dir, cache_dir)) as data:
+                info = json.loads(str(data["info"]))
+                if identity is not None and info["identity"] != identity:
+                    return None
+
+                return cls(
+                    dataset_dir,
+                    info["classes"],
+                    info["names"],
+                    {column: data[f"{column}_codes"] for column in CATEGORICAL_COLUMNS},
+                    data["times"],
+                    data["stacks"],
+                )
+        except FileNotFoundError:
+            return None
+
+    def column(self, column: str) -> np.ndarray:
+        """
+        Returns the names of a categorical column for every sample.
+        """
+        return np.array(self.names[column])[self.codes[column]]
+
+    def label_indices(self) -> np.ndarray:
+        """
+        Returns the index of the label of every sample in the classes.
+        """
+        return np.array(
+            [self.classes.index(label) for label in self.names["label"]], dtype=np.int32
+        )[self.codes["label"]]
+
+    def select(self, mask: np.ndarray) -> "SampleIndex":
+        """
+        Returns the index of the samples selected by a boolean mask or an array of indices.
+        """
+        return SampleIndex(
+            self.dataset_dir,
+            self.classes,
+            self.names,
+            {column: codes[mask] for column, codes in self.codes.items()},
+            self.times[mask],
+            self.stacks[mask],
+        )
+
+    def query(self, **values: str) -> "SampleIndex":
+        """
+        Returns the samples with the given participant, emotion and/or label,
+        e.g. query(participant="cs").
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, name in values.items():
+            if name not in self.names[column]:
+                return self.select(np.zeros(len(self), dtype=bool))
+            mask &= self.codes[column] == self.names[column].index(name)
+
+        return self.select(mask)
+
+    def segments(self) -> Iterator[Tuple[str, str, str, "SampleIndex"]]:
+        """
+        Yields the (label, participant, emotion, samples) of each times file.
+        """
+        changes = np.zeros(max(len(self) - 1, 0), dtype=bool)
+        for codes in self.codes.values():
+            changes |= np.diff(codes) != 0
+        bounds = np.concatenate([[0], np.flatnonzero(changes) + 1, [len(self)]])
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+
+            yield (
+                self.names["label"][self.codes["label"][start]],
+                self.names["participant"][self.codes["participant"][start]],
+                self.names["emotion"][self.codes["emotion"][start]],
+                self.select(slice(start, end)),
+            )
+
+    def image_names(self) -> List[str]:
+        """
+        Returns the name of the image of every sample, as written by the face processing.
+        """
+        return [
+            IMAGE_NAME_FORMAT.format(participant, emotion, time)
+            for participant, emotion, time in zip(
+                self.column("participant"), self.column("emotion"), self.times.tolist()
+            )
+        ]
+
+    def image_paths(self) -> List[Path]:
+        """
+        Returns the path of the image of every sample.
+        """
+        return [
+            self.dataset_dir / label / name
+            for label, name in zip(self.column("label"), self.image_names())
+        ]
+
+
+def load_sample_index(dataset_dir: Path, cache_dir: Optional[Path] = None) -> SampleIndex:
+    """
+    Loads the sample index of the dataset directory from the cache directory
+    (SAMPLE_INDEX_CACHE_DIR by default), building and saving it first if there is none or if
+    the dataset changed since it was built.
+    """
+    identity = dataset_identity(dataset_dir)
+    sample_index = SampleIndex.load(dataset_dir, identity, cache_dir)
+    if sample_index is None:
+        sample_index = SampleIndex.build(dataset_dir)
+        sample_index.save(identity, cache_dir)
+
+    return sample_index
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Build the sample index of the face dataset directories."
+    )
+    parser.add_argument(
+        "dataset_dirs",
+        type=Path,
+        nargs="+",
+        help="Dataset directories (e.g. output_path/train), with one directory per label.",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-dir",
+        type=Path,
+        help=f"Directory to save the indexes in. Defaults to {SAMPLE_INDEX_CACHE_DIR}.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for dataset_dir in args.dataset_dirs:
+        sample_index = load_sample_index(dataset_dir, args.cache_dir)
+        print(f"{dataset_dir}: {len(sample_index)} samples")
@@ -0,0 +1,195 @@
+import cv2
+import os
+from pathlib import Path
+import pytest
+import shutil
+
+from data_processing.face.benchmark import box_iou
+from data_processing.face.crop import (
+    crop,
+    crop_frame,
+    FaceCropper,
+    FaceTracker,
+    get_face_cropper,
+    iter_cropped_frames,
+)
+from data_processing.face.process_data import crop_images, extract_cropped_frames
+from data_processing.manifest import MANIFEST_FILE
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def write_test_video(image_path: Path, video_path: Path, seconds: int, fps: int = 10):
+    """
+    Write a video that shows the same image for the specified number of seconds.
+    """
+    os.makedirs(video_path.parent, exist_ok=True)
+
+    img = cv2.imread(str(image_path))
+    height, width = img.shape[:2]
+    writer = cv2.VideoWriter(
+        str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+    )
+    for _ in range(seconds * fps):
+        writer.write(img)
+    writer.release()
+
+
+@pytest.mark.parametrize(
+    "test_image, expected_size",
+    [
+        (test_files_dir / "excited_woman.png", 176),
+        (test_files_dir / "happy_man.png", 291),
+    ],
+)
+def test_crop(test_image, expected_size):
+    output_dir = test_files_dir / "cropped"
+    os.makedirs(output_dir, exist_ok=True)
+
+    crop(test_image, output_dir)
+
+    cropped_img = cv2.imread(str(output_dir / f"{test_image.stem}_c.png"))
+    assert cropped_img.shape[:2] == (expected_size, expected_size)
+
+
+def test_iter_cropped_frames():
+    excited_woman = cv2.imread(str(test_files_dir / "excited_woman.png"))
+    happy_man = cv2.imread(str(test_files_dir / "happy_man.png"))
+    frames = [
+        (0.0, excited_woman),
+        (1.0, excited_woman[:100, :100]),  # No face in this frame
+        (2.0, happy_man),
+    ]
+
+    cropped_frames = list(iter_cropped_frames(frames))
+
+    assert [time for time, _ in cropped_frames] == [0.0, 2.0]
+    for (_, cropped_img), (_, frame) in zip(cropped_frames, [frames[0], frames[2]]):
+        assert (cropped_img == crop_frame(frame)).all()
+
+
+def test_crop_many():
+    face_cropper = FaceCropper()
+    image_paths = [
+        test_files_dir / "excited_woman.png",
+        test_files_dir / "happy_man.png",
+    ]
+    no_face = cv2.imread(str(image_paths[0]))[:100, :100]
+
+    cropped_from_paths = face_cropper.crop_many(image_paths)
+    cropped_from_arrays = face_cropper.crop_many(
+        [cv2.imread(str(path)) for path in image_paths] + [no_face]
+    )
+
+    assert [img.shape for img in cropped_from_paths] == [(176, 176), (291, 291)]
+    assert cropped_from_arrays[2] is None
+    for from_path, from_array in zip(cropped_from_paths, cropped_from_arrays):
+        assert (from_path == from_array).all()
+
+
+def test_get_face_cropper():
+    assert get_face_cropper() is get_face_cropper()
+
+
+@pytest.mark.parametrize(
+    "test_image, detection_scale",
+    [
+        (test_files_dir / "excited_woman.png", 0.5),
+        (test_files_dir / "excited_woman.png", 0.25),
+        (test_files_dir / "happy_man.png", 0.5),
+        (test_files_dir / "happy_man.png", 0.25),
+    ],
+)
+def test_downscaled_detection(test_image, detection_scale):
+    face_cropper = FaceCropper(detection_scale)
+    gray_img = face_cropper.read_gray(test_image)
+
+    reference = FaceCropper().detect(gray_img)
+    face = face_cropper.detect(gray_img)
+
+    # The box is mapped back to full resolution
+    assert box_iou(face, reference) > 0.9
+
+    # The crop is taken from the full-resolution image
+    x, y, w, h = face
+    cropped_img = face_cropper.crop_many([test_image])[0]
+    assert (cropped_img == gray_img[y:y+h, x:x+w]).all()
+
+
+def test_face_tracker():
+    img = cv2.imread(str(test_files_dir / "happy_man.png"))
+    gray_img = cv2.copyMakeBorder(
+        cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), 100, 100, 300, 300, cv2.BORDER_CONSTANT
+    )
+    face_tracker = FaceTracker(redetect_interval=3)
+
+    faces = [face_tracker.detect(gray_img) for _ in range(5)]
+
+    # The face is tracked for 3 frames before a full-frame detection
+    assert face_tracker.frames_since_detection == 0
+    assert all(face is not None for face in faces)
+
+    # The tracked faces overlap the detected face
+    reference = FaceCropper().detect(gray_img)
+    for face in faces:
+        assert box_iou(face, reference) > 0.7
+
+
+def test_face_tracker_sizes():
+    test_image = test_files_dir / "happy_man.png"
+    face_tracker = FaceTracker(FaceCropper(0.5))
+    gray_img = face_tracker.read_gray(test_image)
+
+    # The first frame is a full-frame detection with the FaceCropper sizes
+    reference = FaceCropper(0.5).detect(gray_img)
+    assert (face_tracker.detect(gray_img) == reference).all()
+
+    # The size limits are also applied around the previous face
+    x, y, w, h = reference
+    assert face_tracker.detect(gray_img, max_size=(w // 2, w // 2)) is None
+    assert face_tracker.detect(gray_img, min_size=(2 * w, 2 * w)) is None
+
+    # Both the tracked and the full-frame detection use the base crop_many
+    cropped_imgs = face_tracker.crop_many([test_image, test_image])
+    assert all((img == gray_img[y:y+h, x:x+w]).all() for img in cropped_imgs)
+@pytest.mark.parametrize("keep_frames", [False, True])
+def test_extract_cropped_frames(keep_frames):
+    image_dir = test_files_dir / "images" / f"happy_man_{keep_frames}"
+    video_path = image_dir.parent / f"happy_man_{keep_frames}.mp4"
+    write_test_video(test_files_dir / "happy_man.png", video_path, 3)
+
+    cropped_paths = extract_cropped_frames(video_path, image_dir, keep_frames)
+
+    assert cropped_paths == [
+        image_dir / "cropped" / f"happy_man_{keep_frames}_{time}_c.png"
+        for time in (0.0, 1.0, 2.0)
+    ]
+    for cropped_path in cropped_paths:
+        assert cropped_path.is_file()
+
+    full_frames = [file for file in os.listdir(image_dir) if file.endswith(".png")]
+    assert len(full_frames) == (3 if keep_frames else 0)
+
+
+def test_crop_images_incremental():
+    image_dir = test_files_dir / "images" / "incremental_crop"
+    shutil.rmtree(image_dir, ignore_errors=True)
+    os.makedirs(image_dir)
+    for name in ("excited_woman", "happy_man"):
+        shutil.copy(test_files_dir / f"{name}.png", image_dir / f"{name}_0.0.png")
+
+    crop_images(image_dir, incremental=True)
+
+    cropped_paths = [
+        image_dir / "cropped" / f"{name}_0.0_c.png"
+        for name in ("excited_woman", "happy_man")
+    ]
+    assert (image_dir / MANIFEST_FILE).is_file()
+    mtimes = [os.stat(path).st_mtime_ns for path in cropped_paths]
+
+    # Only the image that changed is cropped again
+    shutil.copy(test_files_dir / "happy_man.png", image_dir / "excited_woman_0.0.png")
+    crop_images(image_dir, incremental=True)
+
+    assert os.stat(cropped_paths[0]).st_mtime_ns != mtimes[0]
+    assert os.stat(cropped_paths[1]).st_mtime_ns == mtimes[1]
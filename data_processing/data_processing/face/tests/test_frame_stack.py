@@ -0,0 +1,85 @@
+import csv
+import numpy as np
+from pathlib import Path
+import pytest
+import shutil
+
+from data_processing.face.frame_stack import (
+    FrameStack,
+    list_frame_stacks,
+    write_frame_stack,
+)
+from data_processing.face.process_data import separate_images, TIMES_FILE_FORMAT
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def make_frames(num_frames):
+    """
+    Create frames of different sizes, alternating between grayscale and colour.
+    """
+    rng = np.random.default_rng(496)
+    shapes = [
+        (20 + i, 30 + i) if i % 2 else (20 + i, 30 + i, 3) for i in range(num_frames)
+    ]
+    return [
+        (float(i), rng.integers(0, 256, shape, dtype=np.uint8))
+        for i, shape in enumerate(shapes)
+    ]
+
+
+def test_frame_stack():
+    stack_dir = test_files_dir / "images" / "frame_stack"
+    frames = make_frames(5)
+
+    write_frame_stack(stack_dir, "test", frames)
+
+    assert "test" in list_frame_stacks(stack_dir)
+    stack = FrameStack(stack_dir, "test")
+    assert len(stack) == len(frames)
+    for (time, frame), (stack_time, stack_frame) in zip(frames, stack):
+        assert time == stack_time
+        assert (frame == stack_frame).all()
+
+    assert (stack.at_time(3.0) == frames[3][1]).all()
+    assert stack.find(3.5) == -1
+    with pytest.raises(KeyError):
+        stack.at_time(3.5)
+
+    # Subsets only contain the frames at the specified times
+    stack.subset(stack_dir, "subset", [4.0, 1.0])
+    subset = FrameStack(stack_dir, "subset")
+    assert list(subset.times) == [1.0, 4.0]
+    assert (subset.at_time(4.0) == frames[4][1]).all()
+
+
+@pytest.mark.parametrize("split_files", [False, True])
+def test_separate_frame_stacks(split_files):
+    source_dir = test_files_dir / "separate_frame_stacks" / "ab_happy"
+    output_dir = test_files_dir / "separate_frame_stacks" / "output"
+    shutil.rmtree(source_dir.parent, ignore_errors=True)
+    frames = make_frames(10)
+    write_frame_stack(source_dir / "cropped", "ab_happy", frames)
+
+    destination_paths = separate_images(
+        [source_dir], output_dir, binary=True, split_files=split_files
+    )
+
+    if split_files:
+        paths = [destination_paths[dataset]["positive"] for dataset in ("train", "val", "test")]
+    else:
+        paths = [destination_paths["positive"]]
+    stack_times = []
+    for path in paths:
+        assert list_frame_stacks(path) == ["ab_happy"]
+        stack = FrameStack(path, "ab_happy")
+        with open(path / TIMES_FILE_FORMAT.format("ab", "happy"), "r") as f:
+            assert [float(row["times"]) for row in csv.DictReader(f)] == list(stack.times)
+        for time, frame in stack:
+            assert (frame == frames[int(time)][1]).all()
+        stack_times.extend(stack.times)
+
+    # Every frame ends up in exactly one dataset
+    assert sorted(stack_times) == [time for time, _ in frames]
+
+    shutil.rmtree(source_dir.parent)
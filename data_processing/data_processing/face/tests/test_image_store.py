@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+import os
+from pathlib import Path
+import pytest
+import shutil
+
+from data_processing.face.frame_stack import write_frame_stack
+from data_processing.face.image_store import image_store_paths, load_image_store
+from data_processing.face.tests.test_sample_index import write_times
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def test_image_store():
+    dataset_dir = test_files_dir / "image_store" / "train"
+    shutil.rmtree(dataset_dir.parent, ignore_errors=True)
+
+    # One participant with images and one with a frame stack of colour frames
+    write_times(dataset_dir / "positive", "cs", "happy", [1.0, 2.0])
+    for value, time in ((50, 1.0), (100, 2.0)):
+        cv2.imwrite(
+            str(dataset_dir / "positive" / f"cs_happy_{time}_c.png"),
+            np.full((40, 30), value, dtype=np.uint8),
+        )
+    write_times(dataset_dir / "negative", "mf", "sad", [0.5])
+    write_frame_stack(
+        dataset_dir / "negative", "mf_sad", [(0.5, np.full((20, 20, 3), 200, dtype=np.uint8))]
+    )
+
+    image_store = load_image_store(dataset_dir, (8, 6))
+    assert image_store.images.dtype == np.uint8
+    assert image_store.images.shape == (3, 8, 6, 1)
+    assert list(image_store.samples.label_indices()) == [0, 1, 1]
+    assert (image_store.images[0] == 200).all()
+    assert (image_store.images[1] == 50).all()
+    assert (image_store.images[2] == 100).all()
+
+    # The store is only rebuilt when the dataset changes
+    images_path, _ = image_store_paths(dataset_dir, (8, 6))
+    mtime = os.stat(images_path).st_mtime_ns
+    load_image_store(dataset_dir, (8, 6))
+    assert os.stat(images_path).st_mtime_ns == mtime
+
+    os.remove(dataset_dir / "negative" / "times_mf_sad.csv")
+    assert len(load_image_store(dataset_dir, (8, 6))) == 2
+
+
+def test_image_store_missing_image():
+    dataset_dir = test_files_dir / "image_store" / "missing"
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    write_times(dataset_dir / "positive", "cs", "happy", [1.0, 2.0])
+    cv2.imwrite(
+        str(dataset_dir / "positive" / "cs_happy_1.0_c.png"), np.zeros((4, 4), dtype=np.uint8)
+    )
+
+    # The missing image is named, and the unfinished store is not used
+    with pytest.raises(FileNotFoundError, match="cs_happy_2.0_c.png"):
+        load_image_store(dataset_dir, (8, 6))
+    assert not image_store_paths(dataset_dir, (8, 6))[1].is_file()
@@ -0,0 +1,111 @@
+import csv
+import cv2
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+
+from data_processing.face.frame_stack import write_frame_stack
+from data_processing.face.process_data import TIMES_FILE_FORMAT
+from data_processing.face.sample_index import (
+    load_sample_index,
+    sample_index_path,
+    SampleIndex,
+)
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def write_times(label_dir, inits, emotion, times):
+    os.makedirs(label_dir, exist_ok=True)
+    with open(label_dir / TIMES_FILE_FORMAT.format(inits, emotion), "w") as f:
+        writer = csv.DictWriter(f, ["times"])
+        writer.writeheader()
+        writer.writerows({"times": time} for time in times)
+
+
+def make_dataset():
+    dataset_dir = test_files_dir / "sample_index" / "train"
+    shutil.rmtree(dataset_dir.parent, ignore_errors=True)
+    write_times(dataset_dir / "positive", "cs", "happy", [1.0, 2.5])
+    write_times(dataset_dir / "positive", "mf", "joy", [0.5])
+    write_times(dataset_dir / "negative", "cs", "sad", [1.0, 3.0, 4.0])
+    write_frame_stack(
+        dataset_dir / "negative",
+        "cs_sad",
+        [(t, np.zeros((2, 2), dtype=np.uint8)) for t in (1.0, 3.0, 4.0)],
+    )
+    return dataset_dir
+
+
+def test_sample_index():
+    dataset_dir = make_dataset()
+
+    cache_dir = dataset_dir.parent / "cache"
+    samples = load_sample_index(dataset_dir, cache_dir)
+    assert sample_index_path(dataset_dir, cache_dir).is_file()
+    assert sample_index_path(dataset_dir, cache_dir).parent == cache_dir
+    assert samples.split == "train"
+    assert samples.classes == ["negative", "positive"]
+    assert len(samples) == 6
+    assert list(samples.times) == [1.0, 3.0, 4.0, 1.0, 2.5, 0.5]
+    assert list(samples.stacks) == [True] * 3 + [False] * 3
+    assert list(samples.label_indices()) == [0, 0, 0, 1, 1, 1]
+
+    # The samples are queried by participant, emotion and label
+    cs_samples = samples.query(participant="cs")
+    assert list(cs_samples.column("emotion")) == ["sad"] * 3 + ["happy"] * 2
+    assert len(samples.query(participant="cs", label="positive")) == 2
+    assert len(samples.query(participant="ab")) == 0
+
+    # There is one segment per times file
+    segments = [(label, inits, emotion, len(s)) for label, inits, emotion, s in samples.segments()]
+    assert segments == [
+        ("negative", "cs", "sad", 3),
+        ("positive", "cs", "happy", 2),
+        ("positive", "mf", "joy", 1),
+    ]
+    assert samples.query(emotion="joy").image_paths() == [
+        dataset_dir / "positive" / "mf_joy_0.5_c.png"
+    ]
+
+
+def test_sample_index_invalidation():
+    dataset_dir = make_dataset()
+    cache_dir = dataset_dir.parent / "cache"
+    load_sample_index(dataset_dir, cache_dir)
+
+    # The saved index is loaded while the dataset is unchanged
+    saved = SampleIndex.load(dataset_dir, cache_dir=cache_dir)
+    loaded = load_sample_index(dataset_dir, cache_dir)
+    assert loaded.classes == saved.classes
+    assert (loaded.times == saved.times).all()
+
+    # The index is rebuilt when a times file or a label is added
+    write_times(dataset_dir / "neutral", "ab", "calm", [1.0, 2.0])
+    samples = load_sample_index(dataset_dir, cache_dir)
+    assert samples.classes == ["negative", "neutral", "positive"]
+    assert len(samples.query(label="neutral")) == 2
+
+    # The index is rebuilt when a times file is rewritten
+    write_times(dataset_dir / "positive", "mf", "joy", [0.5, 1.5, 2.5])
+    assert len(load_sample_index(dataset_dir, cache_dir).query(participant="mf")) == 3
+
+
+def test_sample_index_read_only_dataset(caplog):
+    dataset_dir = make_dataset()
+    cache_dir = dataset_dir.parent / "cache"
+    image = np.zeros((2, 2), dtype=np.uint8)
+    for name in ("cs_happy_1.0_c.png", "cs_happy_2.5_c.png", "cs_happy_9.0_c.png"):
+        cv2.imwrite(str(dataset_dir / "positive" / name), image)
+
+    # Nothing is written to the dataset, which could be read-only
+    before = sorted(dataset_dir.rglob("*"))
+    with caplog.at_level(logging.WARNING):
+        samples = load_sample_index(dataset_dir, cache_dir)
+    assert sorted(dataset_dir.rglob("*")) == before
+
+    # The image that is not in the times files is left out, and counted
+    assert len(samples) == 6
+    assert "1 images are not in the times files" in caplog.text
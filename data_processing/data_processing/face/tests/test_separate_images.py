@@ -275,3 +275,40 @@ def test_separate_no_cropped_dir(
 
     if TEAR_DOWN:
         teardown_test_folders(setup_folders, output_folders)
+
+
+@pytest.mark.parametrize("copy_mode", ["copy", "link", "parallel"])
+def test_separate_images_copy_mode(copy_mode):
+    """
+    Test that every copy mode materializes the same dataset, and that link mode
+    shares the files with the source folders instead of copying them.
+    """
+    setup_folders = [TEST_FILES_DIR / "ab_happy", TEST_FILES_DIR / "cd_sad"]
+    num_images = 10
+    setup_test_folders(setup_folders, num_images)
+
+    destination_paths = separate_images(
+        setup_folders, TEST_FILES_DIR, binary=True, copy_mode=copy_mode
+    )
+
+    for folder in setup_folders:
+        inits, emotion_name = folder.stem.split("_")
+        emotion_category = "positive" if emotion_name == "happy" else "negative"
+        dataset_files = [
+            file
+            for dataset in ["train", "val", "test"]
+            for file in os.listdir(destination_paths[dataset][emotion_category])
+            if file.endswith(".jpg")
+        ]
+        assert sorted(dataset_files) == sorted(os.listdir(folder / "cropped"))
+
+        # The test files are also in the participant's folder
+        individual_path = destination_paths[inits]
+        for file in os.listdir(destination_paths["test"][emotion_category]):
+            if file.endswith(".jpg"):
+                source_path = folder / "cropped" / file
+                dest_path = individual_path / file
+                assert os.path.samefile(source_path, dest_path) == (copy_mode == "link")
+
+    if TEAR_DOWN:
+        teardown_test_folders(setup_folders, TEST_FILES_DIR)
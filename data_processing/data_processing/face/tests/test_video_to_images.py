@@ -1,6 +1,10 @@
+import os
 from pathlib import Path
 import pytest
+import shutil
 
+from data_processing.face.process_data import extract_all_frames, extract_video_frames
+import data_processing.face.video_to_images as video_to_images
 from data_processing.face.video_to_images import extract_frames
 
 test_files_dir = Path(__file__).parent / "test_files"
@@ -22,9 +26,104 @@ def test_extract_frames(test_video, test_rate, expected_num_images):
         assert image_path.exists() and image_path.is_file()
 
 
+@pytest.mark.parametrize(
+    "test_video, test_rate, expected_num_images,",
+    [
+        (test_files_dir / "keyboard_cat.mp4", 1, 54),
+        (test_files_dir / "keyboard_cat.mp4", 2, 109),
+        (test_files_dir / "keyboard_cat.mp4", 3, 163),
+    ],
+)
+def test_extract_frames_sequential(test_video, test_rate, expected_num_images):
+    image_paths = extract_frames(
+        test_video, test_rate, test_files_dir / "images", sequential=True
+    )
+    assert len(image_paths) == expected_num_images
+    assert image_paths == [
+        test_files_dir / "images" / f"keyboard_cat_{i / test_rate}.png"
+        for i in range(expected_num_images)
+    ]
+
+    for image_path in image_paths:
+        assert image_path.exists() and image_path.is_file()
+
+
 @pytest.mark.parametrize(
     "test_video,", [("dne.mp4"), (Path(__file__).parent), (Path(__file__))]
 )
 def test_nonexistent_video(test_video):
     with pytest.raises(Exception):
         extract_frames(test_video, 1, test_files_dir / "images")
+
+    with pytest.raises(Exception):
+        extract_frames(test_video, 1, test_files_dir / "images", sequential=True)
+
+
+class UndecodableCapture:
+    """
+    A stand-in for cv2.VideoCapture whose frames can be grabbed but not decoded.
+    """
+
+    def __init__(self, path):
+        pass
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        return True
+
+    def retrieve(self):
+        return False, None
+
+    def release(self):
+        pass
+
+
+def test_extract_frames_sequential_undecodable(monkeypatch):
+    monkeypatch.setattr(video_to_images.cv2, "VideoCapture", UndecodableCapture)
+
+    with pytest.raises(Exception, match="could not decode the frame at 0.0s"):
+        extract_frames(
+            test_files_dir / "keyboard_cat.mp4",
+            1,
+            test_files_dir / "images" / "undecodable",
+            sequential=True,
+        )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_extract_all_frames(caplog, workers):
+    video_paths = [
+        test_files_dir / "keyboard_cat.mp4",
+        test_files_dir / "dne.mp4",
+        test_files_dir / "keyboard_cat.mp4",
+    ]
+    image_dirs = [test_files_dir / "images" / f"video_{workers}_{i}" for i in range(3)]
+    for image_dir in image_dirs:
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+    extract_all_frames(video_paths, image_dirs, sequential_decode=True, workers=workers)
+
+    # Each video is extracted into its own directory, and errors do not stop the others
+    assert len(os.listdir(image_dirs[0])) == 54
+    assert not image_dirs[1].exists()
+    assert len(os.listdir(image_dirs[2])) == 54
+    assert "Error extracting frames from" in caplog.text
+
+
+def test_extract_video_frames_incremental():
+    image_dir = test_files_dir / "images" / "incremental_frames"
+    image_paths = extract_video_frames(
+        test_files_dir / "keyboard_cat.mp4", image_dir, True, incremental=True
+    )
+    mtimes = [os.stat(path).st_mtime_ns for path in image_paths]
+
+    # The second run skips the video and returns the recorded frames
+    assert (
+        extract_video_frames(
+            test_files_dir / "keyboard_cat.mp4", image_dir, True, incremental=True
+        )
+        == image_paths
+    )
+    assert [os.stat(path).st_mtime_ns for path in image_paths] == mtimes
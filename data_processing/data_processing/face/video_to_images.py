@@ -1,39 +1,102 @@
 #!/usr/bin/env python3
 
+import cv2
 from moviepy.editor import VideoFileClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+import numpy as np
 import os
 from pathlib import Path
 import sys
-from typing import List
+from typing import Iterator, List, Tuple
 
 video_formats = (".mov", ".mp4", ".wav")
 
 
+def check_video(video: Path):
+    """
+    Raises an exception if the specified video cannot be read.
+    """
+    if not video.exists():
+        raise Exception("Error: video does not exist")
+
+    if not video.is_file() and video.suffix in video_formats:
+        raise Exception("Error: video is not a video file")
+
+
+def iter_frames(video: Path, rate: int) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    This function decodes the specified video once from start to end.
+    It expects a rate in frames per second.\n
+    It yields a (time, BGR frame) tuple for each sampled timestamp, using the
+    same timestamps and frame selection as moviepy's seek-per-frame path.
+    """
+    check_video(video)
+
+    # Use the same duration and fps as moviepy so the timestamps match
+    infos = ffmpeg_parse_infos(video.absolute().as_posix())
+    duration = infos["duration"]
+    fps = infos["video_fps"]
+
+    capture = cv2.VideoCapture(video.absolute().as_posix())
+    if not capture.isOpened():
+        raise Exception("Error: video could not be opened")
+
+    try:
+        frame = None
+        frame_index = -1
+        for i in range(int(rate * duration)):
+            time = i / rate
+
+            # Grab (without converting) the frames that are not needed
+            target_index = int(fps * time + 0.00001)
+            while frame_index < target_index and capture.grab():
+                frame_index += 1
+                if frame_index == target_index:
+                    frame = None
+
+            # Like moviepy, reuse the last frame if the video ends early
+            if frame is None:
+                ok, frame = capture.retrieve()
+                if not ok or frame is None:
+                    raise Exception(f"Error: could not decode the frame at {time}s")
+
+            yield time, frame
+    finally:
+        capture.release()
+
+
 def extract_frames(
-    video: Path, rate: int, image_dir: Path = Path(__file__).parent / "images"
+    video: Path,
+    rate: int,
+    image_dir: Path = Path(__file__).parent / "images",
+    sequential: bool = False,
 ) -> List[Path]:
     """
     This function extracts the frames of the specified video.
     It expects a rate in frames per second.\n
+    If sequential is True, the video is decoded in a single pass instead of
+    seeking to every timestamp.\n
     It returns a list of paths to the extracted frames.
     """
 
-    if not video.exists():
-        raise Exception("Error: video does not exist")
-
-    if not video.is_file() and video.suffix in video_formats:
-        raise Exception("Error: video is not a video file")
+    check_video(video)
 
     if not image_dir.exists():
         os.makedirs(image_dir)
 
-    clip = VideoFileClip(video.absolute().as_posix())
     image_paths = []
-    for i in range(int(rate * clip.duration)):
-        time = i / rate
-        image_path = image_dir / Path(f"{video.stem}_{time}.png")
-        clip.save_frame(image_path, time)
-        image_paths.append(image_path)
+    if sequential:
+        for time, frame in iter_frames(video, rate):
+            image_path = image_dir / Path(f"{video.stem}_{time}.png")
+            cv2.imwrite(str(image_path), frame)
+            image_paths.append(image_path)
+    else:
+        clip = VideoFileClip(video.absolute().as_posix())
+        for i in range(int(rate * clip.duration)):
+            time = i / rate
+            image_path = image_dir / Path(f"{video.stem}_{time}.png")
+            clip.save_frame(image_path, time)
+            image_paths.append(image_path)
 
     return image_paths
 
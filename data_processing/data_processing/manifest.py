@@ -0,0 +1,92 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_identity(path: Path) -> Dict[str, int]:
+    """
+    Returns the size and modification time of a file, used to detect when it changes.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class Manifest:
+    """
+    Records the inputs, parameters and outputs of each processed item (e.g. a video or a frame),
+    so that a re-run can skip the items that are up to date and only redo the ones that changed
+    or that a crash left unfinished.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+        if path.is_file():
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_up_to_date(
+        self, key: str, inputs: List[Path], params: Dict[str, Any]
+    ) -> bool:
+        """
+        Checks that the item was completed with the same inputs and parameters,
+        and that all of its outputs still exist.
+        """
+        entry = self.entries.get(key)
+        if entry is None or not entry["complete"] or entry["params"] != params:
+            return False
+
+        try:
+            identities = [file_identity(path) for path in inputs]
+        except FileNotFoundError:
+            return False
+
+        return entry["inputs"] == identities and all(
+            (self.path.parent / output).exists() for output in entry["outputs"]
+        )
+
+    def outputs(self, key: str) -> Optional[List[Path]]:
+        """
+        Returns the recorded outputs of an item, or None if it was never recorded.
+        """
+        if key not in self.entries:
+            return None
+
+        return [self.path.parent / output for output in self.entries[key]["outputs"]]
+
+    def record(
+        self,
+        key: str,
+        inputs: List[Path],
+        params: Dict[str, Any],
+        outputs: Optional[List[Path]] = None,
+        complete: bool = True,
+    ):
+        """
+        Records an item. Items should be recorded as incomplete before they are processed,
+        so that a crash leaves them marked as unfinished.
+        Outputs are stored relative to the manifest's directory.
+        """
+        self.entries[key] = {
+            "inputs": [file_identity(path) for path in inputs],
+            "params": params,
+            "outputs": [
+                os.path.relpath(output, self.path.parent) for output in outputs or []
+            ],
+            "complete": complete,
+        }
+
+    def save(self):
+        """
+        Writes the manifest, replacing the previous one in a single step.
+        """
+        os.makedirs(self.path.parent, exist_ok=True)
+
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
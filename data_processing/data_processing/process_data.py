@@ -4,7 +4,9 @@ import argparse
 from pathlib import Path
 
 import data_processing.face as face
+from data_processing.face.process_data import COPY_MODES, STORAGE_FORMATS
 import data_processing.pupil as pupil
+from data_processing.pupil.process_data import BACKENDS
 
 
 def process_data(
@@ -18,9 +20,21 @@ def process_data(
     log: bool = False,
     plot_matlab: bool = False,
     plot_result: bool = False,
+    sequential_decode: bool = False,
+    workers: int = 1,
+    stream_crop: bool = False,
+    keep_frames: bool = False,
+    track_faces: bool = False,
+    detection_scale: float = 1.0,
+    incremental: bool = False,
+    storage: str = "png",
+    copy_mode: str = "copy",
+    pupil_backend: str = "matlab",
+    cache_gaze: bool = False,
+    keep_pupil_intermediate: bool = False,
 ):
-    face.process_data(video_dir, output_path, binary_face, skip_get_frames, skip_crop_images, use_crop_ui, log)
-    pupil.process_data(pupil_dir, plot_matlab, plot_result)
+    face.process_data(video_dir, output_path, binary_face, skip_get_frames, skip_crop_images, use_crop_ui, log, sequential_decode, workers, stream_crop, keep_frames, track_faces, detection_scale, incremental, storage, copy_mode)
+    pupil.process_data(pupil_dir, plot_matlab, plot_result, incremental, pupil_backend, cache_gaze, workers, keep_pupil_intermediate)
 
 
 def parse_arguments():
@@ -66,6 +80,79 @@ def parse_arguments():
     parser.add_argument(
         "-r", "--plot-result", action="store_true", help="Whether to plot results."
     )
+    parser.add_argument(
+        "-s",
+        "--sequential-decode",
+        action="store_true",
+        help="Decode each video in a single pass instead of seeking to every frame.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of processes used to extract and crop the frames of the videos, "
+            "and to process the pupil data of the participants."
+        ),
+    )
+    parser.add_argument(
+        "--stream-crop",
+        action="store_true",
+        help="Crop the frames as they are decoded instead of saving them first.",
+    )
+    parser.add_argument(
+        "--keep-frames",
+        action="store_true",
+        help="With --stream-crop, also save the full frames.",
+    )
+    parser.add_argument(
+        "-t",
+        "--track-faces",
+        action="store_true",
+        help="Search for each face around the face in the previous frame.",
+    )
+    parser.add_argument(
+        "-d",
+        "--detection-scale",
+        type=float,
+        default=1.0,
+        help="Scale of the downscaled copy used to detect faces (e.g. 0.25).",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Skip the videos, frames and participants that are up to date in their manifest.",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=STORAGE_FORMATS,
+        default="png",
+        help="Store the frames of each video as images or as a single frame stack.",
+    )
+    parser.add_argument(
+        "--copy-mode",
+        choices=COPY_MODES,
+        default="copy",
+        help="Copy, link or copy in parallel the cropped images into the output path.",
+    )
+    parser.add_argument(
+        "--pupil-backend",
+        choices=BACKENDS,
+        default="matlab",
+        help="Remove the pupil outliers with the MATLAB engine or with NumPy.",
+    )
+    parser.add_argument(
+        "--cache-gaze",
+        action="store_true",
+        help="With the numpy pupil backend, read the gaze files through a columnar cache.",
+    )
+    parser.add_argument(
+        "--keep-pupil-intermediate",
+        action="store_true",
+        help="Also write the intermediate mat, data and segments files of the pupil data.",
+    )
     return parser.parse_args()
 
 
@@ -84,4 +171,16 @@ if __name__ == "__main__":
         args.log,
         args.plot_matlab,
         args.plot_result,
+        args.sequential_decode,
+        args.workers,
+        args.stream_crop,
+        args.keep_frames,
+        args.track_faces,
+        args.detection_scale,
+        args.incremental,
+        args.storage,
+        args.copy_mode,
+        args.pupil_backend,
+        args.cache_gaze,
+        args.keep_pupil_intermediate,
     )
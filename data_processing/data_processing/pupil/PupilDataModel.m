@@ -159,11 +159,16 @@ classdef PupilDataModel < handle
     methods
         
         %==================================================================
-        function obj = PupilDataModel(filepath,filename,settings)
+        function obj = PupilDataModel(filepath,filename,settings,rawFile)
             % Constructs a PupilDataModel instance given the filename,
             % filepath and settings.
             %
             %   obj = PupilDataModel(filepath,filename,settings)
+            %   obj = PupilDataModel(filepath,filename,settings,rawFile)
+            %
+            %    If a RawFileModel is given as rawFile, its data is used
+            %    instead of loading the mat file, and the filename is only
+            %    used as a label.
             %
             %    To construct multiple objects, use the static batch
             %    constructor method.
@@ -181,7 +186,11 @@ classdef PupilDataModel < handle
                 obj.filepath = [filepath '\'];
                 
                 % Load the data from the mat file:
-                s = load([filepath filename]);
+                if nargin>3
+                    s = rawFile;
+                else
+                    s = load([filepath filename]);
+                end
                 
                 % Save data to object:
                 obj.timestamps_RawData_ms = s.diameter.t_ms;
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import numpy as np
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from data_processing.pupil.process_data import (
+    BACKENDS,
+    DATA_FILE_FORMAT,
+    MAT_FILE_FORMAT,
+    SEGMENTS_FILE_FORMAT,
+)
+from data_processing.pupil.preprocess import preprocess_gaze_file
+
+
+def write_synthetic_gaze_file(
+    gaze_path: Path, seconds_per_media: float, rate: int = 150, num_media: int = 7
+):
+    """
+    Writes a GazePoint-like csv file with a slowly varying pupil diameter per eye,
+    blinks (missing samples), and outliers, for num_media videos of the same length.
+    """
+    rng = np.random.default_rng(496)
+    media_time = np.arange(int(seconds_per_media * rate)) / rate
+
+    with open(gaze_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["MEDIA_ID", "MEDIA_NAME", "TIME", "LPD", "RPD"])
+        for media in range(num_media):
+            left = 25 + 3 * np.sin(2 * np.pi * media_time / 7) + rng.normal(0, 0.2, len(media_time))
+            right = left + 1.5 + rng.normal(0, 0.2, len(media_time))
+
+            # Blinks of 100-300 ms every few seconds
+            for blink_start in rng.integers(0, len(media_time), int(seconds_per_media / 4)):
+                blink_end = blink_start + int(rate * rng.uniform(0.1, 0.3))
+                left[blink_start:blink_end] = 0
+                right[blink_start:blink_end] = 0
+
+            # Outliers
+            outliers = rng.integers(0, len(media_time), int(seconds_per_media))
+            left[outliers] += rng.choice([-8, 8], len(outliers))
+
+            writer.writerows(
+                (media, f"{media + 1}.mp4", f"{t:.5f}", f"{l:.5f}", f"{r:.5f}")
+                for t, l, r in zip(media_time, left, right)
+            )
+
+
+def benchmark_backends(gaze_path: Path, backends=BACKENDS):
+    """
+    Times the preprocessing of a gaze file with each backend.
+    The time of the matlab backend includes starting the engine.
+    """
+    data_dir = gaze_path.parent
+    inits = "benchmark"
+
+    for backend in backends:
+        start = time.perf_counter()
+        if backend == "matlab":
+            import matlab.engine
+
+            eng = matlab.engine.start_matlab()
+            eng.addpath(str(Path(__file__).parent))
+            eng.process_data(
+                str(os.path.join(data_dir, "")),
+                gaze_path.name,
+                MAT_FILE_FORMAT.format(inits),
+                DATA_FILE_FORMAT.format(inits),
+                SEGMENTS_FILE_FORMAT.format(inits),
+                False,
+                nargout=0,
+            )
+            eng.quit()
+        else:
+            preprocess_gaze_file(
+                data_dir,
+                gaze_path.name,
+                DATA_FILE_FORMAT.format(inits),
+                SEGMENTS_FILE_FORMAT.format(inits),
+            )
+        elapsed = time.perf_counter() - start
+
+        with open(data_dir / DATA_FILE_FORMAT.format(inits), "r") as f:
+            num_samples = sum(1 for _ in f) - 1
+        print(f"{backend}: {elapsed:.2f}s, {num_samples} valid mean samples")
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the pupil processing backends.")
+    parser.add_argument(
+        "gaze_file",
+        type=Path,
+        nargs="?",
+        help="Gaze csv file to process. A synthetic file is used if not given.",
+    )
+    parser.add_argument(
+        "-s",
+        "--seconds",
+        type=float,
+        default=600,
+        help="Length of each video in the synthetic gaze file.",
+    )
+    parser.add_argument(
+        "-b",
+        "--backends",
+        nargs="+",
+        choices=BACKENDS,
+        default=["numpy"],
+        help="Backends to benchmark.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.gaze_file is not None:
+        benchmark_backends(args.gaze_file, args.backends)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            gaze_path = Path(data_dir) / "benchmark_all_gaze.csv"
+            write_synthetic_gaze_file(gaze_path, args.seconds)
+            benchmark_backends(gaze_path, args.backends)
@@ -0,0 +1,222 @@
+import csv
+from dataclasses import dataclass
+import json
+import numpy as np
+import os
+from pathlib import Path
+import re
+import shutil
+from typing import Dict, Iterator, List, Optional
+
+from data_processing.manifest import file_identity
+
+GAZE_CHUNK_ROWS = 100_000
+GAZE_CACHE_DIR_FORMAT = "{}_cache"
+GAZE_CACHE_INFO_FILE = "info.json"
+GAZE_CACHE_COLUMNS = {
+    "time": np.float64,
+    "left_diameters": np.float64,
+    "right_diameters": np.float64,
+    "media_codes": np.int32,
+}
+
+# GazePoint exports the TIME column with the recording's date, e.g. TIME(2023/11/20 10:11:12.123)
+TIME_COLUMN_PATTERN = re.compile(r"TIME\(.+\)")
+
+
+@dataclass
+class GazeData:
+    time: np.ndarray
+    left_diameters: np.ndarray
+    right_diameters: np.ndarray
+    # The index of each row's media name in media_names
+    media_codes: np.ndarray
+    media_names: List[str]
+
+
+def normalize_header(header: List[str]) -> List[str]:
+    """
+    Renames the TIME(<date>) column of a GazePoint header to TIME.
+    """
+    return ["TIME" if TIME_COLUMN_PATTERN.fullmatch(name) else name for name in header]
+
+
+def to_float_array(values: List[str]) -> np.ndarray:
+    """
+    Converts csv values to floats, treating empty values as missing (like MATLAB's readtable).
+    """
+    return np.array([value if value.strip() else "nan" for value in values], dtype=np.float64)
+
+
+def iter_gaze_chunks(
+    gaze_path: Path, chunk_rows: int = GAZE_CHUNK_ROWS
+) -> Iterator[GazeData]:
+    """
+    Reads the TIME, LPD, RPD and MEDIA_NAME columns of a GazePoint csv file in chunks of rows,
+    so that only one chunk of the csv is held in memory at a time.
+    The header is normalized as it is read, without changing the file.
+    Media codes are consistent across chunks, and each chunk's media_names is the list of
+    all the names seen so far.
+    """
+    media_codes: Dict[str, int] = {}
+    with open(gaze_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = normalize_header(next(reader))
+        columns = [header.index(name) for name in ("TIME", "LPD", "RPD", "MEDIA_NAME")]
+
+        while True:
+            rows = [row for _, row in zip(range(chunk_rows), reader)]
+            if not rows:
+                break
+
+            time, left, right, names = (
+                [row[i] for row in rows] for i in columns
+            )
+            codes = np.array(
+                [media_codes.setdefault(name, len(media_codes)) for name in names],
+                dtype=GAZE_CACHE_COLUMNS["media_codes"],
+            )
+            yield GazeData(
+                to_float_array(time),
+                to_float_array(left),
+                to_float_array(right),
+                codes,
+                list(media_codes),
+            )
+
+
+def gaze_cache_dir(gaze_path: Path) -> Path:
+    return gaze_path.parent / GAZE_CACHE_DIR_FORMAT.format(gaze_path.stem)
+
+
+def write_gaze_cache(gaze_path: Path, chunk_rows: int = GAZE_CHUNK_ROWS):
+    """
+    Converts a GazePoint csv file to a columnar cache, with one raw file per column
+    and an info file with the number of rows, the media names and the csv's identity.
+    """
+    cache_dir = gaze_cache_dir(gaze_path)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+
+    num_rows = 0
+    media_names: List[str] = []
+    column_files = {
+        column: open(cache_dir / f"{column}.dat", "wb") for column in GAZE_CACHE_COLUMNS
+    }
+    try:
+        for chunk in iter_gaze_chunks(gaze_path, chunk_rows):
+            for column, f in column_files.items():
+                f.write(getattr(chunk, column).tobytes())
+            num_rows += len(chunk.time)
+            media_names = chunk.media_names
+    finally:
+        for f in column_files.values():
+            f.close()
+
+    # The info file is written last, so that an interrupted conversion is not used
+    info = {
+        "source": file_identity(gaze_path),
+        "rows": num_rows,
+        "media_names": media_names,
+    }
+    with open(cache_dir / GAZE_CACHE_INFO_FILE, "w") as f:
+        json.dump(info, f)
+
+
+def load_gaze_cache(gaze_path: Path) -> Optional[GazeData]:
+    """
+    Memory-maps the columnar cache of a GazePoint csv file.
+    Returns None if there is no cache, or if the csv changed since the cache was written.
+    """
+    cache_dir = gaze_cache_dir(gaze_path)
+    try:
+        with open(cache_dir / GAZE_CACHE_INFO_FILE, "r") as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if info["source"] != file_identity(gaze_path):
+        return None
+
+    columns = {
+        column: np.memmap(
+            cache_dir / f"{column}.dat", dtype=dtype, mode="r", shape=(info["rows"],)
+        )
+        if info["rows"] > 0
+        else np.empty(0, dtype=dtype)
+        for column, dtype in GAZE_CACHE_COLUMNS.items()
+    }
+    return GazeData(media_names=info["media_names"], **columns)
+
+
+def read_gaze_file(gaze_path: Path, use_cache: bool = False) -> GazeData:
+    """
+    Reads a GazePoint csv file.
+    If use_cache is set, the file is converted to a columnar cache the first time it is read,
+    and the cache is memory-mapped instead of parsing the csv on later reads.
+    """
+    if use_cache:
+        gaze = load_gaze_cache(gaze_path)
+        if gaze is None:
+            write_gaze_cache(gaze_path)
+            gaze = load_gaze_cache(gaze_path)
+        return gaze
+
+    chunks = list(iter_gaze_chunks(gaze_path))
+    if not chunks:
+        return GazeData(
+            *(np.empty(0, dtype=dtype) for dtype in GAZE_CACHE_COLUMNS.values()), []
+        )
+
+    return GazeData(
+        np.concatenate([chunk.time for chunk in chunks]),
+        np.concatenate([chunk.left_diameters for chunk in chunks]),
+        np.concatenate([chunk.right_diameters for chunk in chunks]),
+        np.concatenate([chunk.media_codes for chunk in chunks]),
+        chunks[-1].media_names,
+    )
+
+
+def header_needs_normalizing(gaze_path: Path) -> bool:
+    """
+    Checks whether the TIME column of a GazePoint csv file still has the date in its name.
+    """
+    with open(gaze_path, "r", newline="") as f:
+        header = next(csv.reader(f), [])
+
+    return normalize_header(header) != header
+
+
+def write_normalized_gaze_file(gaze_path: Path, output_path: Path) -> bool:
+    """
+    Copies a GazePoint csv file with a normalized header, one line at a time.
+    The identities of the csv and its copy are recorded in an info file next to the copy,
+    and the copy is only rewritten if either of them changed.
+    Returns whether the copy was written.
+    """
+    info_path = output_path.with_suffix(".json")
+    try:
+        with open(info_path, "r") as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        info = None
+
+    if output_path.is_file() and info == {
+        "source": file_identity(gaze_path),
+        "output": file_identity(output_path),
+    }:
+        return False
+
+    with open(gaze_path, "r", newline="") as f, open(output_path, "w", newline="") as out:
+        header_line = f.readline()
+        line_terminator = "\r\n" if header_line.endswith("\r\n") else "\n"
+        header = normalize_header(next(csv.reader([header_line])))
+        csv.writer(out, lineterminator=line_terminator).writerow(header)
+        shutil.copyfileobj(f, out)
+
+    # The info file is written last, so that an interrupted copy is not used
+    with open(info_path, "w") as f:
+        json.dump(
+            {"source": file_identity(gaze_path), "output": file_identity(output_path)}, f
+        )
+    return True
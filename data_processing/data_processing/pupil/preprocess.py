@@ -0,0 +1,412 @@
+import csv
+from dataclasses import dataclass
+import numpy as np
+from pathlib import Path
+from scipy.signal import butter, filtfilt
+from typing import List, Tuple
+
+from data_processing.pupil.gaze_file import GazeData, read_gaze_file
+
+
+@dataclass
+class RawFilterSettings:
+    """
+    The settings of the raw data filter, with the defaults of rawDataFilter.m.
+    """
+
+    pupil_diameter_min: float = 1.5
+    pupil_diameter_max: float = 9
+    island_filter_island_separation_ms: float = 40
+    island_filter_min_island_width_ms: float = 50
+    dilation_speed_filter_mad_multiplier: float = 16
+    dilation_speed_filter_max_gap_ms: float = 200
+    gap_detect_min_width: float = 75
+    gap_detect_max_width: float = 2000
+    gap_padding_backward: float = 50
+    gap_padding_forward: float = 50
+    residuals_filter_passes: int = 4
+    residuals_filter_mad_multiplier: float = 16
+    residuals_filter_interp_fs: float = 100
+    residuals_filter_lowpass_cf: float = 16
+
+
+# The settings used by process_data.m
+PROCESS_DATA_SETTINGS = RawFilterSettings(
+    pupil_diameter_min=12,
+    pupil_diameter_max=np.inf,
+    dilation_speed_filter_mad_multiplier=4,
+    residuals_filter_mad_multiplier=4,
+)
+
+
+def build_timeline(
+    gaze: GazeData,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """
+    Concatenates the per-media times of the gaze data into a single time vector.
+    A new segment starts at the first sample of each media name, one sample period after
+    the end of the previous segment, and the times are kept at least 1 ms apart.
+    Returns the time vector (in ms), the left and right diameters, and the start and end
+    times (in s) and names of the segments.
+    """
+    # Remove erroneous data at the beginning of the csv
+    start_idx = int(np.argmax(gaze.time != 0))
+    time = gaze.time[start_idx:]
+    codes = gaze.media_codes[start_idx:]
+
+    # The segments start at the first row of each media name
+    _, first_rows = np.unique(codes, return_index=True)
+    boundaries = np.sort(first_rows)[1:]
+
+    segment_start = [time[0]]
+    segment_end = []
+    for row in boundaries:
+        end_time = segment_start[-1] + time[row - 1]
+        segment_start.append(end_time + time[row - 1] - time[row - 2])
+        segment_end.append(end_time)
+    segment_end.append(segment_start[-1] + time[-1])
+    segment_start = np.array(segment_start)
+    segment_end = np.array(segment_end)
+    segment_names = [
+        gaze.media_names[codes[row]] for row in np.concatenate([[0], boundaries])
+    ]
+
+    # Offset each time by the start of its segment
+    segment_idx = np.searchsorted(boundaries, np.arange(len(time)), side="right")
+    t_ms = (segment_start[segment_idx] + time) * 1000
+    t_ms[0] = time[0] * 1000
+
+    # Make sure the times are at least 1 ms apart, i.e. t[i] = max(t[i], t[i-1] + 1)
+    offsets = np.arange(len(t_ms))
+    t_ms = np.maximum.accumulate(t_ms - offsets) + offsets
+
+    return (
+        t_ms,
+        gaze.left_diameters[start_idx:],
+        gaze.right_diameters[start_idx:],
+        segment_start,
+        segment_end,
+        segment_names,
+    )
+
+
+def mad_calc(d: np.ndarray, n: float) -> Tuple[float, float, float]:
+    """
+    Calculates the median, the median absolute deviation and the rejection threshold.
+    """
+    with np.errstate(invalid="ignore"):
+        med_d = np.nanmedian(d) if np.any(~np.isnan(d)) else np.nan
+        mad = np.nanmedian(np.abs(d - med_d)) if not np.isnan(med_d) else np.nan
+
+    return med_d, mad, med_d + n * mad
+
+
+def remove_loners(
+    t_ms: np.ndarray, is_valid: np.ndarray, settings: RawFilterSettings
+) -> np.ndarray:
+    """
+    Removes the islands of valid samples that are separated from the other samples
+    and narrower than the minimum island width.
+    """
+    valid_idx = np.flatnonzero(is_valid)
+    if len(valid_idx) < 3:
+        return is_valid
+
+    t_valid = t_ms[valid_idx]
+
+    # Detect the island borders
+    the_sea = np.diff(t_valid) > settings.island_filter_island_separation_ms
+    shore_left = np.concatenate([[True], the_sea])
+    shore_right = np.concatenate([the_sea, [True]])
+
+    # Measure each island, with the same edge margins as the MATLAB bins
+    widths = (t_valid[shore_right] + 0.001) - (t_valid[shore_left] - 0.001) - 0.002
+    island_num = np.cumsum(shore_left) - 1
+    tiny_islanders = widths[island_num] < settings.island_filter_min_island_width_ms
+
+    is_valid = is_valid.copy()
+    is_valid[valid_idx[tiny_islanders]] = False
+    return is_valid
+
+
+def expand_gaps(
+    t_ms: np.ndarray, is_valid: np.ndarray, settings: RawFilterSettings
+) -> np.ndarray:
+    """
+    Removes the samples around the gaps in the valid samples, which may be artifacts.
+    """
+    valid_idx = np.flatnonzero(is_valid)
+    valid_t = t_ms[valid_idx]
+
+    gaps = np.diff(valid_t)
+    needs_padding = (gaps > settings.gap_detect_min_width) & (
+        gaps < settings.gap_detect_max_width
+    )
+    if not np.any(needs_padding):
+        return is_valid
+
+    # The gaps are sorted and do not overlap, so a sample is near a gap if it is before
+    # the padded end of the last gap whose padded start is before the sample
+    padded_starts = valid_t[:-1][needs_padding] - settings.gap_padding_backward
+    padded_ends = valid_t[1:][needs_padding] + settings.gap_padding_forward
+    last_gap = np.searchsorted(padded_starts, valid_t, side="left") - 1
+    is_near_gap = (last_gap >= 0) & (valid_t < padded_ends[np.maximum(last_gap, 0)])
+
+    is_valid = is_valid.copy()
+    is_valid[valid_idx[is_near_gap]] = False
+    return is_valid
+
+
+def remove_out_of_bounds(
+    t_ms: np.ndarray,
+    diameters: np.ndarray,
+    is_valid: np.ndarray,
+    settings: RawFilterSettings,
+) -> np.ndarray:
+    """
+    Removes the samples outside of the acceptable pupil diameter range.
+    """
+    if settings.pupil_diameter_max <= settings.pupil_diameter_min:
+        raise ValueError("The maximum must be larger than the minimum")
+
+    with np.errstate(invalid="ignore"):
+        is_valid = (
+            (diameters <= settings.pupil_diameter_max)
+            & (diameters >= settings.pupil_diameter_min)
+            & ~np.isnan(diameters)
+            & is_valid
+        )
+
+    if np.any(np.diff(t_ms[is_valid]) == 0):
+        raise ValueError("Time vector not strictly increasing")
+
+    return remove_loners(t_ms, is_valid, settings)
+
+
+def mad_speed_filter(
+    t_ms: np.ndarray,
+    diameters: np.ndarray,
+    is_valid: np.ndarray,
+    settings: RawFilterSettings,
+) -> np.ndarray:
+    """
+    Removes the samples with outlying dilation speeds, such as blinks.
+    """
+    if not np.any(is_valid):
+        return is_valid
+
+    cur_diameters = diameters[is_valid]
+    cur_t_ms = t_ms[is_valid]
+
+    # Calculate the dilation speeds, over gaps that are not too large
+    dt = np.diff(cur_t_ms)
+    speeds = np.diff(cur_diameters) / dt
+    speeds[dt > settings.dilation_speed_filter_max_gap_ms] = np.nan
+
+    # Use the largest of the backward and forward speeds of each sample
+    max_dilation_speeds = np.full(len(diameters), np.nan)
+    max_dilation_speeds[is_valid] = np.fmax(
+        np.abs(np.concatenate([[np.nan], speeds])),
+        np.abs(np.concatenate([speeds, [np.nan]])),
+    )
+
+    _, _, thresh = mad_calc(
+        max_dilation_speeds, settings.dilation_speed_filter_mad_multiplier
+    )
+    with np.errstate(invalid="ignore"):
+        is_valid = is_valid & (max_dilation_speeds <= thresh)
+
+    is_valid = remove_loners(t_ms, is_valid, settings)
+    return expand_gaps(t_ms, is_valid, settings)
+
+
+def deviation_calculator(
+    t_ms: np.ndarray,
+    diameters: np.ndarray,
+    is_valid: np.ndarray,
+    t_interp: np.ndarray,
+    b: np.ndarray,
+    a: np.ndarray,
+) -> np.ndarray:
+    """
+    Calculates the deviation of each sample from a smooth trendline through the valid samples.
+    """
+    is_valid = is_valid & ~np.isnan(diameters)
+
+    # Interpolate the valid samples to a uniform signal, extrapolating the nearest value
+    uniform_baseline = np.interp(t_interp, t_ms[is_valid], diameters[is_valid])
+
+    # Low pass filter the uniform signal and map it back to the original time vector
+    smooth_uniform_baseline = filtfilt(
+        b, a, uniform_baseline, padlen=3 * (max(len(a), len(b)) - 1)
+    )
+    smooth_baseline = np.interp(
+        t_ms, t_interp, smooth_uniform_baseline, left=np.nan, right=np.nan
+    )
+
+    return np.abs(diameters - smooth_baseline)
+
+
+def mad_deviation_filter(
+    t_ms: np.ndarray,
+    diameters: np.ndarray,
+    is_valid: np.ndarray,
+    settings: RawFilterSettings,
+) -> np.ndarray:
+    """
+    Removes the samples with outlying deviations from a smooth trendline, over several passes.
+    """
+    if np.sum(is_valid) < 3:
+        return is_valid
+
+    b, a = butter(
+        1,
+        settings.residuals_filter_lowpass_cf / (settings.residuals_filter_interp_fs / 2),
+    )
+    step = 1000 / settings.residuals_filter_interp_fs
+    t_interp = t_ms[0] + step * np.arange(
+        np.floor((t_ms[-1] - t_ms[0]) / step + 1e-10) + 1
+    )
+
+    # Remove the previously rejected samples, these are no longer to be considered
+    diameters = np.where(is_valid, diameters, np.nan)
+
+    is_valid_running = is_valid
+    for i in range(settings.residuals_filter_passes):
+        is_valid_start = is_valid_running
+
+        residuals = deviation_calculator(
+            t_ms, diameters, is_valid_running & is_valid, t_interp, b, a
+        )
+        _, _, thresh = mad_calc(residuals, settings.residuals_filter_mad_multiplier)
+
+        with np.errstate(invalid="ignore"):
+            is_valid_running = (residuals <= thresh) & is_valid
+        is_valid_running = remove_loners(t_ms, is_valid_running, settings)
+
+        # Stop when a pass has no effect
+        if i > 0 and np.array_equal(is_valid_start, is_valid_running):
+            break
+
+    return is_valid_running
+
+
+def raw_data_filter(
+    t_ms: np.ndarray,
+    diameters: np.ndarray,
+    settings: RawFilterSettings = PROCESS_DATA_SETTINGS,
+) -> np.ndarray:
+    """
+    Filters the raw diameters of one eye with the range, dilation speed and deviation filters.
+    Returns which samples are valid.
+    """
+    is_valid = ~np.isnan(diameters)
+    is_valid = remove_out_of_bounds(t_ms, diameters, is_valid, settings)
+    is_valid = mad_speed_filter(t_ms, diameters, is_valid, settings)
+    return mad_deviation_filter(t_ms, diameters, is_valid, settings)
+
+
+def gen_mean_dia_samples(
+    t_ms: np.ndarray,
+    left_diameters: np.ndarray,
+    right_diameters: np.ndarray,
+    left_valid: np.ndarray,
+    right_valid: np.ndarray,
+) -> np.ndarray:
+    """
+    Calculates the mean pupil diameter of both eyes. When only one eye is valid, the other
+    is regenerated from the interpolated difference between the eyes.
+    Returns an empty array if there are not enough samples with both eyes.
+    """
+    left_diameters = np.where(left_valid, left_diameters, np.nan)
+    right_diameters = np.where(right_valid, right_diameters, np.nan)
+
+    left_without_right = ~np.isnan(left_diameters) & np.isnan(right_diameters)
+    right_without_left = ~np.isnan(right_diameters) & np.isnan(left_diameters)
+
+    diam_diff = right_diameters - left_diameters
+    diam_diff_rows = ~np.isnan(diam_diff)
+    if np.sum(diam_diff_rows) <= 2:
+        return np.array([])
+
+    diam_diff_cont = np.interp(
+        t_ms, t_ms[diam_diff_rows], diam_diff[diam_diff_rows], left=np.nan, right=np.nan
+    )
+
+    left_fixed = left_diameters.copy()
+    left_fixed[right_without_left] = (
+        right_diameters[right_without_left] - diam_diff_cont[right_without_left]
+    )
+    right_fixed = right_diameters.copy()
+    right_fixed[left_without_right] = (
+        left_diameters[left_without_right] + diam_diff_cont[left_without_right]
+    )
+
+    return (left_fixed + right_fixed) / 2
+
+
+def preprocess_gaze(
+    gaze: GazeData, settings: RawFilterSettings = PROCESS_DATA_SETTINGS
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """
+    Filters both eyes and generates the mean pupil diameters.
+    Returns the times (in ms) and diameters of the valid mean samples, and the start and
+    end times (in s) and names of the segments.
+    """
+    t_ms, left, right, segment_start, segment_end, segment_names = build_timeline(gaze)
+
+    left_valid = raw_data_filter(t_ms, left, settings)
+    right_valid = raw_data_filter(t_ms, right, settings)
+    mean_diameters = gen_mean_dia_samples(t_ms, left, right, left_valid, right_valid)
+
+    has_mean = ~np.isnan(mean_diameters)
+    times = t_ms[has_mean] if len(mean_diameters) else mean_diameters
+
+    return times, mean_diameters[has_mean], segment_start, segment_end, segment_names
+
+
+def write_preprocessed_files(
+    data_dir: Path,
+    data_csv_file: str,
+    seg_csv_file: str,
+    times: np.ndarray,
+    diameters: np.ndarray,
+    segment_start: np.ndarray,
+    segment_end: np.ndarray,
+    segment_names: List[str],
+):
+    """
+    Writes the mean pupil diameters and segments csv files of process_data.m.
+    """
+    with open(data_dir / data_csv_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["times", "diameters"])
+        writer.writerows(zip(times.tolist(), diameters.tolist()))
+
+    with open(data_dir / seg_csv_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["segmentStart", "segmentEnd", "segmentName"])
+        writer.writerows(
+            zip(segment_start.tolist(), segment_end.tolist(), segment_names)
+        )
+
+
+def preprocess_gaze_file(
+    data_dir: Path,
+    in_csv_file: str,
+    data_csv_file: str,
+    seg_csv_file: str,
+    settings: RawFilterSettings = PROCESS_DATA_SETTINGS,
+    use_cache: bool = False,
+):
+    """
+    Preprocesses a GazePoint csv file without MATLAB, writing the same mean pupil diameters
+    and segments csv files as process_data.m (with rawDataFilter.m and genMeanDiaSamples.m).
+    If use_cache is set, the csv is read through its columnar cache (see read_gaze_file).
+    """
+    write_preprocessed_files(
+        data_dir,
+        data_csv_file,
+        seg_csv_file,
+        *preprocess_gaze(read_gaze_file(data_dir / in_csv_file, use_cache), settings),
+    )
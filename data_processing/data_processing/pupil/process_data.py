@@ -1,25 +1,45 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import csv
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import logging
 import numpy as np
-import matlab.engine
-import matplotlib.pyplot as plt
+from multiprocessing.util import Finalize
 import os
 from pathlib import Path
 import pickle
 import re
 from scipy.interpolate import CubicSpline
-from typing import Dict, List
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from data_processing.diagnostics import (
+    close_plot_renderer,
+    decimate_series,
+    get_plot_renderer,
+    plot_spline,
+)
+from data_processing.manifest import Manifest, MANIFEST_FILE
+from data_processing.pupil.gaze_file import (
+    header_needs_normalizing,
+    read_gaze_file,
+    write_normalized_gaze_file,
+)
+from data_processing.pupil.preprocess import preprocess_gaze, write_preprocessed_files
+from data_processing.pupil.spline_store import convert_spline_files
 
 EXCLUSION_WORDS = ("transition",)
 
 MAT_FILE_FORMAT = "pupil_{}.mat"
+NORMALIZED_GAZE_FILE_FORMAT = "gaze_{}.csv"
 DATA_FILE_FORMAT = "data_{}.csv"
 SEGMENTS_FILE_FORMAT = "segments_{}.csv"
 OUTPUT_FILE_FORMAT = "pupil_{}_{}.pkl"
 
+BACKENDS = ("matlab", "numpy")
+
 SEG_NAME_TO_EMOTION = {
     "1.mp4": "joy",
     "2.mp4": "anger",
@@ -38,30 +58,43 @@ class Segment:
     end: float
 
 
-def process_participant(
-    eng,
-    data_dir: Path,
-    pupil_file: str,
-    inits: str,
-    plot_matlab: bool = False,
-    plot_result: bool = False,
-):
-    mat_file = MAT_FILE_FORMAT.format(inits)
-    data_file = DATA_FILE_FORMAT.format(inits)
-    segments_file = SEGMENTS_FILE_FORMAT.format(inits)
-    eng.process_data(
-        str(os.path.join(data_dir, "")),
-        pupil_file,
-        mat_file,
-        data_file,
-        segments_file,
-        plot_matlab,
-        nargout=0,
-    )
+@dataclass
+class ParticipantReport:
+    inits: str
+    output_files: List[Path] = field(default_factory=list)
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+def engine_array(values) -> np.ndarray:
+    """
+    Converts an array returned by the MATLAB engine, such as a matlab.double column,
+    to a flat NumPy array. The engine's arrays support the buffer protocol,
+    so they are not copied.
+    """
+    return np.asarray(values, dtype=np.float64).reshape(-1)
 
-    # Read the segments csv file
+
+def make_segments(
+    segment_start: np.ndarray, segment_end: np.ndarray, segment_names: List[str]
+) -> List[Segment]:
+    """
+    Creates the segments from their start and end times in s, with the times in ms.
+    """
+    return [
+        Segment(name, start * 1000, end * 1000)
+        for name, start, end in zip(
+            segment_names, segment_start.tolist(), segment_end.tolist()
+        )
+    ]
+
+
+def read_segments(segments_path: Path) -> List[Segment]:
+    """
+    Reads the segments csv file, with the start and end times in ms.
+    """
     segments: List[Segment] = []
-    with open(data_dir / segments_file, "r") as f:
+    with open(segments_path, "r") as f:
         reader = csv.DictReader(f)
         for row in reader:
             segments.append(
@@ -72,29 +105,115 @@ def process_participant(
                 )
             )
 
-    # Read the data csv file
-    curr_seg_idx = 0
-    data: Dict[Dict[List[float], List[float]]] = {
-        segments[0].name: {"times": [], "diameters": []}
-    }
-    with open(data_dir / data_file, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # Get the current segment for each time
-            time = float(row["times"])
-            if time > segments[curr_seg_idx].end:
-                curr_seg_idx += 1
-                data[segments[curr_seg_idx].name] = {"times": [], "diameters": []}
-
-            # Add the data point to the current segment
-            data[segments[curr_seg_idx].name]["times"].append(
-                time - segments[curr_seg_idx].start
-            )
-            data[segments[curr_seg_idx].name]["diameters"].append(
-                float(row["diameters"])
-            )
+    return segments
+
+
+def read_pupil_data(data_path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads the times and diameters columns of the data csv file.
+    """
+    with open(data_path, "r") as f:
+        header = f.readline().strip().split(",")
+        data = np.loadtxt(
+            f,
+            delimiter=",",
+            usecols=(header.index("times"), header.index("diameters")),
+            ndmin=2,
+        )
+
+    return data[:, 0], data[:, 1]
+
+
+def split_segments(
+    segments: List[Segment], times: np.ndarray, diameters: np.ndarray
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Splits the sorted data into segments, with the times relative to the start of the segment.
+    Each time belongs to the first segment that ends at or after it.
+    Segments without data are left out.
+    """
+    data: Dict[str, Dict[str, np.ndarray]] = {}
+    if len(times) == 0:
+        return data
+
+    starts = np.array([segment.start for segment in segments])
+    ends = np.array([segment.end for segment in segments])
+
+    # Find the segment of each time, and where the segment changes
+    segment_idx = np.minimum(
+        np.searchsorted(ends, times, side="left"), len(segments) - 1
+    )
+    boundaries = np.flatnonzero(np.diff(segment_idx)) + 1
+
+    for idx, seg_times, seg_diameters in zip(
+        segment_idx[np.concatenate([[0], boundaries])],
+        np.split(times, boundaries),
+        np.split(diameters, boundaries),
+    ):
+        data[segments[idx].name] = {
+            "times": seg_times - starts[idx],
+            "diameters": seg_diameters,
+        }
+
+    return data
+
+
+def process_participant(
+    eng,
+    data_dir: Path,
+    pupil_file: str,
+    inits: str,
+    plot_matlab: bool = False,
+    plot_result: bool = False,
+    cache_gaze: bool = False,
+    keep_intermediate: bool = False,
+) -> List[Path]:
+    """
+    Removes the outliers from a participant's pupil data and fits a spline to each segment.
+    The outliers are removed with the MATLAB engine, or with the NumPy backend if eng is None.
+    Either way, the filtered samples and the segments are returned in memory. If
+    keep_intermediate is set, they are also written to the data and segments csv files
+    (and the MATLAB backend writes the mat file), as process_data.m does.
+    If cache_gaze is set, the NumPy backend reads the gaze file through its columnar cache.
+    """
+    if eng is None:
+        times, diameters, segment_start, segment_end, segment_names = preprocess_gaze(
+            read_gaze_file(data_dir / pupil_file, cache_gaze)
+        )
+    else:
+        times, diameters, segment_start, segment_end, segment_names = eng.preprocess_data(
+            str(os.path.join(data_dir, "")),
+            pupil_file,
+            MAT_FILE_FORMAT.format(inits) if keep_intermediate else "",
+            plot_matlab,
+            nargout=5,
+        )
+        times, diameters, segment_start, segment_end = (
+            engine_array(values)
+            for values in (times, diameters, segment_start, segment_end)
+        )
+        # A cell array with a single name is returned as a string
+        if isinstance(segment_names, str):
+            segment_names = [segment_names]
+
+    if keep_intermediate:
+        write_preprocessed_files(
+            data_dir,
+            DATA_FILE_FORMAT.format(inits),
+            SEGMENTS_FILE_FORMAT.format(inits),
+            times,
+            diameters,
+            segment_start,
+            segment_end,
+            segment_names,
+        )
+
+    # Split the data into segments
+    segments = make_segments(segment_start, segment_end, segment_names)
+    data = split_segments(segments, times, diameters)
 
     # Write the output csv files
+    output_files = []
     for seg_name, seg_data in data.items():
         exclude = False
         for word in EXCLUSION_WORDS:
@@ -111,50 +230,251 @@ def process_participant(
             cspline = CubicSpline(seg_data["times"], seg_data["diameters"])
 
             if plot_result:
-                plt.clf()
+                # Render the plot in the background, with the discrete samples
+                # decimated to the width of the plot
                 xnew = np.linspace(0, seg_data["times"][-1], num=1001)
-                plt.plot(xnew, cspline(xnew), "o", label="spline")
-                plt.plot(
-                    seg_data["times"], seg_data["diameters"], "k", label="discrete"
+                get_plot_renderer().submit(
+                    plot_spline,
+                    Path(f"{output_file}.png"),
+                    *decimate_series(seg_data["times"], seg_data["diameters"]),
+                    xnew,
+                    cspline(xnew),
                 )
-                plt.title("Smoothed Pupil Function")
-                plt.savefig(f"./{output_file}.png")
 
             with open(output_file, "wb") as f:
                 pickle.dump(cspline, f)
+            output_files.append(output_file)
 
+    return output_files
 
-def process_data(
+
+def start_matlab_engine():
+    """
+    Starts a MATLAB engine with the pupil scripts on its path.
+    """
+    import matlab.engine
+
+    eng = matlab.engine.start_matlab()
+    eng.addpath(str(Path(__file__).parent))
+    return eng
+
+
+def no_engine():
+    """
+    The engine factory of the NumPy backend, which does not need an engine.
+    """
+    return None
+
+
+ENGINE_FACTORIES = {"matlab": start_matlab_engine, "numpy": no_engine}
+
+# The engine owned by the current worker process
+_engine = None
+
+
+def init_engine_worker(engine_factory: Callable[[], Any]):
+    """
+    Starts the engine of a pool worker, which is quit when the worker exits.
+    """
+    global _engine
+    _engine = engine_factory()
+    if _engine is not None:
+        Finalize(None, _engine.quit, exitpriority=10)
+
+
+def process_participant_in_worker(
     data_dir: Path,
+    csv_file: str,
+    inits: str,
     plot_matlab: bool = False,
     plot_result: bool = False,
+    cache_gaze: bool = False,
+    keep_intermediate: bool = False,
+) -> ParticipantReport:
+    """
+    Processes a participant with the engine of the current worker.
+    Errors are caught and reported, so that one participant does not stop the others.
+    """
+    start = time.perf_counter()
+    try:
+        # The NumPy backend normalizes the header as it reads the file, but MATLAB reads
+        # a copy with a normalized header if the TIME field still has the date in it.
+        # The copy is only rewritten when the gaze file changes.
+        pupil_file = csv_file
+        if _engine is not None and header_needs_normalizing(data_dir / csv_file):
+            pupil_file = NORMALIZED_GAZE_FILE_FORMAT.format(inits)
+            write_normalized_gaze_file(data_dir / csv_file, data_dir / pupil_file)
+
+        output_files = process_participant(
+            _engine,
+            data_dir,
+            pupil_file,
+            inits,
+            plot_matlab,
+            plot_result,
+            cache_gaze,
+            keep_intermediate,
+        )
+        return ParticipantReport(inits, output_files, seconds=time.perf_counter() - start)
+    except Exception as e:
+        return ParticipantReport(
+            inits, error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - start
+        )
+
+
+def process_participants(
+    argument_lists: List[Tuple],
+    engine_factory: Callable[[], Any],
+    workers: int = 1,
 ):
+    """
+    Processes the participants, each with the arguments of process_participant_in_worker.
+    Each worker process starts its own engine and takes the next participant when it is done.
+    With a single worker, the participants are processed in this process.
+    Yields the report of each participant as it finishes.
+    """
+    global _engine
+
+    if workers <= 1:
+        # The engine is quit when the participants are done, rather than when this
+        # process exits
+        _engine = engine_factory()
+        try:
+            for arguments in argument_lists:
+                yield process_participant_in_worker(*arguments)
+        finally:
+            if _engine is not None:
+                _engine.quit()
+            _engine = None
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_engine_worker,
+        initargs=(engine_factory,),
+    ) as executor:
+        futures = [
+            executor.submit(process_participant_in_worker, *arguments)
+            for arguments in argument_lists
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def process_data(
+    data_dir: Path,
+    plot_matlab: bool = False,
+    plot_result: bool = False,
+    incremental: bool = False,
+    backend: str = "matlab",
+    cache_gaze: bool = False,
+    workers: int = 1,
+    keep_intermediate: bool = False,
+    engine_factory: Optional[Callable[[], Any]] = None,
+) -> List[ParticipantReport]:
+    """
+    Processes the pupil data of every participant in the data directory, using a pool of
+    workers that each own an engine. By default, the engine is the MATLAB engine for the
+    matlab backend and none for the numpy backend, but a different engine_factory can be given.
+    The engines return the filtered samples in memory, and the intermediate mat and csv
+    files are only written if keep_intermediate is set.
+    The splines of all the participants are then consolidated into a spline store.
+    Returns the report of each participant, in the order that they finished.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}")
+
+    if backend == "numpy" and plot_matlab:
+        raise ValueError("Plotting the data with Matlab needs the matlab backend")
+
     # Iterate over all csv files in the data_dir
     csv_files = {}
     for file in os.listdir(data_dir):
         # If a matching data csv file is found add a new tuple for that participant
-        if match := re.search("(?P<inits>\w+)_all_gaze\.csv", Path(file).name):
+        if match := re.search(r"(?P<inits>\w+)_all_gaze\.csv", Path(file).name):
             csv_files[match["inits"]] = file
-            with open(data_dir / file, 'r+') as f:
-                lines = f.readlines()
-                f.seek(0)
-                for i, line in enumerate(lines):
-                    if i == 0 and (match := re.search(r"(?P<before_time>.*),TIME\(.+\),(?P<after_time>.*)\n", line)):
-                        f.write(match["before_time"] + ",TIME," + match["after_time"] + '\n')
-                    else:
-                        f.write(line)
-
-    # Start the matlab engine
-    eng = matlab.engine.start_matlab()
-    eng.addpath(str(Path(__file__).parent))
 
-    # Iterate over all found csv files
+    # Skip the participants that are up to date in the manifest
+    manifest = Manifest(data_dir / MANIFEST_FILE)
+    params = {
+        "segments": SEG_NAME_TO_EMOTION,
+        "exclusion_words": list(EXCLUSION_WORDS),
+        "backend": backend,
+    }
+    if incremental:
+        csv_files = {
+            inits: csv_file
+            for inits, csv_file in csv_files.items()
+            if not manifest.is_up_to_date(inits, [data_dir / csv_file], params)
+        }
+
+    if not csv_files:
+        return []
+
+    if engine_factory is None:
+        engine_factory = ENGINE_FACTORIES[backend]
+
+    # Mark the participants as unfinished in case they do not complete
     for inits, csv_file in csv_files.items():
-        # Process each participants pupillometry data
-        process_participant(eng, data_dir, csv_file, inits, plot_matlab, plot_result)
+        manifest.record(inits, [data_dir / csv_file], params, complete=False)
+    manifest.save()
+
+    # Process each participants pupillometry data
+    argument_lists = [
+        (
+            data_dir,
+            csv_file,
+            inits,
+            plot_matlab,
+            plot_result,
+            cache_gaze,
+            keep_intermediate,
+        )
+        for inits, csv_file in csv_files.items()
+    ]
+    reports = []
+    for report in process_participants(argument_lists, engine_factory, workers):
+        reports.append(report)
+        if report.error is None:
+            manifest.record(
+                report.inits,
+                [data_dir / csv_files[report.inits]],
+                params,
+                report.output_files,
+            )
+            manifest.save()
+            logging.info(
+                "[%d/%d] Finished participant %s in %.1fs",
+                len(reports),
+                len(csv_files),
+                report.inits,
+                report.seconds,
+            )
+        else:
+            logging.error(
+                "[%d/%d] Error processing participant %s: %s",
+                len(reports),
+                len(csv_files),
+                report.inits,
+                report.error,
+            )
+
+    # Wait for the plots of this process to be rendered, the workers wait when they exit
+    close_plot_renderer()
 
-    # Close the matlab engine
-    eng.quit()
+    failed = [report.inits for report in reports if report.error is not None]
+    if len(failed) < len(reports):
+        # Consolidate the splines of every participant for the training data loaders
+        convert_spline_files(data_dir)
+
+    logging.info(
+        "Processed %d participants: %d finished, %d failed%s",
+        len(reports),
+        len(reports) - len(failed),
+        len(failed),
+        f" ({', '.join(failed)})" if failed else "",
+    )
+    return reports
 
 
 def parse_args():
@@ -172,6 +492,38 @@ def parse_args():
     parser.add_argument(
         "-r", "--plot-result", action="store_true", help="Whether to plot results."
     )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Skip the participants that are up to date in the manifest.",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default="matlab",
+        help="Remove the outliers with the MATLAB engine or with NumPy.",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache-gaze",
+        action="store_true",
+        help="With the numpy backend, read the gaze files through a columnar cache.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes, each with its own engine, used to process the participants.",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-intermediate",
+        action="store_true",
+        help="Also write the intermediate mat, data and segments files of each participant.",
+    )
     return parser.parse_args()
 
 
@@ -183,4 +535,9 @@ if __name__ == "__main__":
         args.data_dir,
         args.plot_matlab,
         args.plot_result,
+        args.incremental,
+        args.backend,
+        args.cache_gaze,
+        args.workers,
+        args.keep_intermediate,
     )
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import re
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.interpolate import PPoly
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data_processing.manifest import file_identity
+
+SPLINE_STORE_BREAKPOINTS_FILE = "pupil_splines_breakpoints.npy"
+SPLINE_STORE_COEFFICIENTS_FILE = "pupil_splines_coefficients.npy"
+SPLINE_STORE_INDEX_FILE = "pupil_splines_index.npy"
+SPLINE_STORE_SOURCES_FILE = "pupil_splines_sources.json"
+
+SPLINE_FILE_PATTERN = re.compile(r"pupil_(?P<inits>\w+)_(?P<emotion>\w+)\.pkl$")
+
+# The order of the cubic polynomials, which have 4 coefficients per interval
+SPLINE_ORDER = 4
+
+
+def spline_store_paths(store_dir: Path) -> Tuple[Path, Path, Path]:
+    """
+    Returns the breakpoints, coefficients and index paths of the spline store in the directory.
+    """
+    return (
+        store_dir / SPLINE_STORE_BREAKPOINTS_FILE,
+        store_dir / SPLINE_STORE_COEFFICIENTS_FILE,
+        store_dir / SPLINE_STORE_INDEX_FILE,
+    )
+
+
+def write_spline_store(store_dir: Path, splines: Iterable[Tuple[str, str, PPoly]]):
+    """
+    Writes the (inits, emotion, spline) tuples to a spline store.
+    The breakpoints of all the splines are concatenated into one array, and their
+    coefficients into one (4, intervals) array, with an index of where each spline starts.
+    The index is written last, so that an interrupted write is not used.
+    """
+    keys: List[Tuple[str, str]] = []
+    breakpoints: List[np.ndarray] = []
+    coefficients: List[np.ndarray] = []
+    for inits, emotion, spline in splines:
+        if spline.c.shape[0] != SPLINE_ORDER or spline.c.ndim != 2:
+            raise ValueError(f"Spline for {inits} {emotion} is not a cubic 1-D spline")
+
+        keys.append((inits, emotion))
+        breakpoints.append(np.asarray(spline.x, dtype=np.float64))
+        coefficients.append(np.asarray(spline.c, dtype=np.float64))
+
+    num_breakpoints = np.array([len(x) for x in breakpoints], dtype=np.int64)
+    num_intervals = num_breakpoints - 1
+    index = np.zeros(
+        len(keys),
+        dtype=[
+            ("inits", f"U{max((len(k[0]) for k in keys), default=1)}"),
+            ("emotion", f"U{max((len(k[1]) for k in keys), default=1)}"),
+            ("breakpoint_offset", np.int64),
+            ("coefficient_offset", np.int64),
+            ("breakpoints", np.int64),
+        ],
+    )
+    index["inits"] = [inits for inits, _ in keys]
+    index["emotion"] = [emotion for _, emotion in keys]
+    index["breakpoint_offset"] = np.cumsum(num_breakpoints) - num_breakpoints
+    index["coefficient_offset"] = np.cumsum(num_intervals) - num_intervals
+    index["breakpoints"] = num_breakpoints
+
+    breakpoints_path, coefficients_path, index_path = spline_store_paths(store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    np.save(breakpoints_path, np.concatenate(breakpoints) if breakpoints else np.empty(0))
+    np.save(
+        coefficients_path,
+        np.concatenate(coefficients, axis=1)
+        if coefficients
+        else np.empty((SPLINE_ORDER, 0)),
+    )
+    np.save(index_path, index)
+
+
+def find_spline_files(pkl_dir: Path) -> Dict[Tuple[str, str], str]:
+    """
+    Returns the pickled spline files in the directory, by (inits, emotion).
+    """
+    spline_files = {}
+    for file in sorted(os.listdir(pkl_dir)):
+        if match := SPLINE_FILE_PATTERN.search(file):
+            spline_files[(match["inits"], match["emotion"])] = file
+
+    return spline_files
+
+
+def spline_file_identities(pkl_dir: Path) -> Dict[str, Dict[str, int]]:
+    """
+    Returns the identity of each pickled spline file in the directory, by file name.
+    """
+    return {
+        file: file_identity(Path(pkl_dir) / file)
+        for file in find_spline_files(pkl_dir).values()
+    }
+
+
+def read_spline_sources(store_dir: Path) -> Optional[Dict[str, Dict[str, int]]]:
+    """
+    Returns the identities of the pickled splines a store was converted from,
+    or None if it was not converted by convert_spline_files.
+    """
+    sources_path = Path(store_dir) / SPLINE_STORE_SOURCES_FILE
+    if not sources_path.is_file():
+        return None
+
+    with open(sources_path, "r") as f:
+        return json.load(f)
+
+
+def convert_spline_files(pkl_dir: Path, store_dir: Path = None) -> Path:
+    """
+    Converts the pupil_{inits}_{emotion}.pkl splines in the directory to a spline store,
+    in the same directory unless store_dir is given.
+    The identities of the pickled files are recorded next to the store, so that
+    load_spline_store can tell when it is out of date.
+    Returns the path to the index of the store.
+    """
+    if store_dir is None:
+        store_dir = pkl_dir
+
+    sources = spline_file_identities(pkl_dir)
+    sources_path = Path(store_dir) / SPLINE_STORE_SOURCES_FILE
+    if sources_path.is_file():
+        os.remove(sources_path)
+
+    def load_splines():
+        for (inits, emotion), file in find_spline_files(pkl_dir).items():
+            with open(pkl_dir / file, "rb") as f:
+                yield inits, emotion, pickle.load(f)
+
+    write_spline_store(store_dir, load_splines())
+    # Written last, so that an interrupted conversion is redone
+    with open(sources_path, "w") as f:
+        json.dump(sources, f)
+
+    return spline_store_paths(store_dir)[2]
+
+
+class ResampledSpline:
+    """
+    A spline sampled on a uniform grid with the given period, starting at time 0.
+    The samples are float32, like the inputs of the models.
+    The windows are strided views of the samples, so they are not copied until they
+    are gathered.
+    """
+
+    def __init__(self, samples: np.ndarray, period: float):
+        self.samples = samples
+        self.period = period
+
+    @property
+    def stop(self) -> float:
+        return (len(self.samples) - 1) * self.period
+
+    def window_view(self, window_size: int) -> np.ndarray:
+        """
+        Returns a (windows, window_size) view of every window of the samples.
+        """
+        return sliding_window_view(self.samples, window_size)
+
+    def window_indices(self, end_times: np.ndarray, window_size: int) -> np.ndarray:
+        """
+        Returns the row of the window view that ends at the grid sample nearest to each
+        end time.
+        """
+        end_idx = np.rint(np.asarray(end_times, dtype=np.float64) / self.period)
+        indices = end_idx.astype(np.int64) - (window_size - 1)
+        if np.any(indices < 0) or np.any(end_idx >= len(self.samples)):
+            raise ValueError("The windows must be within the resampled times")
+
+        return indices
+
+    def windows(
+        self, end_times: np.ndarray, window_size: int, out: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        Gathers the windows of window_size samples ending at the end times into one array,
+        or into the rows of out if it is given.
+        """
+        return np.take(
+            self.window_view(window_size),
+            self.window_indices(end_times, window_size),
+            axis=0,
+            out=out,
+        )
+
+
+class SplineStore:
+    """
+    Reads a spline store written by write_spline_store.
+    The breakpoints and coefficients are memory-mapped, so opening the store only reads the
+    index, and the splines are only read from disk when they are evaluated.
+    """
+
+    def __init__(self, store_dir: Path):
+        breakpoints_path, coefficients_path, index_path = spline_store_paths(store_dir)
+        self.index = np.load(index_path)
+        self.breakpoints = np.load(breakpoints_path, mmap_mode="r")
+        self.coefficients = np.load(coefficients_path, mmap_mode="r")
+        self.keys = {
+            (str(inits), str(emotion)): i
+            for i, (inits, emotion) in enumerate(
+                zip(self.index["inits"], self.index["emotion"])
+            )
+        }
+        self.resampled: Dict[Tuple[int, float], ResampledSpline] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self.keys
+
+    def find(self, inits: str, emotion: str) -> int:
+        """
+        Returns the index of the spline of the participant and emotion, or -1 if there is none.
+        """
+        return self.keys.get((inits, emotion), -1)
+
+    def participants(self) -> Dict[str, List[str]]:
+        """
+        Returns the emotions of each participant in the store.
+        """
+        participants: Dict[str, List[str]] = {}
+        for inits, emotion in self.keys:
+            participants.setdefault(inits, []).append(emotion)
+
+        return participants
+
+    def spline(self, i: int) -> PPoly:
+        """
+        Returns the i-th spline, which evaluates like the pickled CubicSpline.
+        """
+        _, _, breakpoint_offset, coefficient_offset, num_breakpoints = self.index[i]
+        return PPoly.construct_fast(
+            np.array(
+                self.coefficients[
+                    :, coefficient_offset : coefficient_offset + num_breakpoints - 1
+                ]
+            ),
+            np.array(
+                self.breakpoints[breakpoint_offset : breakpoint_offset + num_breakpoints]
+            ),
+        )
+
+    def evaluate(self, spline_indices: np.ndarray, times: np.ndarray) -> np.ndarray:
+        """
+        Evaluates many splines at many times in one call.
+        spline_indices has one spline per row of times, e.g. one per window, and the times
+        outside of a spline are extrapolated from its first or last interval, like CubicSpline.
+        """
+        spline_indices = np.asarray(spline_indices, dtype=np.int64)
+        times = np.asarray(times, dtype=np.float64)
+        if len(spline_indices) != len(times):
+            raise ValueError("There must be one spline index per row of times")
+
+        index = self.index[spline_indices]
+        # Find the interval of each time within its spline, with one searchsorted per spline
+        # over the rows of that spline
+        intervals = np.empty(times.shape, dtype=np.int64)
+        order = np.argsort(spline_indices, kind="stable")
+        splits = np.flatnonzero(np.diff(spline_indices[order])) + 1
+        for rows in np.split(order, splits):
+            if len(rows) == 0:
+                continue
+
+            _, _, breakpoint_offset, _, num_breakpoints = self.index[spline_indices[rows[0]]]
+            x = self.breakpoints[breakpoint_offset : breakpoint_offset + num_breakpoints]
+            intervals[rows] = np.clip(
+                np.searchsorted(x, times[rows], side="right") - 1, 0, num_breakpoints - 2
+            )
+
+        # Evaluate the cubic polynomials of all the intervals at once
+        shape = (-1,) + (1,) * (times.ndim - 1)
+        breakpoint_idx = index["breakpoint_offset"].reshape(shape) + intervals
+        coefficient_idx = index["coefficient_offset"].reshape(shape) + intervals
+        dx = times - self.breakpoints[breakpoint_idx]
+        c0, c1, c2, c3 = (self.coefficients[k][coefficient_idx] for k in range(SPLINE_ORDER))
+        return ((c0 * dx + c1) * dx + c2) * dx + c3
+
+    def resample(self, i: int, stop: float, period: float) -> ResampledSpline:
+        """
+        Returns the i-th spline sampled every period from time 0 to at least stop.
+        The samples are computed once and kept, unless a later stop is requested.
+        """
+        resampled = self.resampled.get((i, period))
+        if resampled is None or resampled.stop < stop:
+            grid = np.arange(int(np.ceil(stop / period)) + 1) * period
+            resampled = ResampledSpline(
+                self.evaluate(np.array([i]), grid[np.newaxis])[0].astype(np.float32),
+                period,
+            )
+            self.resampled[(i, period)] = resampled
+
+        return resampled
+
+    def windows(
+        self,
+        spline_indices: np.ndarray,
+        end_times: np.ndarray,
+        window_size: int,
+        period: float,
+    ) -> np.ndarray:
+        """
+        Evaluates a window of window_size samples ending at each end time, at the times of
+        np.linspace(end_time - period * window_size, end_time, window_size).
+        """
+        end_times = np.asarray(end_times, dtype=np.float64)
+        steps = np.linspace(-period * window_size, 0, window_size)
+        return self.evaluate(spline_indices, end_times[:, np.newaxis] + steps)
+
+
+# The stores opened by load_spline_store, with the identity of their index file
+_open_stores: Dict[Path, Tuple[Dict[str, int], SplineStore]] = {}
+
+
+def load_spline_store(pkl_dir: Path) -> SplineStore:
+    """
+    Opens the spline store of the pupil data directory, converting the pickled splines
+    to a store first if there is none, or if they changed since it was converted.
+    A store without recorded sources is only converted again if there are pickled splines.
+    The store is reused by later calls until it changes, so that the splines are only
+    resampled once per process (e.g. for the train and val sets).
+    """
+    index_path = spline_store_paths(pkl_dir)[2]
+    sources = read_spline_sources(pkl_dir)
+    current_sources = spline_file_identities(pkl_dir)
+    if not os.path.isfile(index_path) or (
+        sources != current_sources and (sources is not None or current_sources)
+    ):
+        convert_spline_files(pkl_dir)
+
+    key = Path(pkl_dir).resolve()
+    identity = file_identity(index_path)
+    if key not in _open_stores or _open_stores[key][0] != identity:
+        _open_stores[key] = (identity, SplineStore(pkl_dir))
+
+    return _open_stores[key][1]
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert the pickled pupil splines to a spline store."
+    )
+    parser.add_argument(
+        "pkl_dir", type=Path, help="Input directory containing the pickled splines."
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        help="Directory to write the store to. Defaults to the input directory.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    convert_spline_files(args.pkl_dir, args.output_dir)
@@ -0,0 +1,99 @@
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+
+from data_processing.manifest import file_identity
+from data_processing.pupil.benchmark import write_synthetic_gaze_file
+from data_processing.pupil.gaze_file import (
+    gaze_cache_dir,
+    header_needs_normalizing,
+    iter_gaze_chunks,
+    read_gaze_file,
+    write_normalized_gaze_file,
+)
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def write_dated_gaze_file(gaze_path: Path):
+    """
+    Write a synthetic gaze file with the date in the TIME field, as exported by GazePoint.
+    """
+    write_synthetic_gaze_file(gaze_path, 5)
+    with open(gaze_path, "r") as f:
+        lines = f.readlines()
+    lines[0] = lines[0].replace("TIME", "TIME(2023/11/20 10:11:12.123)")
+    with open(gaze_path, "w") as f:
+        f.writelines(lines)
+
+
+def assert_same_gaze(gaze, expected):
+    for column in ("time", "left_diameters", "right_diameters", "media_codes"):
+        assert np.array_equal(
+            getattr(gaze, column), getattr(expected, column), equal_nan=True
+        )
+    assert gaze.media_names == expected.media_names
+
+
+def test_read_gaze_file():
+    data_dir = test_files_dir / "gaze_file"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    gaze_path = data_dir / "ab_all_gaze.csv"
+    write_dated_gaze_file(gaze_path)
+    identity = file_identity(gaze_path)
+
+    # The header is normalized without changing the file
+    gaze = read_gaze_file(gaze_path)
+    assert header_needs_normalizing(gaze_path)
+    assert file_identity(gaze_path) == identity
+    assert len(gaze.time) == 7 * 5 * 150
+    assert gaze.media_names == [f"{media}.mp4" for media in range(1, 8)]
+
+    # Reading in chunks gives the same data
+    chunks = list(iter_gaze_chunks(gaze_path, 1000))
+    assert len(chunks) == 6
+    assert np.array_equal(
+        np.concatenate([chunk.media_codes for chunk in chunks]), gaze.media_codes
+    )
+
+    # The cache is written on the first read and memory-mapped on the next ones
+    assert_same_gaze(read_gaze_file(gaze_path, use_cache=True), gaze)
+    cached_gaze = read_gaze_file(gaze_path, use_cache=True)
+    assert isinstance(cached_gaze.time, np.memmap)
+    assert_same_gaze(cached_gaze, gaze)
+
+    # The cache is rewritten when the gaze file changes
+    write_synthetic_gaze_file(gaze_path, 2)
+    assert len(read_gaze_file(gaze_path, use_cache=True).time) == 7 * 2 * 150
+    assert gaze_cache_dir(gaze_path).is_dir()
+
+
+def test_write_normalized_gaze_file():
+    data_dir = test_files_dir / "gaze_file"
+    os.makedirs(data_dir, exist_ok=True)
+    gaze_path = data_dir / "cd_all_gaze.csv"
+    write_dated_gaze_file(gaze_path)
+
+    output_path = data_dir / "gaze_cd.csv"
+    output_path.unlink(missing_ok=True)
+    assert write_normalized_gaze_file(gaze_path, output_path)
+
+    assert not header_needs_normalizing(output_path)
+    assert_same_gaze(read_gaze_file(output_path), read_gaze_file(gaze_path))
+
+    # The copy is not rewritten while the gaze file and the copy are unchanged
+    mtime = os.stat(output_path).st_mtime_ns
+    assert not write_normalized_gaze_file(gaze_path, output_path)
+    assert os.stat(output_path).st_mtime_ns == mtime
+
+    # It is rewritten when the copy or the gaze file changes
+    with open(output_path, "a") as f:
+        f.write("\n")
+    assert write_normalized_gaze_file(gaze_path, output_path)
+    assert_same_gaze(read_gaze_file(output_path), read_gaze_file(gaze_path))
+
+    write_synthetic_gaze_file(gaze_path, 2)
+    assert write_normalized_gaze_file(gaze_path, output_path)
+    assert len(read_gaze_file(output_path).time) == 7 * 2 * 150
@@ -0,0 +1,436 @@
+import numpy as np
+import os
+from pathlib import Path
+import pytest
+from scipy.signal import butter, filtfilt
+import shutil
+import warnings
+
+from data_processing.pupil.benchmark import write_synthetic_gaze_file
+from data_processing.pupil.gaze_file import GazeData, read_gaze_file
+from data_processing.pupil.preprocess import (
+    build_timeline,
+    expand_gaps,
+    gen_mean_dia_samples,
+    mad_deviation_filter,
+    mad_speed_filter,
+    preprocess_gaze,
+    PROCESS_DATA_SETTINGS,
+    raw_data_filter,
+    remove_loners,
+    remove_out_of_bounds,
+)
+from data_processing.pupil.process_data import (
+    OUTPUT_FILE_FORMAT,
+    process_data,
+    SEG_NAME_TO_EMOTION,
+)
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+@pytest.fixture(scope="module")
+def gaze():
+    gaze_path = test_files_dir / "synthetic_all_gaze.csv"
+    os.makedirs(test_files_dir, exist_ok=True)
+    write_synthetic_gaze_file(gaze_path, 20)
+    return read_gaze_file(gaze_path)
+
+
+def reference_timeline(time, names):
+    """
+    The row by row loop of process_data.m.
+    """
+    start_idx = 0
+    while time[start_idx] == 0:
+        start_idx += 1
+
+    t_ms = [time[start_idx] * 1000]
+    segment_start = [time[start_idx]]
+    segment_end = []
+    segment_names = [names[start_idx]]
+    for r in range(start_idx + 1, len(time)):
+        if names[r] not in segment_names:
+            end_time = segment_start[-1] + time[r - 1]
+            segment_start.append(end_time + time[r - 1] - time[r - 2])
+            segment_end.append(end_time)
+            segment_names.append(names[r])
+
+        t_ms.append((segment_start[-1] + time[r]) * 1000)
+        if t_ms[-2] > t_ms[-1] - 1:
+            t_ms[-1] = t_ms[-2] + 1
+    segment_end.append(segment_start[-1] + time[-1])
+
+    return t_ms, segment_start, segment_end, segment_names
+
+
+def reference_remove_loners(t_ms, is_valid, settings):
+    """
+    The histc binning of removeLoners in rawDataFilter.m.
+    """
+    valid_idx = np.flatnonzero(is_valid)
+    if len(valid_idx) < 3:
+        return is_valid
+
+    t_valid = t_ms[valid_idx]
+    the_sea = np.diff(t_valid) > settings.island_filter_island_separation_ms
+    island_bins = np.stack(
+        [
+            t_valid[np.concatenate([[True], the_sea])] - 0.001,
+            t_valid[np.concatenate([the_sea, [True]])] + 0.001,
+        ],
+        axis=1,
+    ).ravel()
+    island_num = np.digitize(t_valid, island_bins)
+    tiny_islands = np.flatnonzero(
+        (np.diff(island_bins) - 0.002) < settings.island_filter_min_island_width_ms
+    ) + 1
+
+    is_valid = is_valid.copy()
+    is_valid[valid_idx[np.isin(island_num, tiny_islands)]] = False
+    return is_valid
+
+
+def reference_expand_gaps(t_ms, is_valid, settings):
+    """
+    The pairwise comparison of every sample with every gap of expandGaps in rawDataFilter.m.
+    """
+    valid_idx = np.flatnonzero(is_valid)
+    valid_t = t_ms[valid_idx]
+    gaps = np.diff(valid_t)
+    needs_padding = (gaps > settings.gap_detect_min_width) & (
+        gaps < settings.gap_detect_max_width
+    )
+    gap_starts = valid_t[:-1][needs_padding]
+    gap_ends = valid_t[1:][needs_padding]
+
+    is_near_gap = np.any(
+        (valid_t[:, np.newaxis] > gap_starts - settings.gap_padding_backward)
+        & (valid_t[:, np.newaxis] < gap_ends + settings.gap_padding_forward),
+        axis=1,
+    )
+    is_valid = is_valid.copy()
+    is_valid[valid_idx[is_near_gap]] = False
+    return is_valid
+
+
+def reference_mad_calc(d, n):
+    """
+    madCalc in rawDataFilter.m.
+    """
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        med_d = np.nanmedian(d)
+        mad = np.nanmedian(np.abs(d - med_d))
+    return med_d, mad, med_d + (n * mad)
+
+
+def reference_mad_speed_filter(t_ms, dia, is_valid_in, settings):
+    """
+    madSpeedFilter in rawDataFilter.m.
+    """
+    max_calc_dist = settings.dilation_speed_filter_max_gap_ms
+    mad_multiplier = settings.dilation_speed_filter_mad_multiplier
+    cur_diameters = dia[is_valid_in]
+    cur_t_ms = t_ms[is_valid_in]
+    max_dilation_speeds = np.full(dia.shape, np.nan)
+
+    cur_dilation_speeds = np.diff(cur_diameters) / np.diff(cur_t_ms)
+    cur_dilation_speeds[np.diff(cur_t_ms) > max_calc_dist] = np.nan
+
+    back_fwd_dilations = np.stack(
+        [
+            np.concatenate([[np.nan], cur_dilation_speeds]),
+            np.concatenate([cur_dilation_speeds, [np.nan]]),
+        ],
+        axis=1,
+    )
+    # max(..., [], 2) ignores NaNs, unless the whole row is NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        max_dilation_speeds[is_valid_in] = np.nanmax(np.abs(back_fwd_dilations), axis=1)
+
+    _, _, thresh = reference_mad_calc(max_dilation_speeds, mad_multiplier)
+    with np.errstate(invalid="ignore"):
+        is_valid_out = is_valid_in & (max_dilation_speeds <= thresh)
+
+    is_valid_out = reference_remove_loners(t_ms, is_valid_out, settings)
+    return reference_expand_gaps(t_ms, is_valid_out, settings)
+
+
+def reference_deviation_calculator(t_ms, dia, is_valid_in, t_interp, filt_a, filt_b):
+    """
+    deviationCalculator in rawDataFilter.m.
+    """
+    dia_valid = dia[is_valid_in & ~np.isnan(dia)]
+    t_valid = t_ms[is_valid_in & ~np.isnan(dia)]
+
+    # interp1 'linear' is NaN outside of the samples, where interp1 'nearest' 'extrap'
+    # takes the nearest sample
+    uniform_baseline = np.interp(t_interp, t_valid, dia_valid, left=np.nan, right=np.nan)
+    outside = np.isnan(uniform_baseline)
+    uniform_baseline[outside] = dia_valid[
+        np.abs(t_valid[:, np.newaxis] - t_interp[outside]).argmin(axis=0)
+    ]
+
+    # MATLAB's filtfilt pads 3 * (filter order) samples on each side
+    smooth_uniform_baseline = filtfilt(
+        filt_b, filt_a, uniform_baseline, padlen=3 * (max(len(filt_a), len(filt_b)) - 1)
+    )
+    smooth_baseline = np.interp(
+        t_ms, t_interp, smooth_uniform_baseline, left=np.nan, right=np.nan
+    )
+
+    return np.abs(dia - smooth_baseline)
+
+
+def reference_mad_deviation_filter(t_ms, dia, is_valid_in, settings):
+    """
+    madDeviationFilter in rawDataFilter.m.
+    """
+    n_passes = settings.residuals_filter_passes
+    smooth_filt_b, smooth_filt_a = butter(
+        1,
+        settings.residuals_filter_lowpass_cf / (settings.residuals_filter_interp_fs / 2),
+    )
+    mad_multiplier = settings.residuals_filter_mad_multiplier
+    step = 1000 / settings.residuals_filter_interp_fs
+    t_interp = np.arange(t_ms[0], t_ms[-1] + step / 2, step)
+    t_interp = t_interp[t_interp <= t_ms[-1]]
+
+    is_valid_running = is_valid_in
+    if np.sum(is_valid_in) < 3:
+        return is_valid_running
+
+    dia = dia.copy()
+    dia[~is_valid_in] = np.nan
+
+    is_done = False
+    for pass_indx in range(1, n_passes + 1):
+        if is_done:
+            continue
+
+        is_valid_start = is_valid_running
+        residuals = reference_deviation_calculator(
+            t_ms, dia, is_valid_running & is_valid_in, t_interp, smooth_filt_a, smooth_filt_b
+        )
+        _, _, thresh = reference_mad_calc(residuals, mad_multiplier)
+
+        with np.errstate(invalid="ignore"):
+            is_valid_running = (residuals <= thresh) & is_valid_in
+        is_valid_running = reference_remove_loners(t_ms, is_valid_running, settings)
+
+        if pass_indx > 1 and np.all(is_valid_start == is_valid_running):
+            is_done = True
+
+    return is_valid_running
+
+
+def reference_gen_mean_dia_samples(t_ms, l_dia, r_dia, l_valid, r_valid):
+    """
+    genMeanDiaSamples.m.
+    """
+    l_dia = l_dia.copy()
+    r_dia = r_dia.copy()
+    l_dia[~l_valid] = np.nan
+    r_dia[~r_valid] = np.nan
+
+    l_without_r = ~np.isnan(l_dia) & np.isnan(r_dia)
+    r_without_l = ~np.isnan(r_dia) & np.isnan(l_dia)
+
+    diam_diff = r_dia - l_dia
+    diam_diff_rows = ~np.isnan(diam_diff)
+
+    if np.sum(diam_diff_rows) > 2:
+        diam_diff_cont = np.interp(
+            t_ms, t_ms[diam_diff_rows], diam_diff[diam_diff_rows], left=np.nan, right=np.nan
+        )
+
+        l_fixed = l_dia.copy()
+        l_fixed[r_without_l] = r_dia[r_without_l] - diam_diff_cont[r_without_l]
+
+        r_fixed = r_dia.copy()
+        r_fixed[l_without_r] = l_dia[l_without_r] + diam_diff_cont[l_without_r]
+
+        mean_dia = np.mean(np.stack([l_fixed, r_fixed], axis=1), axis=1)
+    else:
+        mean_dia = np.array([])
+
+    return mean_dia
+
+
+def reference_raw_data_filter(t_ms, dia_samples, settings):
+    """
+    rawDataFilter.m, with removeOutOfBounds.
+    """
+    is_valid = ~np.isnan(dia_samples)
+
+    with np.errstate(invalid="ignore"):
+        too_large = dia_samples > settings.pupil_diameter_max
+        too_small = dia_samples < settings.pupil_diameter_min
+    is_valid = ~too_large & ~too_small & ~np.isnan(dia_samples) & is_valid
+    is_valid = reference_remove_loners(t_ms, is_valid, settings)
+
+    is_valid = reference_mad_speed_filter(t_ms, dia_samples, is_valid, settings)
+    return reference_mad_deviation_filter(t_ms, dia_samples, is_valid, settings)
+
+
+def test_build_timeline(gaze):
+    # Add erroneous rows at the start and a repeated time, which must be moved 1 ms later
+    gaze = GazeData(
+        np.concatenate([[0, 0], gaze.time]),
+        np.concatenate([[0, 0], gaze.left_diameters]),
+        np.concatenate([[0, 0], gaze.right_diameters]),
+        np.concatenate([gaze.media_codes[:2], gaze.media_codes]),
+        gaze.media_names,
+    )
+    gaze.time[10] = gaze.time[9]
+
+    t_ms, left, _, segment_start, segment_end, segment_names = build_timeline(gaze)
+    ref_t_ms, ref_start, ref_end, ref_names = reference_timeline(
+        gaze.time, [gaze.media_names[code] for code in gaze.media_codes]
+    )
+
+    assert np.allclose(t_ms, ref_t_ms)
+    assert np.allclose(segment_start, ref_start)
+    assert np.allclose(segment_end, ref_end)
+    assert segment_names == ref_names
+    assert len(left) == len(t_ms)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_island_and_gap_filters(gaze, seed):
+    rng = np.random.default_rng(seed)
+    t_ms = build_timeline(gaze)[0]
+
+    # Drop random runs of samples to create islands and gaps of all sizes
+    is_valid = np.ones(len(t_ms), dtype=bool)
+    for start in rng.integers(0, len(t_ms), 200):
+        is_valid[start : start + rng.integers(1, 60)] = False
+
+    assert (
+        remove_loners(t_ms, is_valid, PROCESS_DATA_SETTINGS)
+        == reference_remove_loners(t_ms, is_valid, PROCESS_DATA_SETTINGS)
+    ).all()
+    assert (
+        expand_gaps(t_ms, is_valid, PROCESS_DATA_SETTINGS)
+        == reference_expand_gaps(t_ms, is_valid, PROCESS_DATA_SETTINGS)
+    ).all()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("eye", [1, 2])
+def test_mad_filters(gaze, seed, eye):
+    rng = np.random.default_rng(seed)
+    t_ms, *diameters = build_timeline(gaze)[0:3]
+    diameters = diameters[eye - 1]
+
+    # Drop random runs of samples on top of the blinks and outliers of the gaze file
+    is_valid = ~np.isnan(diameters)
+    for start in rng.integers(0, len(t_ms), 100):
+        is_valid[start : start + rng.integers(1, 60)] = False
+    is_valid = remove_out_of_bounds(t_ms, diameters, is_valid, PROCESS_DATA_SETTINGS)
+
+    speed_valid = mad_speed_filter(t_ms, diameters, is_valid, PROCESS_DATA_SETTINGS)
+    assert np.array_equal(
+        speed_valid,
+        reference_mad_speed_filter(t_ms, diameters, is_valid, PROCESS_DATA_SETTINGS),
+    )
+
+    deviation_valid = mad_deviation_filter(
+        t_ms, diameters, speed_valid, PROCESS_DATA_SETTINGS
+    )
+    assert np.array_equal(
+        deviation_valid,
+        reference_mad_deviation_filter(t_ms, diameters, speed_valid, PROCESS_DATA_SETTINGS),
+    )
+    assert np.sum(speed_valid & ~deviation_valid) > 0
+
+
+def test_gen_mean_dia_samples(gaze):
+    t_ms, left, right, *_ = build_timeline(gaze)
+    left_valid = reference_raw_data_filter(t_ms, left, PROCESS_DATA_SETTINGS)
+    right_valid = reference_raw_data_filter(t_ms, right, PROCESS_DATA_SETTINGS)
+
+    assert np.array_equal(left_valid, raw_data_filter(t_ms, left, PROCESS_DATA_SETTINGS))
+    assert np.array_equal(right_valid, raw_data_filter(t_ms, right, PROCESS_DATA_SETTINGS))
+    assert np.array_equal(
+        gen_mean_dia_samples(t_ms, left, right, left_valid, right_valid),
+        reference_gen_mean_dia_samples(t_ms, left, right, left_valid, right_valid),
+        equal_nan=True,
+    )
+
+    # Too few samples with both eyes
+    both_valid = np.zeros(len(t_ms), dtype=bool)
+    both_valid[:2] = True
+    assert len(gen_mean_dia_samples(t_ms, left, right, both_valid, both_valid)) == 0
+
+
+def test_preprocess_gaze(gaze):
+    times, diameters, segment_start, segment_end, segment_names = preprocess_gaze(gaze)
+
+    # The whole process_data.m pipeline, from the reference transcriptions
+    ref_t_ms, ref_start, ref_end, ref_names = reference_timeline(
+        gaze.time, [gaze.media_names[code] for code in gaze.media_codes]
+    )
+    ref_t_ms = np.array(ref_t_ms)
+
+    # The erroneous rows at the start are dropped
+    start_idx = len(gaze.time) - len(ref_t_ms)
+    left = gaze.left_diameters[start_idx:]
+    right = gaze.right_diameters[start_idx:]
+    ref_mean = reference_gen_mean_dia_samples(
+        ref_t_ms,
+        left,
+        right,
+        reference_raw_data_filter(ref_t_ms, left, PROCESS_DATA_SETTINGS),
+        reference_raw_data_filter(ref_t_ms, right, PROCESS_DATA_SETTINGS),
+    )
+    has_mean = ~np.isnan(ref_mean)
+
+    assert np.allclose(times, ref_t_ms[has_mean])
+    assert np.array_equal(diameters, ref_mean[has_mean])
+    assert np.allclose(segment_start, ref_start)
+    assert np.allclose(segment_end, ref_end)
+    assert segment_names == ref_names
+
+
+def test_raw_data_filter(gaze):
+    t_ms, left, right, *_ = build_timeline(gaze)
+
+    left_valid = raw_data_filter(t_ms, left, PROCESS_DATA_SETTINGS)
+    right_valid = raw_data_filter(t_ms, right, PROCESS_DATA_SETTINGS)
+
+    # The blinks and the outliers are removed
+    assert not np.any(left[left_valid] < PROCESS_DATA_SETTINGS.pupil_diameter_min)
+    assert not np.any(right[right_valid] < PROCESS_DATA_SETTINGS.pupil_diameter_min)
+    assert np.max(np.abs(np.diff(left[left_valid]))) < 4
+
+    # Most of the samples are kept
+    assert np.mean(left_valid) > 0.8
+    assert np.mean(right_valid) > 0.8
+
+    mean_diameters = gen_mean_dia_samples(t_ms, left, right, left_valid, right_valid)
+    both_valid = left_valid & right_valid
+    assert np.allclose(
+        mean_diameters[both_valid], (left[both_valid] + right[both_valid]) / 2
+    )
+
+    # Samples with only one valid eye are regenerated from the other eye
+    only_right = right_valid & ~left_valid
+    assert np.all(~np.isnan(mean_diameters[only_right][1:-1]))
+
+
+def test_process_data_numpy_backend(gaze):
+    data_dir = test_files_dir / "numpy_backend"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    write_synthetic_gaze_file(data_dir / "ab_all_gaze.csv", 10)
+
+    process_data(data_dir, backend="numpy")
+
+    for emotion in SEG_NAME_TO_EMOTION.values():
+        assert (data_dir / OUTPUT_FILE_FORMAT.format("ab", emotion)).is_file()
+
+    with pytest.raises(ValueError):
+        process_data(data_dir, plot_matlab=True, backend="numpy")
@@ -0,0 +1,279 @@
+from functools import partial
+import json
+from multiprocessing.util import _run_finalizers
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import pytest
+import shutil
+import sys
+
+from data_processing.diagnostics import decimate_series, PlotRenderer
+from data_processing.manifest import MANIFEST_FILE
+from data_processing.pupil.benchmark import write_synthetic_gaze_file
+from data_processing.pupil.gaze_file import read_gaze_file
+from data_processing.pupil.preprocess import preprocess_gaze, preprocess_gaze_file
+from data_processing.pupil.process_data import (
+    DATA_FILE_FORMAT,
+    MAT_FILE_FORMAT,
+    OUTPUT_FILE_FORMAT,
+    process_data,
+    read_pupil_data,
+    read_segments,
+    SEG_NAME_TO_EMOTION,
+    SEGMENTS_FILE_FORMAT,
+    split_segments,
+)
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+class FakeEngine:
+    """
+    A stand-in for the MATLAB engine, which runs the NumPy preprocessing instead and returns
+    the arrays as columns, like matlab.double. It fails for participants whose gaze file
+    starts with 'bad'.
+    """
+
+    def preprocess_data(self, data_dir, in_csv_file, mat_file, plot_data, nargout=0):
+        if in_csv_file.startswith("bad"):
+            raise RuntimeError("MATLAB error")
+
+        times, diameters, segment_start, segment_end, segment_names = preprocess_gaze(
+            read_gaze_file(Path(data_dir) / in_csv_file)
+        )
+
+        # Record which process ran the participant, and the mat file it was given
+        with open(Path(data_dir) / f"engine_{Path(in_csv_file).stem}.json", "w") as f:
+            json.dump({"pid": os.getpid(), "mat_file": mat_file}, f)
+
+        return (
+            times[:, np.newaxis].tolist(),
+            diameters[:, np.newaxis].tolist(),
+            segment_start[:, np.newaxis].tolist(),
+            segment_end[:, np.newaxis].tolist(),
+            segment_names,
+        )
+
+    def quit(self):
+        pass
+
+
+class CountingEngine(FakeEngine):
+    """
+    A FakeEngine that logs the process that started it and every call to quit.
+    """
+
+    def __init__(self, log_file: Path):
+        self.log_file = log_file
+        self.log("start")
+
+    def log(self, event: str):
+        with open(self.log_file, "a") as f:
+            f.write(f"{event} {os.getpid()}\n")
+
+    def quit(self):
+        self.log("quit")
+
+
+def reference_split_segments(segments, times, diameters):
+    """
+    The row by row segment splitting that process_participant used before.
+    """
+    curr_seg_idx = 0
+    data = {segments[0].name: {"times": [], "diameters": []}}
+    for time, diameter in zip(times.tolist(), diameters.tolist()):
+        if time > segments[curr_seg_idx].end:
+            curr_seg_idx += 1
+            data[segments[curr_seg_idx].name] = {"times": [], "diameters": []}
+
+        data[segments[curr_seg_idx].name]["times"].append(
+            time - segments[curr_seg_idx].start
+        )
+        data[segments[curr_seg_idx].name]["diameters"].append(diameter)
+
+    return data
+
+
+def test_split_segments():
+    data_dir = test_files_dir / "split_segments"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    write_synthetic_gaze_file(data_dir / "ab_all_gaze.csv", 10)
+    preprocess_gaze_file(data_dir, "ab_all_gaze.csv", "data_ab.csv", "segments_ab.csv")
+
+    segments = read_segments(data_dir / "segments_ab.csv")
+    times, diameters = read_pupil_data(data_dir / "data_ab.csv")
+
+    data = split_segments(segments, times, diameters)
+    reference = reference_split_segments(segments, times, diameters)
+
+    assert list(data.keys()) == list(reference.keys())
+    for seg_name, seg_data in data.items():
+        assert seg_data["times"].tolist() == reference[seg_name]["times"]
+        assert seg_data["diameters"].tolist() == reference[seg_name]["diameters"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_data_engine_pool(workers):
+    data_dir = test_files_dir / f"engine_pool_{workers}"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    participants = ["ab", "cd", "ef", "bad"]
+    for inits in participants:
+        write_synthetic_gaze_file(data_dir / f"{inits}_all_gaze.csv", 5)
+
+    reports = process_data(data_dir, workers=workers, engine_factory=FakeEngine)
+
+    # Every participant is reported, and the failure does not stop the others
+    assert sorted(report.inits for report in reports) == sorted(participants)
+    for report in reports:
+        if report.inits == "bad":
+            assert "MATLAB error" in report.error
+            assert report.output_files == []
+        else:
+            assert report.error is None
+            assert sorted(report.output_files) == sorted(
+                data_dir / OUTPUT_FILE_FORMAT.format(report.inits, emotion)
+                for emotion in SEG_NAME_TO_EMOTION.values()
+            )
+
+    # Only the failed participant is left unfinished in the manifest
+    with open(data_dir / MANIFEST_FILE, "r") as f:
+        manifest = json.load(f)
+    assert {inits: entry["complete"] for inits, entry in manifest.items()} == {
+        "ab": True,
+        "cd": True,
+        "ef": True,
+        "bad": False,
+    }
+
+    # The participants are processed in worker processes when there are several workers,
+    # and no intermediate files are written
+    pids = set()
+    for inits in ["ab", "cd", "ef"]:
+        with open(data_dir / f"engine_{inits}_all_gaze.json", "r") as f:
+            engine_call = json.load(f)
+        pids.add(engine_call["pid"])
+        assert engine_call["mat_file"] == ""
+        assert not (data_dir / DATA_FILE_FORMAT.format(inits)).exists()
+        assert not (data_dir / SEGMENTS_FILE_FORMAT.format(inits)).exists()
+    assert (os.getpid() in pids) == (workers == 1)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_data_quits_engines_once(workers):
+    data_dir = test_files_dir / f"engine_quit_{workers}"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    for inits in ["ab", "cd", "ef"]:
+        write_synthetic_gaze_file(data_dir / f"{inits}_all_gaze.csv", 5)
+
+    log_file = data_dir / "engine_log.txt"
+    process_data(data_dir, workers=workers, engine_factory=partial(CountingEngine, log_file))
+
+    # The exit finalizers of this process do not quit the engine again
+    _run_finalizers(10)
+
+    with open(log_file, "r") as f:
+        events = [line.split() for line in f]
+    starts = sorted(pid for event, pid in events if event == "start")
+    quits = sorted(pid for event, pid in events if event == "quit")
+    assert starts
+    assert quits == starts
+    assert len(set(quits)) == len(quits)
+    assert (starts == [str(os.getpid())]) == (workers == 1)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "engine"])
+def test_process_data_keep_intermediate(backend):
+    data_dir = test_files_dir / f"keep_intermediate_{backend}"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    write_synthetic_gaze_file(data_dir / "ab_all_gaze.csv", 5)
+    engine_factory = FakeEngine if backend == "engine" else None
+
+    process_data(data_dir, backend="numpy", engine_factory=engine_factory)
+    splines = {}
+    for emotion in SEG_NAME_TO_EMOTION.values():
+        with open(data_dir / OUTPUT_FILE_FORMAT.format("ab", emotion), "rb") as f:
+            splines[emotion] = pickle.load(f)
+
+    process_data(
+        data_dir, backend="numpy", keep_intermediate=True, engine_factory=engine_factory
+    )
+
+    # The intermediate files hold the same data that was passed in memory
+    segments = read_segments(data_dir / SEGMENTS_FILE_FORMAT.format("ab"))
+    times, diameters = read_pupil_data(data_dir / DATA_FILE_FORMAT.format("ab"))
+    data = split_segments(segments, times, diameters)
+    for seg_name, seg_data in data.items():
+        spline = splines[SEG_NAME_TO_EMOTION[seg_name]]
+        assert np.array_equal(spline.x, seg_data["times"])
+        assert np.allclose(spline(spline.x), seg_data["diameters"])
+
+    if backend == "engine":
+        with open(data_dir / "engine_ab_all_gaze.json", "r") as f:
+            assert json.load(f)["mat_file"] == MAT_FILE_FORMAT.format("ab")
+
+
+def test_process_data_plot_result():
+    data_dir = test_files_dir / "plot_result"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    write_synthetic_gaze_file(data_dir / "ab_all_gaze.csv", 5)
+
+    # The plots are rendered in the background, and process_data waits for them
+    process_data(data_dir, plot_result=True, backend="numpy")
+
+    for emotion in SEG_NAME_TO_EMOTION.values():
+        plot_path = data_dir / f"{OUTPUT_FILE_FORMAT.format('ab', emotion)}.png"
+        assert plot_path.is_file()
+        assert plot_path.stat().st_size > 0
+
+
+def write_main_module(output_path):
+    with open(output_path, "w") as f:
+        json.dump(
+            {
+                "main": sys.modules["__main__"].__spec__.name,
+                "tensorflow": "tensorflow" in sys.modules,
+            },
+            f,
+        )
+
+
+def test_plot_renderer_entry_module():
+    output_dir = test_files_dir / "plot_renderer"
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    with PlotRenderer() as renderer:
+        renderer.submit(write_main_module, output_dir / "modules.json")
+
+    # The renderer runs the diagnostics module, and does not import the caller's main module
+    with open(output_dir / "modules.json", "r") as f:
+        assert json.load(f) == {"main": "data_processing.diagnostics", "tensorflow": False}
+
+
+def test_decimate_series():
+    rng = np.random.default_rng(496)
+    x = np.cumsum(rng.uniform(1, 10, 100_000))
+    y = rng.normal(25, 2, len(x))
+
+    dec_x, dec_y = decimate_series(x, y, 640)
+
+    # At most the minimum and maximum of each pixel are kept, in order
+    assert len(dec_x) <= 2 * 640
+    assert np.all(np.diff(dec_x) > 0)
+
+    # The envelope of each pixel is kept
+    bins = np.minimum(((x - x[0]) / (x[-1] - x[0]) * 640).astype(int), 639)
+    dec_bins = np.minimum(((dec_x - x[0]) / (x[-1] - x[0]) * 640).astype(int), 639)
+    for b in rng.integers(0, 640, 20):
+        assert dec_y[dec_bins == b].min() == y[bins == b].min()
+        assert dec_y[dec_bins == b].max() == y[bins == b].max()
+
+    # Short series are not decimated
+    assert len(decimate_series(x[:100], y[:100], 640)[0]) == 100
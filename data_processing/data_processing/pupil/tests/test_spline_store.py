@@ -0,0 +1,155 @@
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import pytest
+from scipy.interpolate import CubicSpline
+import shutil
+
+from data_processing.pupil.benchmark import write_synthetic_gaze_file
+from data_processing.pupil.process_data import process_data
+from data_processing.pupil.spline_store import (
+    convert_spline_files,
+    load_spline_store,
+    SplineStore,
+    spline_store_paths,
+)
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+@pytest.fixture(scope="module")
+def pkl_dir():
+    """
+    Pickles random splines of different lengths for a few participants and emotions.
+    """
+    pkl_dir = test_files_dir / "spline_store"
+    shutil.rmtree(pkl_dir, ignore_errors=True)
+    os.makedirs(pkl_dir)
+
+    rng = np.random.default_rng(496)
+    for inits in ["ab", "cd", "ef"]:
+        for emotion in ["joy", "sad"]:
+            times = np.cumsum(rng.uniform(5, 15, rng.integers(2, 500)))
+            spline = CubicSpline(times, rng.normal(25, 2, len(times)))
+            with open(pkl_dir / f"pupil_{inits}_{emotion}.pkl", "wb") as f:
+                pickle.dump(spline, f)
+
+    return pkl_dir
+
+
+def load_pkl_splines(pkl_dir):
+    splines = {}
+    for file in os.listdir(pkl_dir):
+        if file.endswith(".pkl"):
+            _, inits, emotion = Path(file).stem.split("_")
+            with open(pkl_dir / file, "rb") as f:
+                splines[(inits, emotion)] = pickle.load(f)
+
+    return splines
+
+
+def test_spline_store(pkl_dir):
+    convert_spline_files(pkl_dir)
+    store = SplineStore(pkl_dir)
+    splines = load_pkl_splines(pkl_dir)
+
+    assert len(store) == len(splines)
+    assert store.participants() == {
+        "ab": ["joy", "sad"],
+        "cd": ["joy", "sad"],
+        "ef": ["joy", "sad"],
+    }
+    assert store.find("ab", "fear") == -1
+
+    # Evaluate windows from every spline in one call, including times before the start and
+    # after the end of the splines
+    rng = np.random.default_rng(0)
+    keys = list(splines)
+    spline_indices = [store.find(*keys[k]) for k in rng.integers(0, len(keys), 200)]
+    end_times = [
+        rng.uniform(-100, store.spline(i).x[-1] + 100) for i in spline_indices
+    ]
+    windows = store.windows(spline_indices, end_times, 100, 0.5)
+
+    assert windows.shape == (200, 100)
+    for i, end_time, window in zip(spline_indices, end_times, windows):
+        key = next(key for key in keys if store.find(*key) == i)
+        times = np.linspace(end_time - 0.5 * 100, end_time, 100)
+        assert np.allclose(window, splines[key](times))
+        assert np.allclose(store.spline(i)(times), splines[key](times))
+
+
+def test_resampled_spline(pkl_dir):
+    store = load_spline_store(pkl_dir)
+    assert load_spline_store(pkl_dir) is store
+
+    period = 0.5
+    i = store.find("cd", "joy")
+    spline = store.spline(i)
+    resampled = store.resample(i, 1000, period)
+    assert store.resample(i, 500, period) is resampled
+    assert resampled.stop >= 1000
+
+    # Each window is the spline on the grid, ending at the grid time nearest to the end time
+    end_times = np.array([49.5, 100, 333.3, 1000])
+    windows = resampled.windows(end_times, 100)
+    for end_time, window in zip(end_times, windows):
+        end = np.rint(end_time / period) * period
+        times = end - period * np.arange(99, -1, -1)
+        assert np.allclose(window, spline(times))
+
+    # The windows are views of the samples until they are gathered
+    view = resampled.window_view(100)
+    assert np.shares_memory(view, resampled.samples)
+    assert view.shape == (len(resampled.samples) - 99, 100)
+
+    # The windows can be gathered into a preallocated buffer
+    buffer = np.zeros((len(end_times) + 1, 100), dtype=np.float32)
+    resampled.windows(end_times, 100, out=buffer[1:])
+    assert np.array_equal(buffer[1:], windows)
+    assert not buffer[0].any()
+
+    with pytest.raises(ValueError):
+        resampled.windows([49], 100)
+
+
+def test_process_data_writes_spline_store():
+    data_dir = test_files_dir / "spline_store_process_data"
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+    write_synthetic_gaze_file(data_dir / "ab_all_gaze.csv", 5)
+
+    process_data(data_dir, backend="numpy")
+
+    assert os.path.isfile(spline_store_paths(data_dir)[2])
+    store = load_spline_store(data_dir)
+    assert len(store) == len(load_pkl_splines(data_dir))
+
+
+def test_load_spline_store_rebuilds_changed_splines():
+    pkl_dir = test_files_dir / "spline_store_changed"
+    shutil.rmtree(pkl_dir, ignore_errors=True)
+    os.makedirs(pkl_dir)
+
+    def write_spline(inits, emotion, value):
+        spline = CubicSpline([0.0, 1.0, 2.0], [value, value, value])
+        with open(pkl_dir / f"pupil_{inits}_{emotion}.pkl", "wb") as f:
+            pickle.dump(spline, f)
+
+    write_spline("ab", "joy", 20.0)
+    # Not a pickled spline, since the dot must be literal
+    write_spline("cd", "joy", 20.0)
+    os.rename(pkl_dir / "pupil_cd_joy.pkl", pkl_dir / "pupil_cd_joyxpkl")
+    assert len(load_spline_store(pkl_dir)) == 1
+
+    # A new and a rewritten spline are picked up without removing the store
+    write_spline("ab", "sad", 22.0)
+    write_spline("ab", "joy", 25.0)
+    store = load_spline_store(pkl_dir)
+    assert len(store) == 2
+    assert store.evaluate([store.find("ab", "joy")], [[0.5]])[0, 0] == 25.0
+
+    # A removed spline is dropped
+    os.remove(pkl_dir / "pupil_ab_sad.pkl")
+    assert ("ab", "sad") not in load_spline_store(pkl_dir)
@@ -0,0 +1,95 @@
+import argparse
+import numpy as np
+import time
+import tensorflow as tf
+from typing import Callable, List
+
+import models.face as face
+import models.pupil as pupil
+from models.pupil.train import MAX_PUPIL_DILATION
+from models.serving import create_serving_function
+
+
+def time_calls(call: Callable[[], object], repeats: int) -> float:
+    """
+    Returns the median time of a call, after a warm-up call.
+    """
+    call()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def benchmark_serving(model_name: str, batch_sizes: List[int], repeats: int):
+    """
+    Times model.predict against the serving function, with and without XLA, for each batch
+    size, on a randomly initialised model and random inputs.
+    """
+    if model_name == "face":
+        input_shape = (224, 224, 1)
+        model = face.create_model(2, input_shape)
+        scale = 255
+    else:
+        input_shape = (100, 1)
+        model = pupil.create_model(2, input_shape)
+        scale = MAX_PUPIL_DILATION
+
+    paths = {
+        "predict": lambda inputs: model.predict(inputs, verbose=None),
+        "tf.function": create_serving_function(model),
+        "tf.function + XLA": create_serving_function(model, jit_compile=True),
+    }
+
+    rng = np.random.default_rng(496)
+    for batch_size in batch_sizes:
+        inputs = (rng.random((batch_size, *input_shape)) * scale).astype(np.float32)
+        expected = paths["predict"](inputs)
+        for path, predict in paths.items():
+            if path != "predict":
+                inputs_t = tf.constant(inputs)
+                call = lambda: predict(inputs_t).numpy()
+                difference = np.abs(call() - expected).max()
+            else:
+                call = lambda: predict(inputs)
+                difference = 0.0
+
+            latency = time_calls(call, repeats)
+            print(
+                f"{model_name} batch {batch_size} {path}: {latency * 1000:.2f}ms, "
+                f"{batch_size / latency:.1f} samples/s, max difference {difference:.2g}"
+            )
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the serving functions of the models against model.predict."
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        nargs="+",
+        choices=("face", "pupil"),
+        default=("face", "pupil"),
+        help="Models to benchmark.",
+    )
+    parser.add_argument(
+        "-b", "--batch-sizes", type=int, nargs="+", default=(1, 32), help="Batch sizes."
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, default=20, help="Number of timed calls per measurement."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    tf.get_logger().setLevel("ERROR")
+    for model_name in args.models:
+        benchmark_serving(model_name, args.batch_sizes, args.repeats)
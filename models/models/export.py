@@ -0,0 +1,349 @@
+import argparse
+import numpy as np
+from pathlib import Path
+from sklearn.metrics import confusion_matrix
+import time
+import tensorflow as tf
+from typing import Dict, List, Optional, Tuple
+
+from data_processing.face.image_store import load_image_store
+from data_processing.face.sample_index import load_sample_index
+import models.face as face
+from models.fusion import fuse_predictions, get_data as get_fusion_data, get_pupil_columns
+import models.pupil as pupil
+from models.pupil.train import get_windows
+from models.serving import create_inference_model, create_serving_function
+
+
+EXPORT_DIR = Path(__file__).parent / "tflite"
+TFLITE_FILE_FORMAT = "{}_{}.tflite"
+
+# float16: float16 weights
+# dynamic: int8 weights, quantized and dequantized as the model runs
+# int8: int8 weights, activations, inputs and outputs, calibrated on representative samples
+VARIANTS = ("float16", "dynamic", "int8")
+# The float16 conversion of the LSTMs of the pupil model does not finish with the TFLite
+# converter of TensorFlow 2.15, so the pupil model is not exported in float16, and the
+# float16 variant is evaluated with the Keras pupil model (see report_name)
+UNSUPPORTED_VARIANTS = {("pupil", "float16")}
+NUM_REPRESENTATIVE_SAMPLES = 200
+
+WINDOW_SIZE = 100
+IMAGE_SHAPE = (224, 224, 1)
+
+
+def load_models(num_classes: int) -> Tuple[tf.keras.Model, tf.keras.Model]:
+    """
+    Creates the face and pupil models and loads their best checkpoints, like the fusion script.
+    """
+    face_model = face.create_model(num_classes, IMAGE_SHAPE)
+    pupil_model = pupil.create_model(2, (WINDOW_SIZE, 1))
+    face_model.load_weights(
+        face.BINARY_CHECKPOINT_PATH if num_classes == 2 else face.MULTICLASS_CHECKPOINT_PATH
+    ).expect_partial()
+    pupil_model.load_weights(pupil.CHECKPOINT_PATH).expect_partial()
+
+    return face_model, pupil_model
+
+
+def spread_samples(samples: np.ndarray, num_samples: int) -> np.ndarray:
+    """
+    Returns num_samples samples evenly spaced over the whole array (or all of them if there
+    are fewer), so that they cover every segment of a dataset whose segments are contiguous.
+    """
+    if len(samples) == 0:
+        return np.asarray(samples)
+
+    indices = np.unique(np.linspace(0, len(samples) - 1, num_samples).round().astype(np.int64))
+    return np.asarray(samples[indices])
+
+
+def get_representative_samples(
+    pkl_dir: Path, face_dir: Path, num_samples: int = NUM_REPRESENTATIVE_SAMPLES
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns float32 face images and pupil windows spread over the training sets of the face
+    image store and the pupil window cache, to calibrate the int8 variants.
+    """
+    images = load_image_store(face_dir / "train", IMAGE_SHAPE[0:2]).images
+    windows, _, _ = get_windows(pkl_dir, face_dir / "train", WINDOW_SIZE)
+
+    return (
+        spread_samples(images, num_samples).astype(np.float32),
+        spread_samples(windows, num_samples)[:, :, np.newaxis].astype(np.float32),
+    )
+
+
+def convert_model(
+    model: tf.keras.Model, variant: str, representative_samples: Optional[np.ndarray] = None
+) -> bytes:
+    """
+    Converts the inference model of a trained model to a TFLite model of the variant, which
+    takes one sample at a time. The batch size is fixed, since the LSTMs of the pupil model
+    can only be converted with static shapes.
+    """
+    inference_model = create_inference_model(model)
+    forward = tf.function(
+        lambda inputs: inference_model(inputs, training=False),
+        input_signature=[tf.TensorSpec((1, *model.input_shape[1:]), tf.float32)],
+    )
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [forward.get_concrete_function()], inference_model
+    )
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        converter.representative_dataset = lambda: (
+            [sample[np.newaxis]] for sample in representative_samples
+        )
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif variant != "dynamic":
+        raise ValueError(f"Unknown TFLite variant {variant}")
+
+    return converter.convert()
+
+
+def export_models(
+    pkl_dir: Path, face_dir: Path, export_dir: Path = EXPORT_DIR, variants=VARIANTS
+) -> List[Path]:
+    """
+    Exports the face and pupil models to a TFLite file per variant, named
+    {face,pupil}_{variant}.tflite.
+    Returns the paths of the exported files.
+    """
+    classes = load_sample_index(face_dir / "train").classes
+    face_model, pupil_model = load_models(len(classes))
+
+    representative_images, representative_windows = None, None
+    if "int8" in variants:
+        representative_images, representative_windows = get_representative_samples(
+            pkl_dir, face_dir
+        )
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for variant in variants:
+        for name, model, samples in (
+            ("face", face_model, representative_images),
+            ("pupil", pupil_model, representative_windows),
+        ):
+            path = export_dir / TFLITE_FILE_FORMAT.format(name, variant)
+            if (name, variant) in UNSUPPORTED_VARIANTS:
+                print(
+                    f"Skipped {path}, which cannot be converted; "
+                    f"{report_name(variant)} is evaluated with the Keras {name} model"
+                )
+                continue
+
+            path.write_bytes(convert_model(model, variant, samples))
+            print(f"Exported {path} ({path.stat().st_size / 1024:.0f}KB)")
+            paths.append(path)
+
+    return paths
+
+
+def quantize(inputs: np.ndarray, details: Dict) -> np.ndarray:
+    """
+    Quantizes float inputs to the dtype of the input tensor details of an int8 model,
+    and only casts them otherwise.
+    """
+    if details["dtype"] == np.int8:
+        scale, zero_point = details["quantization"]
+        inputs = np.clip(np.round(inputs / scale + zero_point), -128, 127)
+    return inputs.astype(details["dtype"])
+
+
+def dequantize(outputs: np.ndarray, details: Dict) -> np.ndarray:
+    """
+    Dequantizes the outputs of an int8 model to floats, with the output tensor details.
+    """
+    if details["dtype"] == np.int8:
+        scale, zero_point = details["quantization"]
+        outputs = (outputs.astype(np.float32) - zero_point) * scale
+    return outputs
+
+
+class TFLiteModel:
+    """
+    Runs a TFLite model exported by export_models on one sample at a time.
+    The float inputs and outputs are quantized and dequantized for the int8 variant.
+    """
+
+    def __init__(self, path: Path):
+        self.size = path.stat().st_size
+        self.interpreter = tf.lite.Interpreter(model_path=str(path))
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def __call__(self, inputs: np.ndarray) -> np.ndarray:
+        self.interpreter.set_tensor(self.input["index"], quantize(inputs, self.input))
+        self.interpreter.invoke()
+        return dequantize(self.interpreter.get_tensor(self.output["index"]), self.output)
+
+
+def report_name(variant: str) -> str:
+    """
+    Returns the name of the variant in the evaluation report, which names the models of
+    UNSUPPORTED_VARIANTS that run in Keras, e.g. "float16+keras_pupil".
+    """
+    keras_models = [
+        f"keras_{name}" for name in ("face", "pupil") if (name, variant) in UNSUPPORTED_VARIANTS
+    ]
+    return "+".join([variant] + keras_models)
+
+
+def compare_predictions(
+    labels: np.ndarray, predictions: Dict[str, np.ndarray], num_classes: int
+) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the accuracy of the predictions of each model, the share of its predictions that
+    differ from those of the "keras" model, and the drift of its confusion matrix from that of
+    the "keras" model, which is the number of samples that moved to another cell.
+    """
+    matrices = {
+        name: confusion_matrix(labels, p, labels=range(num_classes))
+        for name, p in predictions.items()
+    }
+    return {
+        name: {
+            "accuracy": float(np.mean(p == labels)),
+            "changed": float(np.mean(p != predictions["keras"])),
+            # Every moved sample leaves one cell and enters another
+            "drift": int(np.abs(matrices[name] - matrices["keras"]).sum() // 2),
+        }
+        for name, p in predictions.items()
+    }
+
+
+def evaluate_variants(
+    pkl_dir: Path, face_dir: Path, export_dir: Path = EXPORT_DIR, variants=VARIANTS
+) -> Dict[str, Dict[str, float]]:
+    """
+    Runs the Keras models and the TFLite variants on each sample of the fusion test set.
+    Returns the accuracy, the share of predictions that differ from Keras, the drift of the
+    confusion matrix (the number of samples that moved to another cell), the size of the
+    two models and the median latency per sample of each.
+    The models of UNSUPPORTED_VARIANTS run in Keras, and their variants are named after them
+    in the report (see report_name).
+    """
+    test_set, classes = get_fusion_data(pkl_dir, face_dir, IMAGE_SHAPE[0:2], WINDOW_SIZE)
+    face_model, pupil_model = load_models(len(classes))
+    pupil_columns = get_pupil_columns(classes)
+
+    serve_face = create_serving_function(face_model)
+    serve_pupil = create_serving_function(pupil_model)
+    keras_runners = {
+        "face": lambda image: serve_face(image).numpy(),
+        "pupil": lambda window: serve_pupil(window).numpy(),
+    }
+    keras_sizes = {
+        name: sum(w.numpy().nbytes for w in model.weights)
+        for name, model in (("face", face_model), ("pupil", pupil_model))
+    }
+
+    runners = {"keras": (keras_runners["face"], keras_runners["pupil"])}
+    sizes = {"keras": sum(keras_sizes.values())}
+    for variant in variants:
+        row = report_name(variant)
+        variant_runners = []
+        sizes[row] = 0
+        for name in ("face", "pupil"):
+            if (name, variant) in UNSUPPORTED_VARIANTS:
+                variant_runners.append(keras_runners[name])
+                sizes[row] += keras_sizes[name]
+            else:
+                model = TFLiteModel(export_dir / TFLITE_FILE_FORMAT.format(name, variant))
+                variant_runners.append(model)
+                sizes[row] += model.size
+        runners[row] = tuple(variant_runners)
+
+    labels = []
+    predictions: Dict[str, List[int]] = {name: [] for name in runners}
+    latencies: Dict[str, List[float]] = {name: [] for name in runners}
+    for _, image, window, label in test_set.as_numpy_iterator():
+        window = window[..., np.newaxis]
+        labels.append(label[0])
+        for name, (run_face, run_pupil) in runners.items():
+            start = time.perf_counter()
+            face_prediction = run_face(image)
+            pupil_prediction = run_pupil(window)
+            latencies[name].append(time.perf_counter() - start)
+            predictions[name].append(
+                fuse_predictions(face_prediction, pupil_prediction, pupil_columns)[0]
+            )
+
+    report = compare_predictions(
+        np.array(labels), {name: np.array(p) for name, p in predictions.items()}, len(classes)
+    )
+    for name in runners:
+        report[name]["size_kb"] = sizes[name] / 1024
+        report[name]["latency_ms"] = float(np.median(latencies[name])) * 1000
+
+    return report
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Export the face and pupil models to TFLite, or compare the exported "
+        "variants to the Keras models on the fusion test set."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Export the checkpoints to float16, dynamic and int8 TFLite models."
+    )
+    export_parser.add_argument("pkl_dir", type=Path, help="The pupil data directory.")
+    export_parser.add_argument(
+        "face_dir",
+        type=Path,
+        help="The processed face data directory, whose train set is used for calibration.",
+    )
+
+    evaluate_parser = subparsers.add_parser(
+        "evaluate", help="Compare the TFLite models to the Keras models on a test set."
+    )
+    evaluate_parser.add_argument("pkl_dir", type=Path, help="The pupil data directory.")
+    evaluate_parser.add_argument(
+        "face_dir", type=Path, help="The test set of the processed face data."
+    )
+
+    for subparser in (export_parser, evaluate_parser):
+        subparser.add_argument(
+            "-o",
+            "--export-dir",
+            type=Path,
+            default=EXPORT_DIR,
+            help="Directory of the TFLite models.",
+        )
+        subparser.add_argument(
+            "-v",
+            "--variants",
+            nargs="+",
+            choices=VARIANTS,
+            default=VARIANTS,
+            help="TFLite variants.",
+        )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    tf.get_logger().setLevel("ERROR")
+
+    if args.command == "export":
+        export_models(args.pkl_dir, args.face_dir, args.export_dir, args.variants)
+    else:
+        report = evaluate_variants(args.pkl_dir, args.face_dir, args.export_dir, args.variants)
+        print(f"{'model':<20} {'accuracy':>8} {'changed':>8} {'drift':>6} {'size':>9} {'latency':>9}")
+        for name, row in report.items():
+            print(
+                f"{name:<20} {row['accuracy']:>8.3f} {row['changed']:>8.1%} {row['drift']:>6d} "
+                f"{row['size_kb']:>7.0f}KB {row['latency_ms']:>7.2f}ms"
+            )
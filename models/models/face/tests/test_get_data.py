@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import os
+import pytest
+import tensorflow as tf
+
+from data_processing.face.frame_stack import write_frame_stack
+from data_processing.face.process_data import TIMES_FILE_FORMAT
+from models.face.train import get_data
+
+
+@pytest.mark.parametrize("storage", ["png", "stack"])
+def test_get_data_mixes_classes(tmp_path, storage):
+    # 32 frames of each class, written label by label
+    dataset_dir = tmp_path / "train"
+    times = [float(t) for t in range(1, 33)]
+    for label, emotion, value in (("negative", "sad", 50), ("positive", "happy", 200)):
+        label_dir = dataset_dir / label
+        os.makedirs(label_dir)
+        with open(label_dir / TIMES_FILE_FORMAT.format("cs", emotion), "w") as f:
+            f.write("times\n" + "".join(f"{time}\n" for time in times))
+
+        frame = np.full((10, 10), value, dtype=np.uint8)
+        if storage == "stack":
+            write_frame_stack(label_dir, f"cs_{emotion}", [(time, frame) for time in times])
+        else:
+            for time in times:
+                cv2.imwrite(str(label_dir / f"cs_{emotion}_{time}_c.png"), frame)
+
+    tf.random.set_seed(496)
+    np.random.seed(496)
+    dataset, classes = get_data(dataset_dir, (8, 8), batch_size=16)
+    assert classes == ["negative", "positive"]
+
+    # The samples are shuffled before they are batched, so the batches are not single-class,
+    # and every sample is read once per epoch
+    labels = []
+    for images, batch_labels in dataset.as_numpy_iterator():
+        assert len(set(batch_labels.tolist())) == 2
+        assert (images[batch_labels == 0] == 50).all()
+        assert (images[batch_labels == 1] == 200).all()
+        labels.extend(batch_labels.tolist())
+    assert sorted(labels) == [0] * 32 + [1] * 32
@@ -1,7 +1,8 @@
+import numpy as np
 from pathlib import Path
 import sys
 import tensorflow as tf
-from tensorflow.data import AUTOTUNE
+from tensorflow.data import AUTOTUNE, Dataset
 from tensorflow.keras.callbacks import ModelCheckpoint
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import (
@@ -13,17 +14,41 @@ from tensorflow.keras.layers import (
     RandomFlip,
     Rescaling,
 )
-from tensorflow.keras.utils import image_dataset_from_directory
 from typing import Optional, Tuple
 
+from data_processing.face.image_store import load_image_store
 
 BINARY_CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/binary-{epoch:03d}.ckpt"
 MULTICLASS_CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/multiclass-{epoch:03d}.ckpt"
 
 
+def image_store_dataset(images: np.ndarray, labels: np.ndarray, batch_size: int = 32) -> Dataset:
+    """
+    Creates a dataset of shuffled batches of the uint8 images and labels.
+    Each batch is gathered from the memory-mapped images as it is read, so the images are
+    not copied into the dataset, and they are converted to floats by the model.
+    """
+    def get_batch(indices):
+        indices = np.sort(indices)
+        return images[indices], labels[indices]
+
+    def read_batch(indices):
+        batch_images, batch_labels = tf.numpy_function(
+            get_batch, [indices], (tf.uint8, tf.int32)
+        )
+        batch_images.set_shape((None, *images.shape[1:]))
+        batch_labels.set_shape((None,))
+        return batch_images, batch_labels
+
+    dataset = Dataset.range(len(images)).shuffle(max(len(images), 1)).batch(batch_size)
+    return dataset.map(read_batch, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+
 def get_data(image_dir: Path, image_size: Tuple[int, int], batch_size: int = 32):
     """
     Get the data from the emotion directories and create the dataset.
+    The images (or the frames of the frame stacks) of the sample index of the image directory
+    are resized once to image_size and saved to an image store, which is memory-mapped.
 
     Args:
         image_dir: The directory containing the images.
@@ -33,21 +58,11 @@ def get_data(image_dir: Path, image_size: Tuple[int, int], batch_size: int = 32)
     Returns:
         The dataset, as well as the classes present in the image directory.
     """
-    # Generate train and val set from directory
-    dataset = image_dataset_from_directory(
-        image_dir,
-        color_mode="grayscale",
-        batch_size=batch_size,
-        image_size=image_size,
-    )
-
-    # Get the classes from the dataset
-    classes = dataset.class_names
-
-    # Prefetch datasets
-    dataset = dataset.cache().shuffle(1000).prefetch(AUTOTUNE)
+    image_store = load_image_store(image_dir, image_size)
+    samples = image_store.samples
+    dataset = image_store_dataset(image_store.images, samples.label_indices(), batch_size)
 
-    return dataset, classes
+    return dataset, samples.classes
 
 
 def create_model(num_classes: int, input_shape: Optional[Tuple[int, int, int]] = None):
@@ -1,113 +1,200 @@
 import csv
-import matplotlib.pyplot as plt
 import numpy as np
-import os
 from pathlib import Path
-import pickle
-from PIL import Image
-import re
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+from sklearn.metrics import confusion_matrix
 import sys
-from tensorflow import convert_to_tensor, get_logger, random
+import time
+import tensorflow as tf
+from tensorflow import get_logger, random
 from tensorflow.data import AUTOTUNE, Dataset
-from tensorflow.keras.utils import img_to_array
-from typing import Tuple
-
-from data_processing.face.process_data import BINARY_EMOTIONS, TIMES_FILE_FORMAT
+from typing import List, Tuple
+
+from data_processing.diagnostics import get_plot_renderer, plot_confusion_matrix
+from data_processing.face.frame_stack import FrameStack
+from data_processing.face.image_store import read_image, resize_image
+from data_processing.face.process_data import BINARY_EMOTIONS
+from data_processing.face.sample_index import load_sample_index
+from data_processing.pupil.spline_store import load_spline_store
 import models.face as face
 import models.pupil as pupil
+from models.serving import create_serving_function
 
 
 PREDICTIONS_CSV = Path(__file__).parent / "predictions.csv"
 
 
 def get_data(
-    pkl_dir: Path, face_dir: Path, image_shape: Tuple[int, int], window_size: int = 100
+    pkl_dir: Path,
+    face_dir: Path,
+    image_shape: Tuple[int, int],
+    window_size: int = 100,
+    batch_size: int = 1,
 ):
     """
-    Get the functions from the .pkl files and timestamps from the face directories, then create the dataset.
+    Get the splines from the spline store of the .pkl files and timestamps from the face directories,
+    then create the dataset.
 
     Args:
         pkl_dir: The path to the directory of .pkl files containing the pupillometry splines.
-        face_dir: The path to the directory of face images (for getting the times files)
+            They are converted to a spline store the first time if there is none.
+            The splines are sampled once every pupil.window_period(window_size), and the windows
+            are taken from the samples.
+        face_dir: The path to the directory of face images (for getting the times files from its
+            sample index)
+        image_shape: The size the images are resized to (e.g. (224, 224)).
         window_size: The number of data samples to be considered at a time.
-        batch_size: The batch size to be used in the training.
+        batch_size: The number of samples per batch.
 
     Returns:
-        The dataset and the label classes.
+        The dataset of (name, image, window, label) batches, and the label classes.
+        The images are decoded and the windows are taken from the resampled splines as the
+        dataset is iterated, so the test set is never held in memory.
+    """
+    # Open the splines of every participant and emotion
+    splines = load_spline_store(pkl_dir)
+
+    # Get the records of the samples that have a spline and a full window before them.
+    # The images and windows are only read as the dataset is iterated.
+    samples = load_sample_index(face_dir)
+    resampled_splines = []
+    stacks = []
+    names = []
+    paths = []
+    in_stack = []
+    segment_ids = []
+    end_times = []
+    labels = []
+    for label, inits, emotion, segment in samples.segments():
+        spline_index = splines.find(inits, emotion)
+        if spline_index < 0:
+            continue
+
+        # Check if a window can be generated for each time
+        segment = segment.select(segment.times >= pupil.PERIOD * window_size)
+        if not len(segment):
+            continue
+
+        # Sample the spline once for the whole segment, and open its frame stack if there is one
+        resampled_splines.append(
+            splines.resample(
+                spline_index, segment.times.max(), pupil.window_period(window_size)
+            )
+        )
+        stacks.append(
+            FrameStack(face_dir / label, f"{inits}_{emotion}") if segment.stacks[0] else None
+        )
+
+        names.extend(segment.image_names())
+        paths.extend(str(path) for path in segment.image_paths())
+        in_stack.extend(segment.stacks.tolist())
+        segment_ids.extend([len(stacks) - 1] * len(segment))
+        end_times.extend(segment.times.tolist())
+        labels.extend([samples.classes.index(label)] * len(segment))
+
+    def read_window(segment_id, end_time):
+        return resampled_splines[segment_id].windows([end_time], window_size)[0]
+
+    def read_face_image(path, is_stack, segment_id, end_time):
+        if is_stack:
+            frame = np.asarray(stacks[segment_id].at_time(end_time))
+        else:
+            frame = read_image(path.decode())
+
+        # Read and resize like the image store that the face model is trained on
+        return resize_image(frame, image_shape)[..., np.newaxis]
+
+    def read_record(name, path, is_stack, segment_id, end_time, label):
+        window = tf.numpy_function(read_window, [segment_id, end_time], tf.float32)
+        window.set_shape((window_size,))
+
+        image = tf.numpy_function(
+            read_face_image, [path, is_stack, segment_id, end_time], tf.uint8
+        )
+        image.set_shape((*image_shape, 1))
+        image = tf.cast(image, tf.float32)
+
+        return name, image, window, label
+
+    dataset = Dataset.from_tensor_slices(
+        (
+            tf.constant(names, tf.string),
+            tf.constant(paths, tf.string),
+            tf.constant(in_stack, tf.bool),
+            tf.constant(segment_ids, tf.int32),
+            tf.constant(end_times, tf.float64),
+            tf.constant(labels, tf.int32),
+        )
+    )
+
+    # Shuffle the records, then read them in parallel
+    dataset = dataset.shuffle(max(len(names), 1))
+    dataset = dataset.map(read_record, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.batch(batch_size).prefetch(AUTOTUNE)
+
+    return dataset, samples.classes
+
+
+def get_pupil_columns(classes: List[str]) -> np.ndarray:
+    """
+    Returns the column of the binary pupil prediction (negative, positive) for each class.
+    """
+    if len(classes) == 2:
+        return np.arange(2)
+
+    return np.array([int(BINARY_EMOTIONS[c] != "negative") for c in classes])
+
+
+def fuse_predictions(
+    face_predictions: np.ndarray, pupil_predictions: np.ndarray, pupil_columns: np.ndarray
+) -> np.ndarray:
+    """
+    Returns the class with the highest sum of the face and pupil probabilities for each sample.
+    The binary pupil probabilities are spread over the classes with pupil_columns.
+    """
+    return np.argmax(face_predictions + pupil_predictions[:, pupil_columns], axis=1)
+
+
+def evaluate(face_model, pupil_model, test_set: Dataset, classes: List[str]):
     """
-    # Read the splines from the pkl files
-    splines = {}
-    for file in os.listdir(pkl_dir):
-        # Check if the file is a pkl with the correct format
-        if match := re.search(r"pupil_(?P<inits>\w+)_(?P<emotion>\w+).pkl$", str(file)):
-            emotion = match["emotion"]
-            inits = match["inits"]
+    Predicts the class of every sample of the test set, one batch at a time.
+    Both models run on each batch in one graph, without their training-only layers, so that
+    they run concurrently.
 
-            if match["inits"] not in splines:
-                splines[match["inits"]] = {}
+    Returns:
+        The names, labels and predictions of the samples.
+    """
+    serve_face = create_serving_function(face_model)
+    serve_pupil = create_serving_function(pupil_model)
 
-            with open(pkl_dir / file, "rb") as f:
-                splines[inits][emotion] = pickle.load(f)
+    @tf.function
+    def predict(face_images, pupil_windows):
+        return serve_face(face_images), serve_pupil(pupil_windows[..., tf.newaxis])
 
-    # Generate the dilations_windows, labels, and classes
+    pupil_columns = get_pupil_columns(classes)
     names = []
-    images = []
-    dilation_windows = []
     labels = []
-    classes = []
-    for i, label in enumerate(os.listdir(face_dir)):
-        classes.append(label)
-        for inits, init_splines in splines.items():
-            for emotion, spline in init_splines.items():
-                # Get the times file for this inits + emotion combination
-                times_path = face_dir / label / TIMES_FILE_FORMAT.format(inits, emotion)
-                if not os.path.isfile(times_path):
-                    continue
-
-                with open(times_path, "r") as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Check if a window can be generated for this time
-                        end_time = float(row["times"])
-                        if end_time < pupil.PERIOD * window_size:
-                            continue
-
-                        # Construct the image name
-                        name = f"{inits}_{emotion}_{end_time}_c.png"
-                        names.append(name)
-
-                        # Get the image for the time
-                        image = Image.open(face_dir / label / name)
-                        image = image.resize(image_shape)
-                        images.append(img_to_array(image))
-
-                        # Generate a window for this time
-                        times = np.linspace(
-                            end_time - pupil.PERIOD * window_size, end_time, window_size
-                        )
-                        dilation_windows.append(spline(times))
-                        labels.append(i)
-
-    # Convert the dilations and labels to a tensor dataset
-    names_t = convert_to_tensor(names)
-    images_t = convert_to_tensor(images)
-    dilations_t = convert_to_tensor(dilation_windows)
-    labels_t = convert_to_tensor(labels)
-    dataset = Dataset.from_tensor_slices((names_t, images_t, dilations_t, labels_t))
-
-    # Prefetch datasets
-    dataset = dataset.batch(1).cache().shuffle(1000).prefetch(AUTOTUNE)
-
-    return dataset, classes
+    predictions = []
+    for image_names, face_images, pupil_windows, batch_labels in test_set:
+        face_predictions, pupil_predictions = predict(face_images, pupil_windows)
+        names.extend(name.decode("ascii") for name in image_names.numpy())
+        labels.append(batch_labels.numpy())
+        predictions.append(
+            fuse_predictions(face_predictions.numpy(), pupil_predictions.numpy(), pupil_columns)
+        )
+
+    return (
+        names,
+        np.concatenate(labels) if labels else np.empty(0, dtype=np.int32),
+        np.concatenate(predictions) if predictions else np.empty(0, dtype=np.int64),
+    )
 
 
 def create_confusion_matrix(labels, predictions, classes):
+    # Render the plot in the background, it is saved before the script exits
     cm = confusion_matrix(labels, predictions)
-    disp = ConfusionMatrixDisplay(cm, display_labels=classes)
-    disp.plot()
-    plt.title("Confusion Matrix")
-    plt.savefig(Path(__file__).parent / 'confusion_matrix.png')
+    get_plot_renderer().submit(
+        plot_confusion_matrix, Path(__file__).parent / 'confusion_matrix.png', cm, classes
+    )
 
 if __name__ == "__main__":
     # Disable annoying tensorflow warnings
@@ -118,10 +205,11 @@ if __name__ == "__main__":
 
     window_size = 100
     image_shape = (224, 224, 1)
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 32
 
     # Get the dataset and classes
     test_set, classes = get_data(
-        Path(sys.argv[1]), Path(sys.argv[2]), image_shape[0:2], window_size
+        Path(sys.argv[1]), Path(sys.argv[2]), image_shape[0:2], window_size, batch_size
     )
 
     input_shape = (window_size, 1)
@@ -135,43 +223,23 @@ if __name__ == "__main__":
     face_model.load_weights(face.BINARY_CHECKPOINT_PATH if len(classes) == 2 else face.MULTICLASS_CHECKPOINT_PATH).expect_partial()
     pupil_model.load_weights(pupil.CHECKPOINT_PATH).expect_partial()
 
-    # Get the accuracy on the test set
-    correct = 0
-    labels = []
-    predictions = {}
-    prediction_classes = set()
-    for image_name, face_image, pupil_window, label in test_set:
-        image = image_name.numpy()[0].decode('ascii')
-        face_prediction = face_model.predict(face_image, verbose=None)
-        pupil_prediction = pupil_model.predict(pupil_window, verbose=None)
-
-        if len(classes) != 2:
-            multiclass_pupil_prediction = []
-            for v in BINARY_EMOTIONS.values():
-                if v == "negative":
-                    multiclass_pupil_prediction.append(pupil_prediction[0][0])
-                else:
-                    multiclass_pupil_prediction.append(pupil_prediction[0][1])
-            pupil_prediction = multiclass_pupil_prediction
-
-        # Check that the label matches the emotion with the highest probability
-        prediction = np.argmax(face_prediction + pupil_prediction)
-        labels.append(label)
-        predictions[image] = prediction
-        prediction_classes.add(classes[label[0]])
-        prediction_classes.add(classes[prediction])
-        if prediction == label:
-            correct += 1
-        
-        print(f"Predicted {classes[prediction]} for {image}")
-
-    print(f"Test accuracy: {correct/len(test_set)}")
-    create_confusion_matrix(labels, list(predictions.values()), sorted(prediction_classes))
+    # Get the predictions on the test set
+    start = time.perf_counter()
+    names, labels, predictions = evaluate(face_model, pupil_model, test_set, classes)
+    elapsed = time.perf_counter() - start
+    for name, prediction in zip(names, predictions):
+        print(f"Predicted {classes[prediction]} for {name}")
+
+    # Check that the labels match the emotions with the highest probability
+    print(f"Test accuracy: {np.mean(predictions == labels)}")
+    print(f"Evaluated {len(names)} samples in {elapsed:.1f}s ({len(names) / elapsed:.1f} samples/s)")
+    prediction_classes = {classes[i] for i in np.concatenate([labels, predictions])}
+    create_confusion_matrix(labels, predictions, sorted(prediction_classes))
 
     # Save csv of predictions
     with open(PREDICTIONS_CSV, 'w') as f:
         writer = csv.DictWriter(f, ['image', 'prediction'])
         writer.writeheader()
 
-        for k, v in predictions.items():
-            writer.writerow({'image': k, 'prediction': classes[v]})
+        for name, prediction in zip(names, predictions):
+            writer.writerow({'image': name, 'prediction': classes[prediction]})
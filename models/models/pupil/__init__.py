@@ -1,2 +1,2 @@
 from models.pupil.test import CHECKPOINT_PATH
-from models.pupil.train import create_model, PERIOD
+from models.pupil.train import create_model, PERIOD, window_period
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+from scipy.interpolate import CubicSpline
+import tempfile
+import time
+
+from data_processing.face.process_data import TIMES_FILE_FORMAT
+from data_processing.pupil.process_data import OUTPUT_FILE_FORMAT, SEG_NAME_TO_EMOTION
+from data_processing.pupil.spline_store import convert_spline_files, find_spline_files
+from models.pupil.train import get_data, PERIOD
+
+
+def write_synthetic_cohort(
+    pkl_dir: Path,
+    face_dir: Path,
+    participants: int,
+    seconds: float,
+    frame_rate: float,
+    sample_rate: int = 150,
+):
+    """
+    Writes a pickled spline and a times file for every participant and emotion, with a
+    slowly varying pupil diameter sampled at sample_rate and frames at frame_rate.
+    """
+    rng = np.random.default_rng(496)
+    sample_times = np.arange(int(seconds * sample_rate)) / sample_rate
+    frame_times = np.arange(int(seconds * frame_rate)) / frame_rate
+
+    for p in range(participants):
+        inits = f"p{p:03d}"
+        for emotion in SEG_NAME_TO_EMOTION.values():
+            diameters = 25 + 3 * np.sin(2 * np.pi * sample_times / rng.uniform(5, 10))
+            spline = CubicSpline(sample_times, diameters + rng.normal(0, 0.2, len(diameters)))
+            with open(pkl_dir / OUTPUT_FILE_FORMAT.format(inits, emotion), "wb") as f:
+                pickle.dump(spline, f)
+
+            os.makedirs(face_dir / emotion, exist_ok=True)
+            with open(face_dir / emotion / TIMES_FILE_FORMAT.format(inits, emotion), "w") as f:
+                writer = csv.DictWriter(f, ["times"])
+                writer.writeheader()
+                writer.writerows({"times": float(t)} for t in frame_times)
+
+
+def get_windows_per_row(pkl_dir: Path, face_dir: Path, window_size: int):
+    """
+    The window generation of get_data before the spline store, which unpickles every spline
+    and evaluates a linspace of times for each row of the times files.
+    """
+    splines = {}
+    for (inits, emotion), file in find_spline_files(pkl_dir).items():
+        with open(pkl_dir / file, "rb") as f:
+            splines.setdefault(inits, {})[emotion] = pickle.load(f)
+
+    dilation_windows = []
+    labels = []
+    for i, label in enumerate(os.listdir(face_dir)):
+        for inits, init_splines in splines.items():
+            for emotion, spline in init_splines.items():
+                times_path = face_dir / label / TIMES_FILE_FORMAT.format(inits, emotion)
+                if not os.path.isfile(times_path):
+                    continue
+
+                with open(times_path, "r") as f:
+                    for row in csv.DictReader(f):
+                        end_time = float(row["times"])
+                        if end_time < PERIOD * window_size:
+                            continue
+
+                        times = np.linspace(end_time - PERIOD * window_size, end_time, window_size)
+                        dilation_windows.append(spline(times))
+                        labels.append(i)
+
+    return dilation_windows, labels
+
+
+def benchmark_get_data(pkl_dir: Path, face_dir: Path, window_size: int, batch_size: int):
+    """
+    Times the window generation per row against get_data, which converts the splines to a
+    spline store the first time and batches the windows of each segment, then against get_data
+    reading the windows from the window cache.
+    """
+    import tensorflow as tf
+
+    start = time.perf_counter()
+    dilation_windows, _ = get_windows_per_row(pkl_dir, face_dir, window_size)
+    tf.convert_to_tensor(dilation_windows)
+    print(f"per row: {time.perf_counter() - start:.2f}s, {len(dilation_windows)} windows")
+
+    start = time.perf_counter()
+    convert_spline_files(pkl_dir)
+    print(f"spline store conversion: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    dataset, _ = get_data(pkl_dir, face_dir, window_size, batch_size)
+    print(f"get_data: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    num_windows = sum(len(labels) for _, labels in dataset)
+    print(f"one epoch of the dataset: {time.perf_counter() - start:.2f}s, {num_windows} windows")
+
+    # A second call reads the windows from the window cache
+    start = time.perf_counter()
+    dataset, _ = get_data(pkl_dir, face_dir, window_size, batch_size)
+    print(f"get_data from the window cache: {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    num_windows = sum(len(labels) for _, labels in dataset)
+    print(f"one epoch of the cached dataset: {time.perf_counter() - start:.2f}s, {num_windows} windows")
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pupil window generation on a synthetic cohort."
+    )
+    parser.add_argument(
+        "-p", "--participants", type=int, default=100, help="Number of participants."
+    )
+    parser.add_argument(
+        "-s", "--seconds", type=float, default=60, help="Length of each video in seconds."
+    )
+    parser.add_argument(
+        "-r",
+        "--frame-rate",
+        type=float,
+        default=1,
+        help="Number of frames (and windows) per second of each video.",
+    )
+    parser.add_argument(
+        "-w", "--window-size", type=int, default=100, help="Number of samples per window."
+    )
+    parser.add_argument("-b", "--batch-size", type=int, default=32, help="Batch size.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        pkl_dir = Path(data_dir) / "pupil"
+        face_dir = Path(data_dir) / "face"
+        os.makedirs(pkl_dir)
+        write_synthetic_cohort(
+            pkl_dir, face_dir, args.participants, args.seconds, args.frame_rate
+        )
+        benchmark_get_data(pkl_dir, face_dir, args.window_size, args.batch_size)
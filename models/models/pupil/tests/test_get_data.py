@@ -0,0 +1,75 @@
+import numpy as np
+from scipy.interpolate import CubicSpline
+import tensorflow as tf
+
+from data_processing.face.tests.test_sample_index import write_times
+from data_processing.pupil.spline_store import write_spline_store
+from models.pupil.train import get_data, PERIOD
+
+
+def make_dataset(tmp_path, times):
+    """
+    Writes a spline and a times file per class, with the spline only increasing for one
+    of them.
+    """
+    t = np.linspace(0, times[-1], 4 * len(times))
+    splines = {
+        "happy": CubicSpline(t, 25 + np.sin(t)),
+        "sad": CubicSpline(t, 20 - np.sin(t)),
+    }
+    pkl_dir = tmp_path / "pupil"
+    write_spline_store(pkl_dir, [("cs", emotion, spline) for emotion, spline in splines.items()])
+
+    face_dir = tmp_path / "train"
+    write_times(face_dir / "positive", "cs", "happy", times)
+    write_times(face_dir / "negative", "cs", "sad", times)
+    return pkl_dir, face_dir, splines
+
+
+def test_get_data_window_spacing(tmp_path):
+    times = [float(t) for t in range(1, 9)]
+    pkl_dir, face_dir, splines = make_dataset(tmp_path, times)
+    window_size = 100
+
+    dataset, classes = get_data(
+        pkl_dir, face_dir, window_size, batch_size=4, cache_dir=tmp_path / "cache"
+    )
+
+    # The windows are the ones the checkpoints were trained on, evaluated at
+    # np.linspace(end_time - PERIOD * window_size, end_time, window_size)
+    references = {
+        classes.index(label): np.array([
+            splines[emotion](np.linspace(end - PERIOD * window_size, end, window_size))
+            for end in times
+        ])
+        for label, emotion in (("negative", "sad"), ("positive", "happy"))
+    }
+    num_windows = 0
+    for windows, labels in dataset.as_numpy_iterator():
+        for window, label in zip(windows, labels):
+            errors = np.abs(references[label] - window).max(axis=1)
+            assert errors.min() < 1e-4
+            num_windows += 1
+    assert num_windows == 2 * len(times)
+
+
+def test_get_data_mixes_classes(tmp_path):
+    # The windows are cached segment by segment, so all the windows of a class are contiguous
+    times = [float(t) for t in range(1, 33)]
+    pkl_dir, face_dir, _ = make_dataset(tmp_path, times)
+
+    tf.random.set_seed(496)
+    dataset, classes = get_data(
+        pkl_dir, face_dir, window_size=100, batch_size=16, cache_dir=tmp_path / "cache"
+    )
+
+    # The samples are shuffled before they are batched, so the batches are not single-class,
+    # and every sample is read once per epoch
+    labels = []
+    for windows, batch_labels in dataset.as_numpy_iterator():
+        assert len(set(batch_labels.tolist())) == 2
+        # The happy windows are all above the sad ones
+        positive = batch_labels == classes.index("positive")
+        assert windows[positive].min() > windows[~positive].max()
+        labels.extend(batch_labels.tolist())
+    assert sorted(labels) == [0] * 32 + [1] * 32
@@ -0,0 +1,115 @@
+import numpy as np
+from pathlib import Path
+from scipy.interpolate import CubicSpline
+import shutil
+
+from data_processing.face.tests.test_sample_index import write_times
+from data_processing.pupil.spline_store import write_spline_store
+from models.pupil.window_cache import WindowCache, window_cache_key
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def make_dataset():
+    data_dir = test_files_dir / "window_cache"
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    pkl_dir = data_dir / "pupil"
+    pkl_dir.mkdir(parents=True)
+    t = np.linspace(0, 10, 11)
+    write_spline_store(
+        pkl_dir,
+        [("cs", "happy", CubicSpline(t, 25 + t)), ("cs", "sad", CubicSpline(t, 25 - t))],
+    )
+
+    face_dir = data_dir / "train"
+    write_times(face_dir / "positive", "cs", "happy", [2.0, 3.0])
+    write_times(face_dir / "negative", "cs", "sad", [4.0])
+    return pkl_dir, face_dir
+
+
+def build(cache: WindowCache, windows: np.ndarray, labels: np.ndarray):
+    cached_windows, cached_labels = cache.create(*windows.shape)
+    cached_windows[:] = windows
+    cached_labels[:] = labels
+    return cached_windows, cached_labels
+
+
+def test_window_cache():
+    pkl_dir, face_dir = make_dataset()
+    cache_dir = pkl_dir / "window_cache"
+    key = window_cache_key(pkl_dir, face_dir, 4, 0.01)
+    windows = np.arange(12, dtype=np.float32).reshape(3, 4)
+    labels = np.array([1, 1, 0], dtype=np.int32)
+    classes = ["negative", "positive"]
+
+    cache = WindowCache(cache_dir, key)
+    assert cache.load() is None
+
+    # A build that is not saved, e.g. because it was interrupted, is not used
+    cached_windows, cached_labels = build(cache, windows, labels)
+    assert WindowCache(cache_dir, key).load() is None
+
+    # A later run with the same key gets the memory-mapped windows of the first build
+    cache.save(cached_windows, cached_labels, classes)
+    loaded_windows, loaded_labels, loaded_classes = WindowCache(cache_dir, key).load()
+    assert isinstance(loaded_windows, np.memmap)
+    assert isinstance(loaded_labels, np.memmap)
+    assert np.array_equal(loaded_windows, windows)
+    assert np.array_equal(loaded_labels, labels)
+    assert loaded_classes == classes
+    assert window_cache_key(pkl_dir, face_dir, 4, 0.01) == key
+
+    # Rebuilding the same key invalidates it until the new build is saved
+    WindowCache(cache_dir, key).create(*windows.shape)
+    assert WindowCache(cache_dir, key).load() is None
+
+
+def test_window_cache_key():
+    pkl_dir, face_dir = make_dataset()
+    key = window_cache_key(pkl_dir, face_dir, 4, 0.01)
+
+    # The window parameters are part of the key
+    assert window_cache_key(pkl_dir, face_dir, 5, 0.01) != key
+    assert window_cache_key(pkl_dir, face_dir, 4, 0.02) != key
+
+    # Rewriting a times file changes the key
+    write_times(face_dir / "negative", "cs", "sad", [4.0, 5.0])
+    new_key = window_cache_key(pkl_dir, face_dir, 4, 0.01)
+    assert new_key != key
+
+    # A new times file for another participant changes it too
+    write_times(face_dir / "negative", "mf", "sad", [4.0])
+    assert window_cache_key(pkl_dir, face_dir, 4, 0.01) != new_key
+
+
+def test_window_cache_eviction():
+    pkl_dir, face_dir = make_dataset()
+    other_face_dir = face_dir.parent / "val"
+    write_times(other_face_dir / "positive", "cs", "happy", [5.0])
+    cache_dir = pkl_dir / "window_cache"
+    windows = np.zeros((1, 4), dtype=np.float32)
+    labels = np.zeros(1, dtype=np.int32)
+
+    def save(face_dir, window_size):
+        cache = WindowCache(
+            cache_dir, window_cache_key(pkl_dir, face_dir, window_size, 0.01), pkl_dir, face_dir
+        )
+        cache.save(*build(cache, windows, labels), ["positive"])
+        return cache
+
+    old = save(face_dir, 4)
+    other = save(other_face_dir, 4)
+
+    # A new entry of the same directories evicts the old one, but not the other dataset's
+    write_times(face_dir / "negative", "cs", "sad", [4.0, 5.0])
+    new = save(face_dir, 4)
+    assert old.load() is None
+    assert not old.windows_path.exists() and not old.labels_path.exists()
+    assert new.load() is not None
+    assert other.load() is not None
+
+    # So does an entry with other window parameters
+    assert save(face_dir, 5).load() is not None
+    assert new.load() is None
+    assert len(list(cache_dir.glob("windows_*.json"))) == 2
@@ -1,9 +1,5 @@
-import csv
 import numpy as np
-import os
 from pathlib import Path
-import pickle
-import re
 import sys
 import tensorflow as tf
 from tensorflow.data import AUTOTUNE, Dataset
@@ -18,10 +14,12 @@ from tensorflow.keras.layers import (
     LSTM,
     Rescaling,
 )
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 
-from data_processing.face.process_data import TIMES_FILE_FORMAT
+from data_processing.face.sample_index import load_sample_index
+from data_processing.pupil.spline_store import load_spline_store
+from models.pupil.window_cache import WINDOW_CACHE_DIR, WindowCache, window_cache_key
 
 
 CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/binary-{epoch:03d}.ckpt"
@@ -29,68 +27,127 @@ MAX_PUPIL_DILATION = 30
 PERIOD = 0.01 #s
 
 
-def get_data(pkl_dir: Path, face_dir: Path, window_size: int = 100, batch_size: int = 32):
+def window_period(window_size: int) -> float:
     """
-    Get the functions from the .pkl files and timestamps from the face directories, then create the dataset.
+    Returns the time between the samples of a window, which spans window_size * PERIOD seconds
+    up to its end time, like np.linspace(end_time - PERIOD * window_size, end_time, window_size).
+    The checkpoints were trained on windows with this spacing.
+    """
+    return PERIOD * window_size / (window_size - 1)
+
+
+def windows_dataset(windows: np.ndarray, labels: np.ndarray, batch_size: int) -> Dataset:
+    """
+    Creates a dataset of shuffled batches of the windows and labels.
+    The samples are shuffled before they are batched, and each batch is gathered from the
+    (memory-mapped) arrays as it is read, instead of copying the arrays into the dataset.
+    """
+    def get_batch(indices):
+        indices = np.sort(indices)
+        return windows[indices], labels[indices]
+
+    def read_batch(indices):
+        batch_windows, batch_labels = tf.numpy_function(
+            get_batch, [indices], (tf.float32, tf.int32)
+        )
+        batch_windows.set_shape((None, windows.shape[1]))
+        batch_labels.set_shape((None,))
+        return batch_windows, batch_labels
+
+    dataset = Dataset.range(len(windows)).shuffle(max(len(windows), 1)).batch(batch_size)
+    return dataset.map(read_batch, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+
+def get_windows(
+    pkl_dir: Path,
+    face_dir: Path,
+    window_size: int = 100,
+    cache_dir: Optional[Path] = None,
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Get the splines from the spline store of the .pkl files and timestamps from the face directories,
+    then take the window of every sample.
+
+    Args:
+        pkl_dir: The path to the directory of .pkl files containing the pupillometry splines.
+            They are converted to a spline store the first time if there is none.
+            The splines are sampled once every window_period(window_size), and the windows are
+            taken from the samples.
+        face_dir: The path to the directory of face images (for getting the times files from its
+            sample index)
+        window_size: The number of data samples to be considered at a time.
+        cache_dir: The directory the windows are cached in, pkl_dir/window_cache by default.
+            The cached windows are read from disk by later runs, until the splines, the times
+            files or window_size change, and only the latest windows of the directories are kept.
+
+    Returns:
+        The memory-mapped windows and labels, with the windows of each times file contiguous,
+        and the label classes.
+    """
+    # Open the splines of every participant and emotion
+    splines = load_spline_store(pkl_dir)
+
+    # Read the windows from the cache if they were already generated
+    cache = WindowCache(
+        cache_dir or pkl_dir / WINDOW_CACHE_DIR,
+        window_cache_key(pkl_dir, face_dir, window_size, window_period(window_size)),
+        pkl_dir,
+        face_dir,
+    )
+    if cached := cache.load():
+        return cached
+
+    # Get the times of the windows of each participant and emotion from the sample index
+    samples = load_sample_index(face_dir)
+    segments = []
+    for label, inits, emotion, segment in samples.segments():
+        spline_index = splines.find(inits, emotion)
+        if spline_index < 0:
+            continue
+
+        # Only generate windows for the times that have a full window before them
+        end_times = segment.times[segment.times >= PERIOD * window_size]
+        if len(end_times):
+            segments.append((spline_index, end_times, samples.classes.index(label)))
+
+    # Take the windows of each segment from its resampled spline into the cache
+    num_windows = sum(len(end_times) for _, end_times, _ in segments)
+    dilation_windows, labels = cache.create(num_windows, window_size)
+    start = 0
+    for spline_index, end_times, i in segments:
+        end = start + len(end_times)
+        resampled = splines.resample(spline_index, end_times.max(), window_period(window_size))
+        resampled.windows(end_times, window_size, out=dilation_windows[start:end])
+        labels[start:end] = i
+        start = end
+    cache.save(dilation_windows, labels, samples.classes)
+
+    return dilation_windows, labels, samples.classes
+
+
+def get_data(
+    pkl_dir: Path,
+    face_dir: Path,
+    window_size: int = 100,
+    batch_size: int = 32,
+    cache_dir: Optional[Path] = None,
+):
+    """
+    Get the windows of the face directory (see get_windows), then create the dataset.
 
     Args:
         pkl_dir: The path to the directory of .pkl files containing the pupillometry splines.
-        face_dir: The path to the directory of face images (for getting the times files)
+        face_dir: The path to the directory of face images (for getting the times files from its
+            sample index)
         window_size: The number of data samples to be considered at a time.
         batch_size: The batch size to be used in the training.
+        cache_dir: The directory the windows are cached in, pkl_dir/window_cache by default.
 
     Returns:
         The dataset and the label classes.
     """
-    # Read the splines from the pkl files
-    splines = {}
-    for file in os.listdir(pkl_dir):
-        # Check if the file is a pkl with the correct format
-        if match := re.search(r"pupil_(?P<inits>\w+)_(?P<emotion>\w+).pkl$", str(file)):
-            emotion = match["emotion"]
-            inits = match["inits"]
-
-            if match["inits"] not in splines:
-                splines[match["inits"]] = {}
-
-            with open(pkl_dir / file, 'rb') as f:
-                splines[inits][emotion] = pickle.load(f)
-
-    # Generate the dilations_windows, labels, and classes
-    dilation_windows = []
-    labels = []
-    classes = []
-    for i, label in enumerate(os.listdir(face_dir)):
-        classes.append(label)
-        for inits, init_splines in splines.items():
-            for emotion, spline in init_splines.items():
-                # Get the times file for this inits + emotion combination
-                times_path = face_dir / label / TIMES_FILE_FORMAT.format(inits, emotion)
-                if not os.path.isfile(times_path):
-                    continue
-
-                with open(times_path, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Check if a window can be generated for this time
-                        end_time = float(row["times"])
-                        if end_time < PERIOD * window_size:
-                            continue
-
-                        # Generate a window for this time
-                        times = np.linspace(end_time - PERIOD * window_size, end_time, window_size)
-                        dilation_windows.append(spline(times))
-                        labels.append(i)
-
-    # Convert the dilations and labels to a tensor dataset
-    dilations_t = tf.convert_to_tensor(dilation_windows)
-    labels_t = tf.convert_to_tensor(labels)
-    dataset = Dataset.from_tensor_slices((dilations_t, labels_t))
-
-    # Prefetch datasets
-    dataset = dataset.batch(batch_size).cache().shuffle(1000).prefetch(AUTOTUNE)
-
-    return dataset, classes
+    dilation_windows, labels, classes = get_windows(pkl_dir, face_dir, window_size, cache_dir)
+    return windows_dataset(dilation_windows, labels, batch_size), classes
 
 
 def create_model(num_classes: int, input_shape: Optional[Tuple[int, int]] = None):
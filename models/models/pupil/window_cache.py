@@ -0,0 +1,135 @@
+import hashlib
+import json
+import numpy as np
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from data_processing.face.sample_index import dataset_identity
+from data_processing.manifest import file_identity
+from data_processing.pupil.spline_store import spline_store_paths
+
+WINDOW_CACHE_DIR = "window_cache"
+
+
+def window_cache_key(pkl_dir: Path, face_dir: Path, window_size: int, period: float) -> str:
+    """
+    Returns the key of the windows of the face directory, which changes when the spline store,
+    a times file or the window parameters change.
+    """
+    key = {
+        "pkl_dir": str(Path(pkl_dir).resolve()),
+        "face_dir": str(Path(face_dir).resolve()),
+        "splines": [file_identity(path) for path in spline_store_paths(pkl_dir)],
+        "times": dataset_identity(face_dir),
+        "window_size": window_size,
+        "period": period,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def window_cache_paths(cache_dir: Path, key: str) -> Tuple[Path, Path, Path]:
+    """
+    Returns the windows, labels and info paths of the cache entry of the key.
+    """
+    return (
+        cache_dir / f"windows_{key}.npy",
+        cache_dir / f"labels_{key}.npy",
+        cache_dir / f"windows_{key}.json",
+    )
+
+
+class WindowCache:
+    """
+    The windows and labels of a dataset saved to .npy files, with a .json file of its classes.
+    The .json file is written last, so that an interrupted write is not used.
+    If the pupil and face directories of the dataset are given, they are recorded in the
+    .json file, and saving the windows evicts the older entries of the same directories, so
+    that the cache holds at most one entry per dataset.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        key: str,
+        pkl_dir: Optional[Path] = None,
+        face_dir: Optional[Path] = None,
+    ):
+        self.cache_dir = cache_dir
+        self.key = key
+        self.windows_path, self.labels_path, self.info_path = window_cache_paths(
+            cache_dir, key
+        )
+        self.dirs = None
+        if pkl_dir is not None and face_dir is not None:
+            self.dirs = {
+                "pkl_dir": str(Path(pkl_dir).resolve()),
+                "face_dir": str(Path(face_dir).resolve()),
+            }
+
+    def load(self) -> Optional[Tuple[np.ndarray, np.ndarray, List[str]]]:
+        """
+        Returns the memory-mapped windows and labels and the classes, or None if they are
+        not cached.
+        """
+        if not self.info_path.is_file():
+            return None
+
+        with open(self.info_path, "r") as f:
+            classes = json.load(f)["classes"]
+
+        return (
+            np.load(self.windows_path, mmap_mode="r"),
+            np.load(self.labels_path, mmap_mode="r"),
+            classes,
+        )
+
+    def create(self, num_windows: int, window_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Creates the memory-mapped windows and labels files, to be filled then saved.
+        """
+        os.makedirs(self.windows_path.parent, exist_ok=True)
+        if self.info_path.is_file():
+            os.remove(self.info_path)
+
+        return (
+            np.lib.format.open_memmap(
+                self.windows_path, "w+", np.float32, (num_windows, window_size)
+            ),
+            np.lib.format.open_memmap(self.labels_path, "w+", np.int32, (num_windows,)),
+        )
+
+    def save(self, windows: np.ndarray, labels: np.ndarray, classes: List[str]):
+        """
+        Flushes the windows and labels created by create, and marks them as cached.
+        """
+        windows.flush()
+        labels.flush()
+        with open(self.info_path, "w") as f:
+            json.dump({"classes": classes, "windows": len(windows), **(self.dirs or {})}, f)
+
+        if self.dirs is not None:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the other entries of the same pupil and face directories, which are out of date
+        or were built with other window parameters.
+        """
+        for info_path in self.cache_dir.glob("windows_*.json"):
+            key = info_path.stem[len("windows_"):]
+            if key == self.key:
+                continue
+
+            try:
+                with open(info_path, "r") as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if all(info.get(name) == value for name, value in self.dirs.items()):
+                # Remove the info file first, so that a partial removal is not used
+                windows_path, labels_path, _ = window_cache_paths(self.cache_dir, key)
+                for path in (info_path, windows_path, labels_path):
+                    if path.is_file():
+                        os.remove(path)
@@ -0,0 +1,37 @@
+import tensorflow as tf
+from tensorflow.keras.layers import Dropout, Input, RandomFlip
+from tensorflow.keras.models import Sequential
+
+# The layers that only change the inputs in training
+TRAINING_ONLY_LAYERS = (Dropout, RandomFlip)
+
+
+def create_inference_model(model: Sequential) -> Sequential:
+    """
+    Returns a model with the layers of a trained model, without the training-only layers.
+    The layers are shared with the trained model, so it uses its (loaded) weights.
+    """
+    return Sequential(
+        [Input(model.input_shape[1:], dtype=model.inputs[0].dtype)]
+        + [layer for layer in model.layers if not isinstance(layer, TRAINING_ONLY_LAYERS)]
+    )
+
+
+def create_serving_function(model: Sequential, jit_compile: bool = False):
+    """
+    Returns the forward pass of the inference model of a trained model, as a tf.function with
+    a fixed signature of a batch of inputs, so that it is only traced once.
+    With jit_compile, the function is compiled with XLA (on the CPU too), once per batch size.
+    """
+    inference_model = create_inference_model(model)
+
+    @tf.function(
+        input_signature=[
+            tf.TensorSpec((None, *model.input_shape[1:]), model.inputs[0].dtype)
+        ],
+        jit_compile=jit_compile,
+    )
+    def serve(inputs):
+        return inference_model(inputs, training=False)
+
+    return serve
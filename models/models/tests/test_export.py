@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from models.export import (
+    compare_predictions,
+    convert_model,
+    dequantize,
+    quantize,
+    report_name,
+    spread_samples,
+    TFLiteModel,
+)
+
+
+def test_quantize_round_trip():
+    details = {"dtype": np.int8, "quantization": (0.05, -3)}
+    inputs = np.linspace(-6, 6, 101, dtype=np.float32)
+
+    quantized = quantize(inputs, details)
+    assert quantized.dtype == np.int8
+
+    # The values in the range of the int8 values come back to within half a step, and the
+    # others are clipped to the ends of the range
+    outputs = dequantize(quantized, details)
+    in_range = (inputs >= (-128 + 3) * 0.05) & (inputs <= (127 + 3) * 0.05)
+    assert np.all(np.abs(outputs[in_range] - inputs[in_range]) <= 0.025 + 1e-6)
+    assert np.allclose(outputs[~in_range], np.where(inputs[~in_range] < 0, -6.25, 6.5))
+
+    # The float variants are only cast
+    float_details = {"dtype": np.float32, "quantization": (0.0, 0)}
+    assert np.array_equal(quantize(inputs, float_details), inputs)
+    assert np.array_equal(dequantize(inputs, float_details), inputs)
+
+
+@pytest.mark.parametrize("variant", ["dynamic", "int8"])
+def test_tflite_model(tmp_path, variant):
+    model = tf.keras.Sequential(
+        [tf.keras.layers.Input((4,)), tf.keras.layers.Dense(3, "softmax")]
+    )
+    samples = np.random.default_rng(496).normal(size=(50, 4)).astype(np.float32)
+
+    path = tmp_path / "model.tflite"
+    path.write_bytes(convert_model(model, variant, samples))
+    tflite_model = TFLiteModel(path)
+
+    # The probabilities of the quantized model are close to those of the Keras model
+    for sample in samples[:10]:
+        outputs = tflite_model(sample[np.newaxis])
+        assert outputs.dtype == np.float32
+        assert np.allclose(outputs, model(sample[np.newaxis]).numpy(), atol=0.05)
+
+
+def test_compare_predictions():
+    labels = np.array([0, 1, 1, 0, 0, 0])
+    report = compare_predictions(
+        labels,
+        {
+            "keras": np.array([0, 1, 0, 0, 0, 1]),
+            # Two samples move to another cell of the confusion matrix
+            "moved": np.array([1, 1, 0, 1, 0, 1]),
+            # Two samples of the same label swap predictions, which leaves the matrix as is
+            "swapped": np.array([0, 1, 0, 0, 1, 0]),
+        },
+        2,
+    )
+
+    assert report["keras"] == {"accuracy": 4 / 6, "changed": 0.0, "drift": 0}
+    assert report["moved"] == {"accuracy": 2 / 6, "changed": 2 / 6, "drift": 2}
+    assert report["swapped"] == {"accuracy": 4 / 6, "changed": 2 / 6, "drift": 0}
+
+
+def test_spread_samples():
+    # Two contiguous segments, which the first samples would not both cover
+    samples = np.repeat([0, 1], 500)
+
+    spread = spread_samples(samples, 10)
+    assert len(spread) == 10
+    assert np.count_nonzero(spread) == 5
+
+    # There are at most as many samples as the array has
+    assert np.array_equal(spread_samples(samples[:3], 10), samples[:3])
+    assert len(spread_samples(samples[:0], 10)) == 0
+
+
+def test_report_name():
+    # The variants with a model that runs in Keras are named after it
+    assert report_name("float16") == "float16+keras_pupil"
+    assert report_name("int8") == "int8"
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+from data_processing.face.frame_stack import write_frame_stack
+from data_processing.face.image_store import load_image_store
+from data_processing.face.sample_index import load_sample_index
+from data_processing.face.tests.test_sample_index import write_times
+from data_processing.pupil.spline_store import write_spline_store
+from models.fusion import get_data
+
+
+def test_get_data_images_match_image_store(tmp_path):
+    # A png dataset and a frame stack dataset, with images that are not the model input size
+    times = [1.0, 2.0, 3.0]
+    rng = np.random.default_rng(496)
+    face_dir = tmp_path / "test"
+    write_times(face_dir / "positive", "cs", "happy", times)
+    for time in times:
+        image = rng.integers(0, 256, (37, 53, 3), dtype=np.uint8)
+        cv2.imwrite(str(face_dir / "positive" / f"cs_happy_{time}_c.png"), image)
+    write_times(face_dir / "negative", "cs", "sad", times)
+    write_frame_stack(
+        face_dir / "negative",
+        "cs_sad",
+        [(time, rng.integers(0, 256, (41, 29), dtype=np.uint8)) for time in times],
+    )
+
+    pkl_dir = tmp_path / "pupil"
+    t = np.linspace(0, 4, 9)
+    write_spline_store(
+        pkl_dir, [("cs", emotion, CubicSpline(t, 25 + t)) for emotion in ("happy", "sad")]
+    )
+
+    image_shape = (16, 24)
+    test_set, _ = get_data(pkl_dir, face_dir, image_shape, window_size=10, batch_size=2)
+
+    # The images are the same as the image store's, which the face model is trained on
+    image_store = load_image_store(face_dir, image_shape)
+    stored = dict(zip(load_sample_index(face_dir).image_names(), image_store.images))
+    num_images = 0
+    for names, images, _, _ in test_set.as_numpy_iterator():
+        assert images.dtype == np.float32
+        for name, image in zip(names, images):
+            assert np.array_equal(image, stored[name.decode()].astype(np.float32))
+            num_images += 1
+    assert num_images == 2 * len(times)